@@ -0,0 +1,291 @@
+import io
+import csv
+import math
+import random
+
+# Synthetic stand-ins for every upstream source, shaped like the real
+# responses the fetchers parse. Everything is derived from a seed, so a size
+# and seed always produce the same payloads.
+
+# Counties laid out as a grid over each state's extent (xmin, ymin, xmax, ymax)
+STATES = {
+    'WA': {
+        'bbox': (-124.85, 45.54, -116.91, 49.00),
+        'fips': '53',
+        'grid': (6, 4),
+        'first_zip': 98001,
+        'counties': ['Clallam', 'Jefferson', 'Snohomish', 'Skagit', 'Okanogan', 'Stevens',
+                     'Grays Harbor', 'Mason', 'King', 'Chelan', 'Lincoln', 'Spokane',
+                     'Pacific', 'Lewis', 'Kittitas', 'Grant', 'Adams', 'Whitman',
+                     'Wahkiakum', 'Skamania', 'Yakima', 'Benton', 'Walla Walla', 'Asotin']
+    },
+    'MT': {
+        'bbox': (-116.05, 44.36, -104.04, 49.00),
+        'fips': '30',
+        'grid': (3, 2),
+        'first_zip': 59001,
+        'counties': ['Flathead', 'Cascade', 'Yellowstone', 'Missoula', 'Lewis and Clark', 'Gallatin']
+    },
+    'ID': {
+        'bbox': (-117.24, 41.99, -111.04, 49.00),
+        'fips': '16',
+        'grid': (2, 3),
+        'first_zip': 83201,
+        'counties': ['Ada', 'Bannock', 'Canyon', 'Twin Falls', 'Kootenai', 'Bonner']
+    }
+}
+
+ZIPS_PER_COUNTY = 4
+
+# Layer sizes as a share of the benchmark size (the largest layers get all of it)
+LAYER_SHARES = {
+    'ecology': 1.0,
+    'tri': 1.0,
+    'towers': 1.0,
+    'wa_mines': 0.25,
+    'wa_iaml': 0.25,
+    'wa_hazard_points': 0.05,     # per point layer
+    'wa_hazard_polygons': 0.01,   # per polygon layer
+    'other_state': 0.25,          # MT/ID mines, ID DEQ PCI, MT/ID TRI
+    'id_landfills': 0.05
+}
+
+# Chemical rows per TRI facility
+TRI_CHEMICALS_PER_FACILITY = 3
+
+# Vertices in each synthetic rock polygon
+POLYGON_VERTICES = 40
+
+TRI_HEADER = ['1. YEAR', '2. TRIFD', '3. FRS ID', '4. FACILITY NAME', '5. STREET ADDRESS', '6. CITY', '7. COUNTY',
+              '8. ST', '9. ZIP', '12. LATITUDE', '13. LONGITUDE', '37. CHEMICAL', '46. CARCINOGEN',
+              '107. TOTAL RELEASES']
+
+CHEMICALS = ['LEAD', 'MERCURY', 'BENZENE', 'TOLUENE', 'AMMONIA', 'ARSENIC', 'XYLENE', 'ZINC COMPOUNDS']
+
+# ArcGIS layers by URL (host + path, without /query)
+DNR_MINES_LAYER = 'gis.dnr.wa.gov/site1/rest/services/Public_Geology/Active_Surface_Mine_Permit_Sites/MapServer/0'
+DNR_MINERALS_SERVICE = 'gis.dnr.wa.gov/site1/rest/services/Public_Geology/Mines_and_Minerals/MapServer'
+MT_MINES_LAYER = 'services9.arcgis.com/QjBb6o7pu37CDH58/arcgis/rest/services/Mine_MBMG2006_shp/FeatureServer/0'
+ID_MINES_LAYER = 'services.arcgis.com/WLhB60Nqwp4NnHz3/arcgis/rest/services/Mines/FeatureServer/0'
+ID_DEQ_SERVICE = 'mapcase.deq.idaho.gov/arcgis/rest/services/SWA_PCI_WMS/MapServer'
+TIGER_COUNTY_LAYER = 'tigerweb.geo.census.gov/arcgis/rest/services/TIGERweb/State_County/MapServer/1'
+TOWERS_LAYER = 'services.arcgis.com/HIFLD/arcgis/rest/services/FM_Transmission_Towers/FeatureServer/0'
+
+HAZARD_POINT_LAYERS = (14, 15, 16, 17, 20)
+HAZARD_POLYGON_LAYERS = (18, 21)
+
+# maxRecordCount of MapServer (on-premises) and FeatureServer (ArcGIS Online) layers
+MAPSERVER_MAX_RECORDS = 1000
+FEATURESERVER_MAX_RECORDS = 2000
+
+def build_fixtures(features=1000, seed=0, pad=0):
+    """
+    Builds every upstream payload for a benchmark of the given size.
+    pad adds that many characters to one free-text attribute per record, to
+    test larger payloads at the same feature count.
+
+    Returns {'counties', 'zips', 'ecology', 'tri_csv', 'towers', 'layers'}:
+    counties is {state: [(name, bbox)]}, zips is {zip: entry}, tri_csv is
+    {state: bytes} and layers is {layer URL: layer} (see _layer).
+    """
+    rng = random.Random(seed)
+    filler = 'x' * pad
+    counties = {state: _county_grid(spec) for state, spec in STATES.items()}
+    zips = _zips(counties)
+    zips_by_county = {}
+    for code, entry in zips.items():
+        zips_by_county.setdefault((entry['state'], entry['county']), []).append(code)
+
+    def place(state):
+        name, bbox = rng.choice(counties[state])
+        return name, round(rng.uniform(bbox[0], bbox[2]), 6), round(rng.uniform(bbox[1], bbox[3]), 6)
+
+    def count(share):
+        return max(1, int(features * LAYER_SHARES[share]))
+
+    ecology = []
+    for i in range(count('ecology')):
+        county, lon, lat = place('WA')
+        ecology.append({
+            'CleanupSiteID': i + 1,
+            'SiteName': f"Cleanup Site {i + 1}",
+            'Address': f"{rng.randint(1, 9999)} Main St",
+            'City': f"{county} City",
+            'County': county,
+            'ZipCode': rng.choice(zips_by_county[('WA', county)]),
+            'Latitude': lat,
+            'Longitude': lon,
+            'SiteStatus': rng.choice(['Cleanup Started', 'Awaiting Cleanup', 'No Further Action']),
+            'SiteRank': rng.randint(1, 5),
+            'Contaminants': [{'ContaminantName': rng.choice(CHEMICALS), 'GroundWater': rng.random() < 0.5,
+                              'SurfaceWater': False, 'Soil': rng.random() < 0.5, 'Air': False, 'Notes': filler}]
+        })
+
+    tri_csv = {}
+    for state in STATES:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(TRI_HEADER)
+        for i in range(count('tri' if state == 'WA' else 'other_state')):
+            county, lon, lat = place(state)
+            zipcode = rng.choice(zips_by_county[(state, county)])
+            for chemical in rng.sample(CHEMICALS, TRI_CHEMICALS_PER_FACILITY):
+                writer.writerow([2023, f"{state}TRI{i:07d}", f"1100{i:08d}", f"Facility {i + 1}{filler}",
+                                 f"{rng.randint(1, 9999)} Industrial Way", f"{county} City", county.upper(), state,
+                                 f"{zipcode}-{rng.randint(1000, 9999)}" if rng.random() < 0.3 else zipcode,
+                                 lat, lon, chemical, rng.choice(['YES', 'NO']), round(rng.uniform(0, 50000), 1)])
+        tri_csv[state] = buffer.getvalue().encode('utf-8')
+
+    towers = []
+    for i in range(count('towers')):
+        _, lon, lat = place(rng.choice(list(STATES)))
+        towers.append(({'CALLSIGN': f"K{i:06d}", 'LICENSEE': f"Broadcaster {i % 500}{filler}",
+                        'ERP': round(rng.uniform(0.1, 100), 2)}, lon, lat))
+
+    layers = {}
+
+    mines = []
+    for i in range(count('wa_mines')):
+        county, lon, lat = place('WA')
+        mines.append(({'MINE_NAME': f"Mine {i + 1}", 'LATITUDE': lat, 'LONGITUDE': lon, 'COUNTY_NAME': county,
+                       'APPLICANT_NAME': f"Aggregates Co {i % 300}{filler}", 'COMMODITY_DESC': 'Sand and Gravel',
+                       'MINE_PERMIT_NUMBER': f"{70000 + i}"}, _point(lon, lat)))
+    layers[DNR_MINES_LAYER] = _layer('Active Surface Mine Permit Sites', 'esriGeometryPoint', mines,
+                                     MAPSERVER_MAX_RECORDS)
+
+    iaml = []
+    for i in range(count('wa_iaml')):
+        county, lon, lat = place('WA')
+        iaml.append(({'SITE_NAME': f"Inactive Mine {i + 1}", 'LATITUDE': lat, 'LONGITUDE': lon, 'COUNTY': county,
+                      'COMMODITY': rng.choice(['Gold', 'Silver', 'Copper', 'Coal']), 'COMMENT': f"Adit{filler}"},
+                     _point(lon, lat)))
+    layers[f"{DNR_MINERALS_SERVICE}/8"] = _layer('IAML Sites', 'esriGeometryPoint', iaml, MAPSERVER_MAX_RECORDS)
+
+    for layer_id in HAZARD_POINT_LAYERS:
+        points = []
+        for i in range(count('wa_hazard_points')):
+            county, lon, lat = place('WA')
+            points.append(({'SITE_NAME': f"Occurrence {layer_id}-{i + 1}", 'LITHOLOGY': 'Serpentinite',
+                            'COMMODITY': f"Asbestos{filler}", 'COUNTY': county}, _point(lon, lat)))
+        layers[f"{DNR_MINERALS_SERVICE}/{layer_id}"] = _layer(f"Layer {layer_id}", 'esriGeometryPoint', points,
+                                                              MAPSERVER_MAX_RECORDS)
+
+    for layer_id in HAZARD_POLYGON_LAYERS:
+        polygons = []
+        for i in range(count('wa_hazard_polygons')):
+            _, lon, lat = place('WA')
+            polygons.append(({'NAMED_UNITS': f"Unit {layer_id}-{i + 1}", 'LITHOLOGY': f"Ultramafic{filler}"},
+                             {'rings': [_blob(rng, lon, lat)]}))
+        # Rock polygons have no COUNTY field, like the real layers
+        layers[f"{DNR_MINERALS_SERVICE}/{layer_id}"] = _layer(f"Layer {layer_id}", 'esriGeometryPolygon', polygons,
+                                                              MAPSERVER_MAX_RECORDS)
+
+    mt_mines = []
+    for i in range(count('other_state')):
+        county, lon, lat = place('MT')
+        mt_mines.append(({'Name': f"MT Mine {i + 1}", 'DLAT': lat, 'DLONG': lon, 'County': county,
+                          'Prop_Type': 'Mine', 'Status': 'Past Producer', 'Com': f"Au{filler}"}, _point(lon, lat)))
+    layers[MT_MINES_LAYER] = _layer('Mine_MBMG2006', 'esriGeometryPoint', mt_mines, FEATURESERVER_MAX_RECORDS)
+
+    id_mines = []
+    for i in range(count('other_state')):
+        county, lon, lat = place('ID')
+        id_mines.append(({'PropName': f"ID Mine {i + 1}", 'NAD27lat': lat, 'NAD27long': lon, 'County': county,
+                          'Commod1': f"Ag{filler}", 'PropType': 'Prospect'}, _point(lon, lat)))
+    layers[ID_MINES_LAYER] = _layer('Mines', 'esriGeometryPoint', id_mines, FEATURESERVER_MAX_RECORDS)
+
+    pci = []
+    for i in range(count('other_state')):
+        county, lon, lat = place('ID')
+        pci.append(({'FACILITY': f"PCI Facility {i + 1}", 'ADDRESS': f"{rng.randint(1, 9999)} Center St",
+                     'CITY': f"{county} City", 'COUNTY': county.upper(),
+                     'ZIPCODE': int(rng.choice(zips_by_county[('ID', county)])), 'LATITUDE': lat, 'LONGITUDE': lon,
+                     'HOTLINK': None, 'FAC_TYPE': 'Dry Cleaner', 'CONTAMINAN': 'Solvents',
+                     'DESCRIPTION': f"Inventory entry{filler}"}, _point(lon, lat)))
+    layers[f"{ID_DEQ_SERVICE}/12"] = _layer('Potential Contaminants Inventory', 'esriGeometryPoint', pci,
+                                            MAPSERVER_MAX_RECORDS)
+
+    landfills = []
+    for i in range(count('id_landfills')):
+        county, lon, lat = place('ID')
+        landfills.append(({'SITENAME': f"Landfill {i + 1}", 'COUNTY': county.upper(), 'STATUS': 'Closed',
+                           'TYPE': 'Municipal', 'CONTAMINANT': f"Leachate{filler}"}, _point(lon, lat)))
+    layers[f"{ID_DEQ_SERVICE}/28"] = _layer('Landfills', 'esriGeometryPoint', landfills, MAPSERVER_MAX_RECORDS)
+
+    layers[TOWERS_LAYER] = _layer('FM Transmission Towers', 'esriGeometryPoint',
+                                  [(attrs, _point(lon, lat)) for attrs, lon, lat in towers], FEATURESERVER_MAX_RECORDS)
+
+    tiger = []
+    for state, spec in STATES.items():
+        for name, (xmin, ymin, xmax, ymax) in counties[state]:
+            tiger.append(({'STATE': spec['fips'], 'BASENAME': name, 'NAME': f"{name} County"},
+                          {'rings': [[[xmin, ymin], [xmin, ymax], [xmax, ymax], [xmax, ymin], [xmin, ymin]]]}))
+    layers[TIGER_COUNTY_LAYER] = _layer('Counties', 'esriGeometryPolygon', tiger, MAPSERVER_MAX_RECORDS)
+
+    return {'counties': counties, 'zips': zips, 'ecology': ecology, 'tri_csv': tri_csv, 'towers': towers,
+            'layers': layers}
+
+def _county_grid(spec):
+    """
+    Splits a state's extent into spec['grid'] (columns, rows) county rectangles.
+    """
+    xmin, ymin, xmax, ymax = spec['bbox']
+    columns, rows = spec['grid']
+    width = (xmax - xmin) / columns
+    height = (ymax - ymin) / rows
+    grid = []
+    for i, name in enumerate(spec['counties']):
+        column, row = i % columns, rows - 1 - i // columns
+        grid.append((name, (round(xmin + column * width, 6), round(ymin + row * height, 6),
+                            round(xmin + (column + 1) * width, 6), round(ymin + (row + 1) * height, 6))))
+    return grid
+
+def _zips(counties):
+    """
+    ZIPS_PER_COUNTY zips per county, centered in quarters of the county.
+    """
+    zips = {}
+    for state, grid in counties.items():
+        code = STATES[state]['first_zip']
+        for name, (xmin, ymin, xmax, ymax) in grid:
+            for i in range(ZIPS_PER_COUNTY):
+                fx, fy = (0.25 + 0.5 * (i % 2), 0.25 + 0.5 * (i // 2))
+                zips[str(code)] = {'zip': str(code), 'state': state, 'county': name, 'city': f"{name} City",
+                                   'lat': round(ymin + fy * (ymax - ymin), 6), 'lon': round(xmin + fx * (xmax - xmin), 6)}
+                code += 1
+    return zips
+
+def _point(lon, lat):
+    return {'x': lon, 'y': lat}
+
+def _blob(rng, lon, lat):
+    """
+    A closed, irregular ring of POLYGON_VERTICES around lon/lat (a few km across).
+    """
+    radius = rng.uniform(0.01, 0.05)
+    ring = []
+    for i in range(POLYGON_VERTICES):
+        angle = 2 * math.pi * i / POLYGON_VERTICES
+        r = radius * rng.uniform(0.7, 1.0)
+        ring.append([round(lon + r * math.cos(angle), 6), round(lat + r * math.sin(angle), 6)])
+    ring.append(list(ring[0]))
+    return ring
+
+def _layer(name, geometry_type, records, max_record_count):
+    """
+    An ArcGIS layer: features numbered by OBJECTID, their extents (for
+    envelope queries) and the schema reported by the layer endpoint.
+    """
+    features = []
+    extents = []
+    for oid, (attrs, geometry) in enumerate(records, start=1):
+        features.append({'attributes': {'OBJECTID': oid, **attrs}, 'geometry': geometry})
+        if 'rings' in geometry:
+            points = [p for ring in geometry['rings'] for p in ring]
+            extents.append((min(p[0] for p in points), min(p[1] for p in points),
+                            max(p[0] for p in points), max(p[1] for p in points)))
+        else:
+            extents.append((geometry['x'], geometry['y'], geometry['x'], geometry['y']))
+    fields = ['OBJECTID'] + (list(records[0][0]) if records else [])
+    return {'name': name, 'geometry_type': geometry_type, 'features': features, 'extents': extents,
+            'fields': fields, 'max_record_count': max_record_count}
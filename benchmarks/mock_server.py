@@ -0,0 +1,369 @@
+import re
+import gzip
+import json
+import time
+import logging
+import argparse
+import threading
+import multiprocessing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from benchmarks.fixtures import build_fixtures, TOWERS_LAYER
+
+# Local stand-in for every upstream the fetchers call. Requests arrive as
+# /<original host>/<original path> (see http_session.configure(upstream=...)).
+
+DEFAULT_HOST = '127.0.0.1'
+
+# Responses smaller than this are sent uncompressed
+GZIP_MIN_BYTES = 1024
+
+# One WHERE predicate: [UPPER(]FIELD[)] <op> <literal>
+WHERE_CLAUSE = re.compile(r"^(?:UPPER\((\w+)\)|(\w+))\s*(LIKE|>=|<=|=)\s*(.+)$", re.IGNORECASE)
+
+class MockUpstream:
+    """
+    Serves fixtures (see build_fixtures) over HTTP: the WA Ecology export,
+    TRI CSV downloads, the HIFLD GeoJSON and Hub item, Zippopotam, and ArcGIS
+    layer/query endpoints with where clauses, envelopes, object-ID and offset
+    paging, counts, extents and maxRecordCount truncation.
+    Every response is delayed by latency seconds.
+    """
+
+    def __init__(self, fixtures, latency=0.0, host=DEFAULT_HOST, port=0):
+        self.fixtures = fixtures
+        self.latency = latency
+        self.stats = {'requests': 0, 'bytes': 0}
+        self.lock = threading.Lock()
+        self.encoded = {}
+        handler = type('BoundMockRequestHandler', (MockRequestHandler,), {'upstream': self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name='mock-upstream', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count(self, size):
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats['bytes'] += size
+
+    def cached_body(self, key, build):
+        """
+        Encodes a static payload once.
+        """
+        with self.lock:
+            if key not in self.encoded:
+                self.encoded[key] = build()
+            return self.encoded[key]
+
+    def handle(self, host, path, params):
+        """
+        Returns (status, body bytes, content type) for a request.
+        """
+        fixtures = self.fixtures
+        if host == 'apps.ecology.wa.gov' and path.endswith('/export'):
+            items = fixtures['ecology']
+            if params.get('Zip'):
+                items = [i for i in items if params['Zip'] in str(i['ZipCode'])]
+            elif params.get('County'):
+                items = [i for i in items if params['County'].upper() in i['County'].upper()]
+            return 200, _json(items), 'application/json'
+
+        if host == 'data.epa.gov':
+            match = re.search(r'/(\d{4})_([A-Z]{2})/csv$', path)
+            if match and match.group(2) in fixtures['tri_csv']:
+                return 200, fixtures['tri_csv'][match.group(2)], 'text/csv'
+            return 404, b'', 'text/plain'
+
+        if host == 'opendata.arcgis.com' and path.endswith('.geojson'):
+            body = self.cached_body('geojson', lambda: _json({
+                'type': 'FeatureCollection',
+                'features': [{'type': 'Feature', 'properties': attrs,
+                              'geometry': {'type': 'Point', 'coordinates': [lon, lat]}}
+                             for attrs, lon, lat in fixtures['towers']]
+            }))
+            return 200, body, 'application/geo+json'
+
+        if host == 'hub.arcgis.com' and path.startswith('/api/v3/datasets/'):
+            return 200, _json({'data': {'attributes': {'url': f"https://{TOWERS_LAYER}"}}}), 'application/json'
+
+        if host == 'api.zippopotam.us':
+            entry = fixtures['zips'].get(path.rsplit('/', 1)[-1])
+            if not entry:
+                return 404, b'{}', 'application/json'
+            return 200, _json({'post code': entry['zip'], 'places': [{
+                'place name': entry['city'], 'state abbreviation': entry['state'],
+                'latitude': str(entry['lat']), 'longitude': str(entry['lon'])}]}), 'application/json'
+
+        key = f"{host}{path}"
+        if key.endswith('/query') and key[:-len('/query')] in fixtures['layers']:
+            try:
+                result = query_layer(fixtures['layers'][key[:-len('/query')]], params)
+            except ValueError as e:
+                result = {'error': {'code': 400, 'message': str(e), 'details': []}}
+            return 200, _json(result), 'application/json'
+        if key in fixtures['layers']:
+            return 200, _json(layer_info(fixtures['layers'][key])), 'application/json'
+
+        return 404, b'', 'text/plain'
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out as separate writes; without this each keep-alive
+    # response waits on a delayed ACK
+    disable_nagle_algorithm = True
+    upstream = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {k: v[-1] for k, v in parse_qs(url.query, keep_blank_values=True).items()}
+
+        if url.path == '/__stats__':
+            self._send(200, _json(self.upstream.stats), 'application/json', count=False)
+            return
+
+        host, _, path = url.path.lstrip('/').partition('/')
+        if self.upstream.latency:
+            time.sleep(self.upstream.latency)
+        status, body, content_type = self.upstream.handle(host, f"/{path}", params)
+        self._send(status, body, content_type)
+
+    def _send(self, status, body, content_type, count=True):
+        headers = {}
+        if len(body) >= GZIP_MIN_BYTES and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body, compresslevel=5)
+            headers['Content-Encoding'] = 'gzip'
+        if count:
+            self.upstream.count(len(body))
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(f"{self.address_string()} - {format % args}")
+
+def layer_info(layer):
+    return {
+        'name': layer['name'],
+        'type': 'Feature Layer',
+        'geometryType': layer['geometry_type'],
+        'objectIdField': 'OBJECTID',
+        'maxRecordCount': layer['max_record_count'],
+        'fields': [{'name': name, 'type': 'esriFieldTypeOID' if name == 'OBJECTID' else 'esriFieldTypeString'}
+                   for name in layer['fields']],
+        'advancedQueryCapabilities': {'supportsPagination': True}
+    }
+
+def query_layer(layer, params):
+    """
+    Answers an ArcGIS /query against a fixture layer.
+    """
+    predicate = parse_where(params.get('where') or '1=1')
+    envelope = None
+    if params.get('geometry'):
+        envelope = [float(v) for v in params['geometry'].split(',')]
+
+    matched = []
+    for feature, extent in zip(layer['features'], layer['extents']):
+        if envelope and (extent[0] > envelope[2] or extent[2] < envelope[0] or
+                         extent[1] > envelope[3] or extent[3] < envelope[1]):
+            continue
+        if predicate(feature['attributes']):
+            matched.append((feature, extent))
+
+    if _true(params.get('returnIdsOnly')):
+        return {'objectIdFieldName': 'OBJECTID', 'objectIds': [f['attributes']['OBJECTID'] for f, _ in matched]}
+    if _true(params.get('returnCountOnly')):
+        return {'count': len(matched)}
+    if _true(params.get('returnExtentOnly')):
+        if not matched:
+            return {'extent': {'xmin': 'NaN', 'ymin': 'NaN', 'xmax': 'NaN', 'ymax': 'NaN'}}
+        return {'extent': {'xmin': min(e[0] for _, e in matched), 'ymin': min(e[1] for _, e in matched),
+                           'xmax': max(e[2] for _, e in matched), 'ymax': max(e[3] for _, e in matched),
+                           'spatialReference': {'wkid': 4326}}}
+
+    offset = int(params.get('resultOffset') or 0)
+    limit = min(int(params.get('resultRecordCount') or layer['max_record_count']), layer['max_record_count'])
+    page = matched[offset:offset + limit]
+
+    out_fields = params.get('outFields') or '*'
+    wanted = None if out_fields == '*' else {f.strip().upper() for f in out_fields.split(',')}
+    return_geometry = not params.get('returnGeometry') or _true(params['returnGeometry'])
+
+    features = []
+    for feature, _ in page:
+        attrs = feature['attributes']
+        if wanted is not None:
+            attrs = {k: v for k, v in attrs.items() if k.upper() in wanted}
+        features.append({'attributes': attrs, 'geometry': feature['geometry']} if return_geometry
+                        else {'attributes': attrs})
+
+    result = {'objectIdFieldName': 'OBJECTID', 'geometryType': layer['geometry_type'],
+              'spatialReference': {'wkid': 4326}, 'features': features}
+    if len(matched) > offset + limit:
+        result['exceededTransferLimit'] = True
+    return result
+
+def parse_where(where):
+    """
+    Compiles the WHERE clauses the fetchers send into a predicate over a
+    feature's attributes: 1=1, [UPPER(]FIELD[)] LIKE/=/>=/<= literal, joined
+    with AND and optionally parenthesized. Raises ValueError otherwise.
+    """
+    where = where.strip()
+    while where.startswith('(') and _closing_paren(where) == len(where) - 1:
+        where = where[1:-1].strip()
+
+    parts = _split_and(where)
+    if len(parts) > 1:
+        predicates = [parse_where(part) for part in parts]
+        return lambda attrs: all(p(attrs) for p in predicates)
+
+    if where.replace(' ', '') == '1=1':
+        return lambda attrs: True
+
+    match = WHERE_CLAUSE.match(where)
+    if not match:
+        raise ValueError(f"Unsupported where clause: {where}")
+    upper_field, field, op, literal = match.groups()
+    field = upper_field or field
+    op = op.upper()
+    literal = literal.strip()
+    if literal.startswith("'") and literal.endswith("'"):
+        value = literal[1:-1].replace("''", "'")
+    else:
+        try:
+            value = float(literal)
+        except ValueError:
+            raise ValueError(f"Unsupported literal: {literal}")
+
+    def get(attrs):
+        v = attrs.get(field)
+        if v is None:
+            return None
+        return str(v).upper() if upper_field else v
+
+    if op == 'LIKE':
+        pattern = re.compile('^' + '.*'.join(re.escape(p) for p in str(value).split('%')) + '$', re.DOTALL)
+        return lambda attrs: get(attrs) is not None and bool(pattern.match(str(get(attrs))))
+
+    def compare(attrs):
+        v = get(attrs)
+        if v is None:
+            return False
+        if isinstance(value, float):
+            try:
+                v = float(v)
+            except (TypeError, ValueError):
+                return False
+        else:
+            v = str(v)
+        if op == '=':
+            return v == value
+        return v >= value if op == '>=' else v <= value
+    return compare
+
+def _split_and(where):
+    """
+    Splits where on top-level ANDs (outside parentheses and quotes).
+    """
+    parts = []
+    depth = 0
+    quoted = False
+    start = 0
+    i = 0
+    while i < len(where):
+        c = where[i]
+        if c == "'":
+            quoted = not quoted
+        elif not quoted and c == '(':
+            depth += 1
+        elif not quoted and c == ')':
+            depth -= 1
+        elif not quoted and depth == 0 and where[i:i + 5].upper() == ' AND ':
+            parts.append(where[start:i].strip())
+            start = i + 5
+            i += 5
+            continue
+        i += 1
+    parts.append(where[start:].strip())
+    return parts
+
+def _closing_paren(where):
+    """
+    Index of the parenthesis closing the one at where[0].
+    """
+    depth = 0
+    quoted = False
+    for i, c in enumerate(where):
+        if c == "'":
+            quoted = not quoted
+        elif not quoted and c == '(':
+            depth += 1
+        elif not quoted and c == ')':
+            depth -= 1
+            if depth == 0:
+                return i
+    return -1
+
+def _true(value):
+    return str(value).lower() == 'true'
+
+def _json(data):
+    return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+def _serve(features, seed, pad, latency, port, ready):
+    upstream = MockUpstream(build_fixtures(features, seed, pad), latency, port=port)
+    ready.put(upstream.url)
+    upstream.server.serve_forever()
+
+def start_process(features=1000, seed=0, pad=0, latency=0.0, port=0):
+    """
+    Builds fixtures and serves them from a child process, so that their
+    memory and serialization cost stay out of the benchmarked process.
+    Returns (process, url); terminate the process when done.
+    """
+    ready = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_serve, args=(features, seed, pad, latency, port, ready), daemon=True)
+    process.start()
+    return process, ready.get(timeout=600)
+
+def main():
+    parser = argparse.ArgumentParser(description="Serves synthetic upstream data for offline runs. Point the app at it "
+                                                 "with TOXMAP_UPSTREAM=<printed URL>.")
+    parser.add_argument('--features', type=int, default=1000, help="Size of the largest layers (default: 1000)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--pad', type=int, default=0, help="Extra characters per record, to grow payloads")
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    upstream = MockUpstream(build_fixtures(args.features, args.seed, args.pad), args.latency, port=args.port)
+    logging.info(f"Serving {args.features}-feature fixtures on {upstream.url}")
+    try:
+        upstream.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        upstream.server.server_close()
+
+if __name__ == "__main__":
+    main()
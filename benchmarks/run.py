@@ -0,0 +1,240 @@
+import os
+import gc
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import requests
+from src import http_cache, http_session, warehouse
+from src.data_fetchers import (fetch_all_data, fetch_broadcast_towers, fetch_epa_tri_data, fetch_id_deq_data,
+                               fetch_id_mines, fetch_mt_mines, fetch_wa_dnr_hazardous_minerals,
+                               fetch_wa_dnr_inactive_mines, fetch_wa_dnr_mines, fetch_wa_ecology_data, STATE_BBOXES)
+from src.features import filter_table, to_layers, to_table
+from src.kml_generator import generate_kml
+from src.kml_stream import stream_kml, stream_kmz
+from src.pipeline import filter_query
+from benchmarks import mock_server
+from benchmarks.fixtures import build_fixtures
+
+# Feature counts benchmarked by default
+DEFAULT_SIZES = (1000, 10000, 100000)
+
+# County and zip searched by the county/zip stages
+BENCHMARK_COUNTY = 'Spokane'
+
+# A stage this much slower than in the baseline report counts as a regression
+DEFAULT_TOLERANCE = 1.25
+
+def fetch_stages():
+    """
+    (name, function) for every fetcher, and for fetch_all_data as a whole.
+    """
+    return [
+        ('fetch_wa_ecology', lambda: fetch_wa_ecology_data(None, False)),
+        ('fetch_epa_tri', lambda: fetch_epa_tri_data(state='WA')),
+        ('fetch_towers_geojson', lambda: fetch_broadcast_towers()),
+        ('fetch_towers_envelope', lambda: fetch_broadcast_towers(STATE_BBOXES['WA'])),
+        ('fetch_wa_dnr_mines', lambda: fetch_wa_dnr_mines()),
+        ('fetch_wa_dnr_inactive_mines', lambda: fetch_wa_dnr_inactive_mines()),
+        ('fetch_wa_dnr_hazardous_minerals', lambda: fetch_wa_dnr_hazardous_minerals()),
+        ('fetch_mt_mines', lambda: fetch_mt_mines()),
+        ('fetch_id_mines', lambda: fetch_id_mines()),
+        ('fetch_id_deq', lambda: fetch_id_deq_data(None, False)),
+        ('fetch_all_county', lambda: fetch_all_data(BENCHMARK_COUNTY, False, 'WA')),
+        ('fetch_all_statewide', lambda: fetch_all_data(None, False, 'WA'))
+    ]
+
+def filter_stages(data, zip_entry):
+    """
+    Filtering statewide WA data down to a county and to a zip, from record
+    lists and from the columnar feature table.
+    """
+    county_query = {'query': BENCHMARK_COUNTY, 'search_term': BENCHMARK_COUNTY, 'is_zip': False, 'state': 'WA',
+                    'lat': None, 'lon': None, 'city': None}
+    zip_query = {'query': zip_entry['zip'], 'search_term': zip_entry['zip'], 'is_zip': True, 'state': 'WA',
+                 'lat': zip_entry['lat'], 'lon': zip_entry['lon'], 'city': zip_entry['city']}
+    table = to_table(data)
+    return [
+        ('filter_county', lambda: filter_query(county_query, data, statewide=True)),
+        ('filter_zip', lambda: filter_query(zip_query, data, statewide=True)),
+        ('build_feature_table', lambda: to_table(data)),
+        ('filter_table_county', lambda: to_layers(filter_table(table, county_query, statewide=True))),
+        ('filter_table_zip', lambda: to_layers(filter_table(table, zip_query, statewide=True)))
+    ]
+
+def render_stages(data, output_dir):
+    """
+    Every writer over the whole statewide dataset.
+    """
+    stages = []
+    for name, write, extension in (('render_generate_kml', generate_kml, 'kml'),
+                                   ('render_stream_kml', stream_kml, 'kml'),
+                                   ('render_stream_kmz', stream_kmz, 'kmz')):
+        path = os.path.join(output_dir, f"{name}.{extension}")
+        stages.append((name, lambda write=write, path=path: (write(*data, 'Washington', path), path)))
+    return stages
+
+def measure(name, function, upstream, repeat=1, memory=True):
+    """
+    Runs a stage repeat times and returns (result, measurement). seconds is
+    the fastest run; peak_mb (traced Python allocations above the starting
+    point), requests and bytes (sent by the mock server) come from the first.
+    """
+    measurement = {'stage': name}
+    result = None
+    for run in range(repeat):
+        # Every run starts cold: no memoized responses, no garbage from the last stage
+        http_cache.clear_memo()
+        gc.collect()
+        before = _upstream_stats(upstream)
+        if memory and run == 0:
+            tracemalloc.start()
+            baseline = tracemalloc.get_traced_memory()[0]
+
+        start = time.perf_counter()
+        result = function()
+        seconds = time.perf_counter() - start
+
+        if memory and run == 0:
+            measurement['peak_mb'] = round((tracemalloc.get_traced_memory()[1] - baseline) / 2 ** 20, 2)
+            tracemalloc.stop()
+        if run == 0:
+            after = _upstream_stats(upstream)
+            measurement['requests'] = after['requests'] - before['requests']
+            measurement['bytes'] = after['bytes'] - before['bytes']
+        measurement['seconds'] = round(min(seconds, measurement.get('seconds', seconds)), 4)
+
+    measurement['items'] = _items(result)
+    return result, measurement
+
+def run_size(features, args, output_dir):
+    """
+    Benchmarks every stage against a mock server holding fixtures of this size.
+    """
+    process, upstream = mock_server.start_process(features, args.seed, args.pad, args.latency)
+    http_session.configure(upstream=upstream)
+    http_session.close()
+    zip_entry = next(e for e in build_fixtures(1, args.seed)['zips'].values() if e['county'] == BENCHMARK_COUNTY)
+
+    results = []
+
+    def run(stages):
+        outputs = {}
+        for name, function in stages:
+            if args.stages and not any(s in name for s in args.stages):
+                continue
+            outputs[name], measurement = measure(name, function, upstream, args.repeat, not args.no_memory)
+            measurement['features'] = features
+            results.append(measurement)
+            print(_format_row(measurement))
+        return outputs
+
+    try:
+        outputs = run(fetch_stages())
+        data = outputs.get('fetch_all_statewide')
+        if data is None:
+            data = fetch_all_data(None, False, 'WA')
+        run(filter_stages(data, zip_entry))
+        run(render_stages(data, output_dir))
+    finally:
+        http_session.configure(upstream='')
+        http_session.close()
+        process.terminate()
+        process.join()
+    return results
+
+def compare(results, baseline_path, tolerance):
+    """
+    Prints each stage's time against the baseline report and returns the
+    stages slower than tolerance times their baseline.
+    """
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = {(r['stage'], r['features']): r for r in json.load(f)['results']}
+
+    regressions = []
+    print(f"\nCompared with {baseline_path}:")
+    for result in results:
+        previous = baseline.get((result['stage'], result['features']))
+        if not previous or not previous['seconds']:
+            continue
+        ratio = result['seconds'] / previous['seconds']
+        flag = ' REGRESSION' if ratio > tolerance else ''
+        print(f"{result['stage']:<34}{result['features']:>8}  {previous['seconds']:>9.3f}s -> "
+              f"{result['seconds']:>9.3f}s  x{ratio:.2f}{flag}")
+        if flag:
+            regressions.append(result)
+    return regressions
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the fetch, filter and render stages against a "
+                                                 "local stand-in for the upstream services")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES),
+                        help="Feature counts to benchmark (default: 1000 10000 100000)")
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds the mock server adds to every response")
+    parser.add_argument('--pad', type=int, default=0, help="Extra characters per record, to grow payloads")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for the synthetic fixtures")
+    parser.add_argument('--repeat', type=int, default=1, help="Runs per stage; the fastest is reported")
+    parser.add_argument('--stages', nargs='+', help="Only run stages whose name contains one of these")
+    parser.add_argument('--no-memory', action='store_true',
+                        help="Skip tracemalloc (its overhead otherwise inflates the first run's time)")
+    parser.add_argument('--output', default=os.path.join('output', 'benchmark.json'), help="JSON report path")
+    parser.add_argument('--baseline', help="Earlier JSON report to compare against")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="Slowdown against --baseline reported as a regression (default: 1.25)")
+    parser.add_argument('--verbose', action='store_true', help="Show the application's log output")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+
+    # Every request must reach the mock server
+    http_cache.configure(enabled=False)
+    warehouse.configure(enabled=False)
+
+    print(f"{'stage':<34}{'features':>8}{'seconds':>10}{'peak MB':>10}{'requests':>10}{'KB sent':>10}{'items':>10}")
+    results = []
+    with tempfile.TemporaryDirectory(prefix='toxmap-bench-') as output_dir:
+        for features in args.sizes:
+            results.extend(run_size(features, args, output_dir))
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {'sizes': args.sizes, 'latency': args.latency, 'pad': args.pad, 'seed': args.seed,
+                   'repeat': args.repeat, 'memory': not args.no_memory},
+        'results': results
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {args.output}")
+
+    if args.baseline and compare(results, args.baseline, args.tolerance):
+        sys.exit(1)
+
+def _upstream_stats(upstream):
+    return requests.get(f"{upstream}/__stats__", timeout=10).json()
+
+def _items(result):
+    """
+    Features returned by a stage (or bytes written, for renders).
+    """
+    if isinstance(result, tuple) and len(result) == 2 and isinstance(result[1], str):
+        return os.path.getsize(result[1]) if result[0] and os.path.exists(result[1]) else 0
+    if isinstance(result, tuple):
+        return sum(len(layer) for layer in result)
+    return len(result) if result is not None else 0
+
+def _format_row(m):
+    peak = f"{m['peak_mb']:.1f}" if 'peak_mb' in m else '-'
+    return (f"{m['stage']:<34}{m['features']:>8}{m['seconds']:>10.3f}{peak:>10}{m['requests']:>10}"
+            f"{m['bytes'] / 1024:>10.0f}{m['items']:>10}")
+
+if __name__ == "__main__":
+    main()
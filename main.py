@@ -1,183 +1,151 @@
 import os
 import sys
-from src.data_fetchers import fetch_all_data, get_county_for_zip, get_location_details
-from src.kml_generator import generate_kml
+import time
+import argparse
+from src import http_cache, profiling, warehouse
+from src.data_fetchers import STATE_FIPS
+from src.zip_table import build_zip_table
+from src.kml_generator import DEFAULT_PRECISION
+from src.geometry import DEFAULT_RING_RADII_MILES
+from src.pipeline import run_query, sync_warehouse, EXPORTS
+from src.server import serve, MapService, DEFAULT_HOST, DEFAULT_PORT
+from src.superoverlay import build_superoverlay, DEFAULT_TILE_FEATURES
+from src.spatial import DEFAULT_RADIUS_MILES, to_miles
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="ToxMap Scraper")
+    parser.add_argument('queries', nargs='*',
+                        help="Zip codes or county names to map (prompts for one if omitted), 'sync [STATE ...]' "
+                             "to download statewide data into the local warehouse, or 'serve [STATE ...]' to run "
+                             "the HTTP map service (preloading the given states), 'superoverlay [STATE ...]' to "
+                             "pre-render statewide KML tiles, or 'build-zips' to rebuild the offline zip table "
+                             "from Census files")
+    parser.add_argument('--host', default=DEFAULT_HOST, help="Address the map service listens on")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help="Port the map service listens on")
+    parser.add_argument('--batch-file', help="File with one zip code or county name per line")
+    parser.add_argument('--jobs', type=int, help="Processes used to render batch outputs or super-overlay tiles (default: all cores)")
+    parser.add_argument('--output-dir', default=os.path.join(os.getcwd(), 'output'), help="Directory for the generated files")
+    parser.add_argument('--warehouse', help="Path of the local SQLite warehouse")
+    parser.add_argument('--no-warehouse', action='store_true', help="Query the live sources even if a synced warehouse exists")
+    parser.add_argument('--no-cache', action='store_true', help="Bypass the on-disk HTTP cache for this run")
+    parser.add_argument('--clear-cache', action='store_true', help="Delete the on-disk HTTP cache before running")
+    parser.add_argument('--radius', type=float, default=DEFAULT_RADIUS_MILES, help="Proximity radius for towers, mines and minerals")
+    parser.add_argument('--units', choices=['mi', 'km'], default='mi', help="Units for --radius")
+    parser.add_argument('--precision', type=int, default=DEFAULT_PRECISION, help="Decimal places for KML coordinates")
+    parser.add_argument('--stream', action='store_true', help="Write the KML incrementally (flat memory for statewide outputs)")
+    parser.add_argument('--rings', type=float, nargs='+', default=list(DEFAULT_RING_RADII_MILES),
+                        help="Buffer ring radii around sites and mines, in --units (e.g. --rings 0.5 1 3)")
+    parser.add_argument('--ring-vertices', type=int, help="Vertices per buffer ring (default: chosen from the radius)")
+    parser.add_argument('--kmz', action='store_true', help="Write a compressed KMZ with Region-based level of detail")
+    parser.add_argument('--formats', nargs='+', choices=['kml', *EXPORTS], default=['kml'],
+                        help="Outputs written from the same filtered data: kml (see --kmz/--stream), geojson, "
+                             "fgb (FlatGeobuf, needs pyogrio) and/or csv (default: kml)")
+    parser.add_argument('--tile-features', type=int, default=DEFAULT_TILE_FEATURES,
+                        help="Most features drawn by one super-overlay tile")
+    parser.add_argument('--profile', action='store_true',
+                        help="Record per-stage timings, HTTP requests and record counts, and write them as JSON")
+    parser.add_argument('--profile-output', help="Path of the --profile report (default: profile.json in --output-dir)")
+    parser.add_argument('--cprofile', action='store_true',
+                        help="With --profile, also run under cProfile: the slowest functions go into the report "
+                             "and raw stats next to it (.pstats)")
+    return parser.parse_args()
+
+def read_queries(args):
+    """
+    Queries from the command line and --batch-file, or one typed at the prompt.
+    """
+    queries = list(args.queries)
+    if args.batch_file:
+        with open(args.batch_file, 'r', encoding='utf-8') as f:
+            queries.extend(line.strip() for line in f if line.strip() and not line.startswith('#'))
+    if not queries:
+        queries = [input("Enter Zip Code or County Name (e.g., 99021 or Spokane): ").strip()]
+    return queries
 
 def main():
-    print("--- ToxMap Scraper ---")
-    user_input = input("Enter Zip Code or County Name (e.g., 99021 or Spokane): ").strip()
-    
-    is_zip = user_input.isdigit()
-    search_term = user_input
-    state = 'WA' # Default
-    
-    print(f"Fetching data for {search_term} ({'Zip' if is_zip else 'County'})...")
-    
-    # Zip-to-Location Expansion
-    if is_zip:
-        print("Looking up Location details...")
-        details = get_location_details(search_term)
-        if details:
-            state = details['state']
-            county = details['county'] # Note: Zippopotam might return City name as Place Name. 
-            # For Zippopotam, 'place name' is usually city. 'county' is not always direct.
-            # Let's rely on the state at least.
-            # Actually, let's use get_county_for_zip for WA as fallback if Zippopotam is vague, 
-            # but Zippopotam is good for State.
-            
-            print(f"--> Zip {search_term} is in {details['city']}, {state}.")
-            
-            # For WA, we still want the County expansion behavior
-            if state == 'WA':
-                wa_county = get_county_for_zip(search_term)
-                if wa_county:
-                    print(f"--> WA County identified: {wa_county}")
-                    print(f"--> Switching to full County search for {wa_county} to include all data.")
-                    search_term = wa_county
-                    is_zip = False
-            else:
-                # For MT/ID, we might stick to Zip or try to find County.
-                # Since we don't have a reliable Zip->County API for MT/ID implemented yet (Zippopotam 'place name' is city),
-                # we will proceed with Zip search for now, OR fetch all for state and filter by proximity.
-                # Fetching all for state is safer.
-                print(f"--> Detected State: {state}")
-        else:
-            print("--> Could not determine location. Defaulting to WA.")
+    args = parse_args()
+    if not args.profile:
+        sys.exit(run(args))
 
-    # Fetch Data
-    # Pass lat/lon if available for spatial querying (MT/ID mines)
-    lat = details.get('lat') if details else None
-    lon = details.get('lon') if details else None
-    
-    sites, towers, mines, inactive_mines, hazardous_minerals = fetch_all_data(search_term, is_zip, state, lat, lon)
-    
-    # Filter Data
-    filtered_sites = []
-    filtered_towers = []
-    filtered_mines = []
-    filtered_inactive_mines = []
-    filtered_haz_minerals = []
-    
-    # Filter Sites
-    for site in sites:
-        if site['source'] == 'WA Ecology':
-            # Already filtered by API
-            filtered_sites.append(site)
-        elif site['source'] == 'EPA TRI':
-            # Filter by Zip, Prefix, or Proximity
-            if is_zip:
-                site_zip = str(site.get('zip', ''))
-                
-                # 1. Exact Match
-                if site_zip == search_term:
-                    filtered_sites.append(site)
-                # 2. Prefix Match (e.g. 83814-1234)
-                elif site_zip.startswith(search_term):
-                    filtered_sites.append(site)
-                # 3. Proximity Match (if lat/lon available)
-                elif lat and lon and site.get('lat') and site.get('lon'):
-                    # Approx 10 miles check (0.15 deg)
-                    if (lat - 0.15 <= site['lat'] <= lat + 0.15) and \
-                       (lon - 0.15 <= site['lon'] <= lon + 0.15):
-                        filtered_sites.append(site)
-            else:
-                # Filter by County (TRI county is usually UPPERCASE)
-                if search_term.upper() in site['county']:
-                    filtered_sites.append(site)
+    report_path = args.profile_output or os.path.join(args.output_dir, 'profile.json')
+    os.makedirs(os.path.dirname(os.path.abspath(report_path)), exist_ok=True)
+    profiling.configure(enabled=True)
+    extra = {'argv': sys.argv[1:]}
+    start = time.perf_counter()
+    status = 1
+    try:
+        if args.cprofile:
+            stats_path = f"{os.path.splitext(report_path)[0]}.pstats"
+            with profiling.cprofile(stats_path) as cprofile:
+                status = run(args)
+            extra['cprofile'] = {'stats_file': stats_path, 'top': cprofile['top']}
         else:
-            # Other sources (placeholders)
-            filtered_sites.append(site)
-            
-    # Filter Towers, Mines, Inactive Mines, Hazardous Minerals
-    if not is_zip:
-        # County Search - Filter by County Name
-        target_county = search_term.upper()
-        
-        for mine in mines:
-            if target_county in mine['county'].upper():
-                filtered_mines.append(mine)
-                
-        for mine in inactive_mines:
-            if target_county in mine['county'].upper():
-                filtered_inactive_mines.append(mine)
-                
-        for site in hazardous_minerals:
-            if site.get('county') and target_county in site['county'].upper():
-                filtered_haz_minerals.append(site)
-            elif not site.get('county'):
-                 # Fallback to proximity for items without county
-                 if filtered_sites:
-                     # Calculate centroid for filtering
-                     lats = [s['lat'] for s in filtered_sites]
-                     lons = [s['lon'] for s in filtered_sites]
-                     avg_lat = sum(lats) / len(lats)
-                     avg_lon = sum(lons) / len(lons)
-                     lat_range = 0.1
-                     lon_range = 0.1
-                     
-                     if (avg_lat - lat_range <= site['lat'] <= avg_lat + lat_range) and \
-                        (avg_lon - lon_range <= site['lon'] <= avg_lon + lon_range):
-                         filtered_haz_minerals.append(site)
-    
-    # Spatial Filtering (Fallback or Zip)
-    # Determine Center Point
-    center_lat = None
-    center_lon = None
-    
-    if is_zip and 'details' in locals() and details:
-        center_lat = details.get('lat')
-        center_lon = details.get('lon')
-    elif filtered_sites:
-        lats = [s['lat'] for s in filtered_sites]
-        lons = [s['lon'] for s in filtered_sites]
-        center_lat = sum(lats) / len(lats)
-        center_lon = sum(lons) / len(lons)
-        
-    if center_lat and center_lon:
-        lat_range = 0.15 # Approx 10 miles
-        lon_range = 0.15
-        
-        print(f"Filtering data around {center_lat}, {center_lon} (Range: +/- {lat_range})...")
-        
-        # Filter Towers (Always proximity)
-        for tower in towers:
-            if (center_lat - lat_range <= tower['lat'] <= center_lat + lat_range) and \
-               (center_lon - lon_range <= tower['lon'] <= center_lon + lon_range):
-                filtered_towers.append(tower)
-                
-        # Filter others if Zip search (and not already filtered by County)
-        if is_zip:
-             for mine in mines:
-                if (center_lat - lat_range <= mine['lat'] <= center_lat + lat_range) and \
-                   (center_lon - lon_range <= mine['lon'] <= center_lon + lon_range):
-                    filtered_mines.append(mine)
-             for mine in inactive_mines:
-                if (center_lat - lat_range <= mine['lat'] <= center_lat + lat_range) and \
-                   (center_lon - lon_range <= mine['lon'] <= center_lon + lon_range):
-                    filtered_inactive_mines.append(mine)
-             for site in hazardous_minerals:
-                if (center_lat - lat_range <= site['lat'] <= center_lat + lat_range) and \
-                   (center_lon - lon_range <= site['lon'] <= center_lon + lon_range):
-                    filtered_haz_minerals.append(site)
+            status = run(args)
+    finally:
+        extra['seconds'] = round(time.perf_counter() - start, 3)
+        extra['exit_status'] = status
+        profiling.write_report(report_path, **extra)
+        print(f"Wrote profile report: {report_path}")
+    sys.exit(status)
+
+def run(args):
+    """
+    Runs the command described by args. Returns the exit status.
+    """
+    if args.clear_cache:
+        http_cache.clear_cache()
+    if args.no_cache:
+        http_cache.configure(enabled=False)
+    warehouse.configure(enabled=not args.no_warehouse, path=args.warehouse)
+
+    print("--- ToxMap Scraper ---")
+    if args.queries[:1] == ['sync']:
+        for state, counts in sync_warehouse(args.queries[1:]).items():
+            print(f"Synced {state}: " + ", ".join(f"{count} {layer.replace('_', ' ')}" for layer, count in counts.items()))
+        return 0
+    if args.queries[:1] == ['build-zips']:
+        print(f"Wrote {build_zip_table(STATE_FIPS)} zips to the offline zip table.")
+        return 0
+    if args.queries[:1] == ['serve']:
+        serve(args.host, args.port, preload=args.queries[1:],
+              service=MapService(radius_miles=to_miles(args.radius, args.units)))
+        return 0
+    if args.queries[:1] == ['superoverlay']:
+        root, success = build_superoverlay(args.queries[1:], output_dir=args.output_dir,
+                                           tile_features=args.tile_features, precision=args.precision,
+                                           ring_radii=[to_miles(r, args.units) for r in args.rings],
+                                           ring_vertices=args.ring_vertices, render_workers=args.jobs)
+        print(f"{'Successfully created' if success else 'Some tiles failed; wrote'}: {root}")
+        return 0 if success else 1
+
+    queries = read_queries(args)
+    print(f"Fetching data for {len(queries)} search{'es' if len(queries) != 1 else ''}...")
 
-    print(f"Found {len(filtered_sites)} Toxic Sites.")
-    print(f"Found {len(filtered_towers)} Broadcast Towers (in range).")
-    print(f"Found {len(filtered_mines)} Active Mines.")
-    print(f"Found {len(filtered_inactive_mines)} Inactive Mines.")
-    print(f"Found {len(filtered_haz_minerals)} Hazardous Mineral Sites.")
-    
-    output_dir = os.path.join(os.getcwd(), 'output')
-    os.makedirs(output_dir, exist_ok=True)
-    safe_term = "".join([c for c in search_term if c.isalnum() or c in (' ', '_')]).strip()
-    output_file = os.path.join(output_dir, f"toxMap[{safe_term}].kml")
-    
-    print(f"Generating KML...")
-    success = generate_kml(filtered_sites, filtered_towers, filtered_mines, filtered_inactive_mines, filtered_haz_minerals, search_term, output_file)
-    
-    if success:
-        print(f"Successfully created: {output_file}")
+    if 'kml' not in args.formats:
+        writer = None
+    elif args.kmz:
+        writer = 'kmz'
     else:
-        print("Failed to generate KML.")
+        writer = 'stream' if args.stream else 'kml'
+    exports = [fmt for fmt in dict.fromkeys(args.formats) if fmt != 'kml']
+
+    results = run_query(queries, output_dir=args.output_dir, radius_miles=to_miles(args.radius, args.units),
+                        writer=writer, precision=args.precision,
+                        ring_radii=[to_miles(r, args.units) for r in args.rings],
+                        ring_vertices=args.ring_vertices, render_workers=args.jobs, exports=exports)
+
+    for result in results:
+        counts = result['counts']
+        print(f"{result['query']} -> {result['search_term']} ({'Zip' if result['is_zip'] else 'County'}, {result['state']}): "
+              f"{counts['sites']} Toxic Sites, {counts['towers']} Broadcast Towers (in range), "
+              f"{counts['mines']} Active Mines, {counts['inactive_mines']} Inactive Mines, "
+              f"{counts['hazardous_minerals']} Hazardous Mineral Sites.")
+        if result['success']:
+            print(f"Successfully created: {', '.join(result['output_files'])}")
+        else:
+            print(f"Failed to generate {', '.join(result['output_files'])}.")
+
+    return 0 if all(result['success'] for result in results) else 1
 
 if __name__ == "__main__":
     main()
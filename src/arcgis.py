@@ -0,0 +1,138 @@
+import math
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from src import profiling
+from src.http_cache import cached_get, DAY
+
+# Pages fetched at the same time for one layer
+DEFAULT_PAGE_WORKERS = 4
+
+# Used when a layer does not report maxRecordCount
+DEFAULT_MAX_RECORD_COUNT = 1000
+
+# Decimal places kept for lon/lat geometry (~0.1 m)
+LATLON_GEOMETRY_PRECISION = 6
+
+def get_json(url, params=None, ttl=DAY, timeout=60, headers=None):
+    """
+    GETs an ArcGIS REST endpoint and returns the decoded JSON.
+    Raises on HTTP errors and on ArcGIS error payloads (which come back as 200).
+    """
+    response = cached_get(url, params=params, headers=headers, ttl=ttl, timeout=timeout)
+    response.raise_for_status()
+    data = response.json()
+    if isinstance(data, dict) and 'error' in data:
+        error = data['error']
+        raise ValueError(f"ArcGIS error {error.get('code')}: {error.get('message')}")
+    return data
+
+def get_layer_info(layer_url, ttl=DAY, timeout=60, headers=None):
+    """
+    Returns the layer's metadata (maxRecordCount, objectIdField, capabilities...).
+    """
+    return get_json(layer_url, params={'f': 'json'}, ttl=ttl, timeout=timeout, headers=headers)
+
+def query_features(url, params, ttl=DAY, timeout=60, headers=None, max_workers=DEFAULT_PAGE_WORKERS):
+    """
+    Runs an ArcGIS /query and returns {'features': [...]} with every matching feature.
+
+    A single request is enough when the result fits in the layer's maxRecordCount.
+    Larger results are split into object-ID windows (or resultOffset pages when
+    IDs are unavailable) which are fetched in parallel and merged in order.
+
+    outFields is checked against the layer schema (see _compact_params), so
+    fetchers can list the attributes they read without breaking on layers
+    that lack some of them.
+    """
+    layer_url = url.rsplit('/query', 1)[0]
+
+    try:
+        info = get_layer_info(layer_url, ttl=ttl, timeout=timeout, headers=headers)
+    except Exception as e:
+        logging.warning(f"Could not read layer info for {layer_url}: {e}")
+        info = {}
+    page_size = info.get('maxRecordCount') or DEFAULT_MAX_RECORD_COUNT
+    params = _compact_params(params, info)
+
+    # Object IDs matching the query (IDs are not subject to maxRecordCount)
+    ids = None
+    oid_field = info.get('objectIdField')
+    try:
+        id_data = get_json(url, params={**params, 'returnIdsOnly': 'true', 'f': 'json'},
+                           ttl=ttl, timeout=timeout, headers=headers)
+        oid_field = id_data.get('objectIdFieldName') or oid_field
+        ids = sorted(id_data.get('objectIds') or [])
+    except Exception as e:
+        logging.warning(f"Could not list object IDs for {layer_url}: {e}")
+
+    if ids is not None and oid_field and len(ids) > page_size:
+        pages = [_oid_window_params(params, oid_field, ids[i:i + page_size])
+                 for i in range(0, len(ids), page_size)]
+    elif ids is None and _supports_pagination(info):
+        pages = _offset_pages(url, params, page_size, oid_field, ttl, timeout, headers)
+    else:
+        pages = [params]
+
+    if len(pages) == 1:
+        data = get_json(url, params=pages[0], ttl=ttl, timeout=timeout, headers=headers)
+        if data.get('exceededTransferLimit'):
+            logging.warning(f"{layer_url} returned a truncated result ({len(data.get('features', []))} features).")
+        return data
+
+    logging.info(f"Fetching {len(pages)} pages of {page_size} from {layer_url}...")
+    with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='page') as executor:
+        results = list(executor.map(profiling.propagate(
+            lambda page_params: get_json(url, params=page_params, ttl=ttl, timeout=timeout, headers=headers)),
+            pages))
+
+    data = dict(results[0])
+    data['features'] = [feature for result in results for feature in result.get('features', [])]
+    data.pop('exceededTransferLimit', None)
+    return data
+
+def _compact_params(params, info):
+    """
+    Trims the payload of a query: keeps only requested outFields that exist on
+    the layer (in the layer's spelling), drops Z/M values and rounds lon/lat
+    geometry to LATLON_GEOMETRY_PRECISION decimals.
+    """
+    params = {**params, 'returnZ': 'false', 'returnM': 'false'}
+
+    out_fields = params.get('outFields', '*')
+    layer_fields = {f['name'].upper(): f['name'] for f in info.get('fields') or [] if f.get('name')}
+    if out_fields != '*' and layer_fields:
+        kept = [layer_fields[name.strip().upper()] for name in out_fields.split(',')
+                if name.strip().upper() in layer_fields]
+        if not kept and info.get('objectIdField'):
+            kept = [info['objectIdField']]
+        params['outFields'] = ','.join(kept) if kept else '*'
+
+    if str(params.get('outSR')) == '4326':
+        params.setdefault('geometryPrecision', LATLON_GEOMETRY_PRECISION)
+    return params
+
+def _oid_window_params(params, oid_field, window_ids):
+    """
+    Restricts a query to the object-ID range covered by window_ids.
+    """
+    window = f"{oid_field} >= {window_ids[0]} AND {oid_field} <= {window_ids[-1]}"
+    where = params.get('where') or '1=1'
+    return {**params, 'where': window if where == '1=1' else f"({where}) AND {window}"}
+
+def _supports_pagination(info):
+    return bool(info.get('advancedQueryCapabilities', {}).get('supportsPagination'))
+
+def _offset_pages(url, params, page_size, oid_field, ttl, timeout, headers):
+    """
+    Builds resultOffset pages from the query's feature count.
+    """
+    count_data = get_json(url, params={**params, 'returnCountOnly': 'true', 'f': 'json'},
+                          ttl=ttl, timeout=timeout, headers=headers)
+    count = count_data.get('count') or 0
+    if oid_field:
+        # Stable ordering so pages do not overlap
+        params = {**params, 'orderByFields': oid_field}
+    pages = []
+    for page in range(max(1, math.ceil(count / page_size))):
+        pages.append({**params, 'resultOffset': page * page_size, 'resultRecordCount': page_size})
+    return pages
@@ -1,14 +1,72 @@
-import requests
 import pandas as pd
-import io
+import csv
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from src import features, profiling, warehouse, zip_table
+from src.http_cache import cached_get, cached_stream, HOUR, DAY
+from src.spatial import DEFAULT_RADIUS_MILES, ID_DEQ_LANDFILL_OFFSET_DEG, bbox_around
+from src.arcgis import query_features, get_layer_info
+from src.geometry import COUNTY_TOLERANCE_DEG, generalization_tolerance, simplify_ring
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Attributes each ArcGIS source reads (requested instead of outFields=*)
+WA_DNR_MINE_FIELDS = ['MINE_NAME', 'LATITUDE', 'LONGITUDE', 'COUNTY_NAME', 'APPLICANT_NAME', 'COMMODITY_DESC', 'MINE_PERMIT_NUMBER']
+WA_DNR_IAML_FIELDS = ['SITE_NAME', 'LATITUDE', 'LONGITUDE', 'COUNTY', 'COMMODITY', 'COMMENT']
+WA_DNR_HAZARDOUS_MINERAL_FIELDS = ['SITE_NAME', 'NAMED_UNITS', 'LITHOLOGY', 'COMMODITY', 'COUNTY']
+MT_MINE_FIELDS = ['Name', 'DLAT', 'DLONG', 'County', 'Prop_Type', 'Status', 'Com']
+ID_MINE_FIELDS = ['PropName', 'NAD27lat', 'NAD27long', 'County', 'Commod1', 'PropType']
+ID_DEQ_PCI_FIELDS = ['FACILITY', 'ADDRESS', 'CITY', 'COUNTY', 'ZIPCODE', 'LATITUDE', 'LONGITUDE', 'HOTLINK', 'FAC_TYPE', 'CONTAMINAN', 'DESCRIPTION']
+ID_DEQ_LANDFILL_FIELDS = ['SITENAME', 'COUNTY', 'STATUS', 'TYPE', 'CONTAMINANT']
+TOWER_FIELDS = ['CALLSIGN', 'LICENSEE', 'ERP']
+
+# Default number of sources fetched at the same time by fetch_all_data
+DEFAULT_MAX_WORKERS = 12
+
+# How long cached responses are trusted before revalidation, per source
+CACHE_TTL = {
+    'tri': 30 * DAY,       # TRI basic download is republished a few times a year
+    'towers': 30 * DAY,    # HIFLD national towers
+    'arcgis': 7 * DAY,     # State GIS layers (DNR, MBMG, IGS, ID DEQ)
+    'ecology': 12 * HOUR,  # WA Ecology cleanup export changes most often
+    'location': 90 * DAY   # Zip lookups
+}
+
+# TRI columns we read (after cleaning the header) and their dtypes
+TRI_COLUMNS = {
+    'TRIFD': 'str',
+    'FACILITY_NAME': 'str',
+    'STREET_ADDRESS': 'str',
+    'CITY': 'str',
+    'COUNTY': 'str',
+    'ZIP': 'str',
+    'LATITUDE': 'float64',
+    'LONGITUDE': 'float64',
+    'CHEMICAL': 'str',
+    'CARCINOGEN': 'str',
+    'TOTAL_RELEASES': 'float64'
+}
+
+# Alternate header spellings seen in TRI downloads
+TRI_COLUMN_ALIASES = {
+    'TRI_FACILITY_ID': 'TRIFD'
+}
+
+def _clean_tri_column(column):
+    """
+    Normalizes a TRI CSV header: drops the "1. ", "2. " numbering and uses underscores.
+    """
+    column = column.split('.', 1)[-1] if '.' in column else column
+    column = column.strip().replace(' ', '_')
+    return TRI_COLUMN_ALIASES.get(column, column)
+
 def fetch_epa_tri_data(year=2023, state='WA'):
     """
     Fetches EPA TRI Basic Data for a specific year and state.
+    The CSV is streamed into pandas, reading only TRI_COLUMNS, and records are
+    built column-wise. The download has one row per facility per chemical;
+    rows are merged into one record per facility (see _aggregate_tri_facilities).
     Returns a list of dictionaries with site details.
     """
     logging.info(f"Fetching EPA TRI data for {state} {year}...")
@@ -16,43 +74,81 @@ def fetch_epa_tri_data(year=2023, state='WA'):
     url = f"https://data.epa.gov/efservice/downloads/tri/mv_tri_basic_download/{year}_{state}/csv"
     
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        
-        # Parse CSV
-        df = pd.read_csv(io.StringIO(response.text))
-        
-        # Clean column names (remove "1. ", "2. ", etc.)
-        df.columns = [c.split('.', 1)[-1].strip() if '.' in c else c.strip() for c in df.columns]
-        
-        sites = []
-        for _, row in df.iterrows():
-            # Filter out rows without coordinates
-            if pd.isna(row.get('LATITUDE')) or pd.isna(row.get('LONGITUDE')):
-                continue
-                
-            site = {
-                'name': row.get('FACILITY_NAME', 'Unknown Facility'),
-                'address': row.get('STREET_ADDRESS', ''),
-                'city': row.get('CITY', ''),
-                'county': str(row.get('COUNTY', '')).upper(), # Added County
-                'zip': str(row.get('ZIP', '')).split('-')[0], # Handle zip+4
-                'lat': row.get('LATITUDE'),
-                'lon': row.get('LONGITUDE'),
-                'source': 'EPA TRI',
-                'url': url,
-                'details': f"Chemicals: {row.get('CHEMICAL', 'N/A')}; Carcinogen: {row.get('CARCINOGEN', 'N/A')}",
-                'rank': 'N/A' # TRI doesn't have a simple rank, default to N/A
-            }
-            sites.append(site)
+        with cached_stream(url, ttl=CACHE_TTL['tri']) as stream:
+            # Read the header ourselves so usecols/dtype can use the cleaned names
+            header = next(csv.reader([stream.readline().decode('utf-8-sig')]))
+            names = [_clean_tri_column(c) for c in header]
+            usecols = [n for n in names if n in TRI_COLUMNS]
+            with profiling.stage('read_csv') as record:
+                df = pd.read_csv(stream, header=None, names=names, usecols=usecols,
+                                 dtype={n: TRI_COLUMNS[n] for n in usecols})
+                record['rows'] = len(df)
+
+        df = df.reindex(columns=list(TRI_COLUMNS))
+
+        # Filter out rows without coordinates
+        df = df.dropna(subset=['LATITUDE', 'LONGITUDE'])
+        with profiling.stage('aggregate', rows=len(df)) as record:
+            facilities = _aggregate_tri_facilities(df)
+            record['out'] = len(facilities)
+
+        records = pd.DataFrame({
+            'name': facilities['FACILITY_NAME'].fillna('Unknown Facility'),
+            'address': facilities['STREET_ADDRESS'].fillna(''),
+            'city': facilities['CITY'].fillna(''),
+            'county': facilities['COUNTY'].fillna('').str.upper(),
+            'zip': facilities['ZIP'].fillna('').str.split('-').str[0], # Handle zip+4
+            'lat': facilities['LATITUDE'],
+            'lon': facilities['LONGITUDE'],
+            'source': 'EPA TRI',
+            'url': url,
+            'details': "Chemicals: " + facilities['chemicals'] + "; Carcinogen: " + facilities['carcinogen']
+                       + "; Total Releases: " + facilities['releases'],
+            'rank': 'N/A', # TRI doesn't have a simple rank, default to N/A
+            'facility_id': facilities['TRIFD'].fillna('')
+        })
+        sites = records.to_dict('records')
             
-        logging.info(f"Found {len(sites)} sites from EPA TRI.")
+        logging.info(f"Found {len(sites)} facilities from EPA TRI ({len(df)} chemical rows).")
         return sites
         
     except Exception as e:
         logging.error(f"Error fetching EPA TRI data: {e}")
         return []
 
+def _aggregate_tri_facilities(df):
+    """
+    Merges TRI rows (one per facility per chemical) into one row per facility.
+    Facilities are keyed by TRIFD, or by name plus coordinates when it is missing.
+    Adds 'chemicals', 'carcinogen' and 'releases' display columns.
+    """
+    df = df.copy()
+    fallback_key = (df['FACILITY_NAME'].fillna('') + '|' + df['LATITUDE'].astype(str)
+                    + '|' + df['LONGITUDE'].astype(str))
+    df['facility_key'] = df['TRIFD'].fillna(fallback_key)
+    df['CHEMICAL'] = df['CHEMICAL'].fillna('N/A')
+    df['CARCINOGEN'] = df['CARCINOGEN'].fillna('N/A').str.upper()
+
+    grouped = df.groupby('facility_key', sort=False)
+    facilities = grouped[['TRIFD', 'FACILITY_NAME', 'STREET_ADDRESS', 'CITY', 'COUNTY', 'ZIP',
+                          'LATITUDE', 'LONGITUDE']].first()
+
+    chemicals = df.drop_duplicates(['facility_key', 'CHEMICAL'])
+    facilities['chemicals'] = chemicals.groupby('facility_key', sort=False)['CHEMICAL'].agg(', '.join)
+
+    # YES if any chemical is a carcinogen (listing which), else NO / N/A
+    carcinogens = chemicals[chemicals['CARCINOGEN'] == 'YES']
+    carcinogen_names = carcinogens.groupby('facility_key', sort=False)['CHEMICAL'].agg(', '.join)
+    any_no = chemicals[chemicals['CARCINOGEN'] == 'NO'].groupby('facility_key', sort=False).size()
+    facilities['carcinogen'] = 'N/A'
+    facilities.loc[facilities.index.isin(any_no.index), 'carcinogen'] = 'NO'
+    facilities.loc[carcinogen_names.index, 'carcinogen'] = 'YES (' + carcinogen_names + ')'
+
+    releases = grouped['TOTAL_RELEASES'].sum(min_count=1)
+    facilities['releases'] = releases.map(lambda v: 'N/A' if pd.isna(v) else f"{v:,.1f} lbs")
+
+    return facilities.reset_index(drop=True)
+
 def fetch_transmission_lines():
     """
     Fetches High Voltage Transmission Lines.
@@ -61,19 +157,35 @@ def fetch_transmission_lines():
     logging.info("Fetching Transmission Lines... (DISABLED)")
     return []
 
-def fetch_broadcast_towers():
+# HIFLD FM Transmission Towers (Open Data item)
+TOWERS_DATASET_ID = "2bfd434d9263401eadae464a9c26104f_0"
+TOWERS_DATASET_URL = f"https://hifld-geoplatform.opendata.arcgis.com/datasets/{TOWERS_DATASET_ID}"
+
+# Add User-Agent to avoid 400 Bad Request
+TOWERS_HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
+
+def fetch_broadcast_towers(bbox=None):
     """
     Fetches Broadcast Towers from ArcGIS Open Data.
+    If bbox (xmin, ymin, xmax, ymax in lon/lat) is provided, only towers inside it are
+    requested from the dataset's FeatureServer. Falls back to the national GeoJSON
+    (filtered locally) if the service cannot be queried.
     Returns a list of dictionaries with tower details.
     """
     logging.info("Fetching Broadcast Towers...")
-    url = "https://opendata.arcgis.com/datasets/2bfd434d9263401eadae464a9c26104f_0.geojson"
-    
-    # Add User-Agent to avoid 400 Bad Request
-    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
-    
+
+    if bbox:
+        service_url = _resolve_towers_service()
+        if service_url:
+            towers = _query_broadcast_towers(service_url, bbox)
+            if towers is not None:
+                return towers
+        logging.warning("Tower FeatureServer query unavailable, falling back to national GeoJSON.")
+
+    url = f"https://opendata.arcgis.com/datasets/{TOWERS_DATASET_ID}.geojson"
+
     try:
-        response = requests.get(url, headers=headers)
+        response = cached_get(url, headers=TOWERS_HEADERS, ttl=CACHE_TTL['towers'])
         response.raise_for_status()
         data = response.json()
         
@@ -86,17 +198,9 @@ def fetch_broadcast_towers():
                 coords = geom.get('coordinates', [])
                 if len(coords) >= 2:
                     lon, lat = coords[0], coords[1]
-                    
-                    tower = {
-                        'name': props.get('CALLSIGN', 'Unknown Tower'),
-                        'lat': lat,
-                        'lon': lon,
-                        'source': 'Broadcast Towers',
-                        'url': 'https://hifld-geoplatform.opendata.arcgis.com/datasets/2bfd434d9263401eadae464a9c26104f_0',
-                        'details': f"Licensee: {props.get('LICENSEE', 'Unknown')}; ERP: {props.get('ERP', 'Unknown')}",
-                        'type': 'Tower'
-                    }
-                    towers.append(tower)
+                    if bbox and not (bbox[0] <= lon <= bbox[2] and bbox[1] <= lat <= bbox[3]):
+                        continue
+                    towers.append(_build_tower(props, lat, lon))
                     
         logging.info(f"Found {len(towers)} broadcast towers.")
         return towers
@@ -105,31 +209,119 @@ def fetch_broadcast_towers():
         logging.error(f"Error fetching Broadcast Towers: {e}")
         return []
 
-def fetch_wa_dnr_mines():
+def fetch_broadcast_towers_for_search(search_term, is_zip=True, state='WA', lat=None, lon=None, radius_miles=DEFAULT_RADIUS_MILES):
+    """
+    Fetches Broadcast Towers inside the search envelope (see get_search_bbox).
+    """
+    return fetch_broadcast_towers(get_search_bbox(search_term, is_zip, state, lat, lon, radius_miles))
+
+def _build_tower(props, lat, lon):
+    return {
+        'name': props.get('CALLSIGN', 'Unknown Tower'),
+        'lat': lat,
+        'lon': lon,
+        'source': 'Broadcast Towers',
+        'url': TOWERS_DATASET_URL,
+        'details': f"Licensee: {props.get('LICENSEE', 'Unknown')}; ERP: {props.get('ERP', 'Unknown')}",
+        'type': 'Tower'
+    }
+
+def _resolve_towers_service():
+    """
+    Looks up the FeatureServer layer behind the HIFLD Open Data item via the Hub API.
+    Returns the layer URL or None.
+    """
+    url = f"https://hub.arcgis.com/api/v3/datasets/{TOWERS_DATASET_ID}"
+    try:
+        response = cached_get(url, headers=TOWERS_HEADERS, timeout=30, ttl=CACHE_TTL['towers'])
+        response.raise_for_status()
+        return response.json()['data']['attributes']['url'].rstrip('/')
+    except Exception as e:
+        logging.error(f"Error resolving Broadcast Towers service: {e}")
+        return None
+
+def _query_broadcast_towers(service_url, bbox):
+    """
+    Queries the towers FeatureServer with an envelope.
+    Returns a list of towers, or None if the query failed.
+    """
+    params = {
+        'where': "1=1",
+        'outFields': ','.join(TOWER_FIELDS),
+        'f': 'json',
+        'outSR': '4326',
+        'geometry': ",".join(str(v) for v in bbox),
+        'geometryType': 'esriGeometryEnvelope',
+        'spatialRel': 'esriSpatialRelIntersects',
+        'inSR': '4326'
+    }
+    logging.info(f"Querying Broadcast Towers in bbox: {params['geometry']}")
+
+    try:
+        data = query_features(f"{service_url}/query", params, ttl=CACHE_TTL['towers'], timeout=60, headers=TOWERS_HEADERS)
+
+        towers = []
+        for feature in data.get('features', []):
+            attrs = feature.get('attributes', {})
+            geom = feature.get('geometry') or {}
+            if geom.get('x') is None or geom.get('y') is None:
+                continue
+            towers.append(_build_tower(attrs, geom['y'], geom['x']))
+
+        logging.info(f"Found {len(towers)} broadcast towers.")
+        return towers
+
+    except Exception as e:
+        logging.error(f"Error querying Broadcast Towers: {e}")
+        return None
+
+def _apply_search_filter(params, county_field, county=None, bbox=None):
+    """
+    Pushes a county predicate (on county_field) or a lon/lat envelope into
+    ArcGIS query params so the server only returns the search area.
+    """
+    params = dict(params)
+    if county:
+        county_name = county.upper().replace("'", "''")
+        params['where'] = f"UPPER({county_field}) LIKE '%{county_name}%'"
+    elif bbox:
+        params['geometry'] = ",".join(str(v) for v in bbox)
+        params['geometryType'] = 'esriGeometryEnvelope'
+        params['spatialRel'] = 'esriSpatialRelIntersects'
+        params['inSR'] = '4326'
+    return params
+
+def _layer_has_field(layer_url, field_name):
+    """
+    True if the layer's schema lists field_name (or it cannot be read).
+    """
+    try:
+        info = get_layer_info(layer_url, ttl=CACHE_TTL['arcgis'])
+    except Exception as e:
+        logging.warning(f"Could not read fields for {layer_url}: {e}")
+        return True
+    fields = info.get('fields')
+    if fields is None:
+        return True
+    return any(f.get('name', '').upper() == field_name for f in fields)
+
+def fetch_wa_dnr_mines(county=None, bbox=None):
     """
     Fetches Active Surface Mine Permits from WA DNR.
+    county / bbox restrict the query on the server (see _apply_search_filter).
     Returns a list of dictionaries with mine details.
     """
     logging.info("Fetching WA DNR Active Surface Mines...")
     url = "https://gis.dnr.wa.gov/site1/rest/services/Public_Geology/Active_Surface_Mine_Permit_Sites/MapServer/0/query"
-    params = {
+    params = _apply_search_filter({
         'where': "1=1",
-        'outFields': '*',
+        'outFields': ','.join(WA_DNR_MINE_FIELDS),
         'f': 'json'
-    }
+    }, 'COUNTY_NAME', county, bbox)
     
     try:
-        response = requests.get(url, params=params)
-        response.raise_for_status()
-        
-        # Handle text/plain response from ArcGIS
-        try:
-            data = response.json()
-        except:
-            if 'json' in response.headers.get('Content-Type', '') or 'text/plain' in response.headers.get('Content-Type', ''):
-                 data = json.loads(response.text)
-            else:
-                raise ValueError("Invalid response format")
+        # ArcGIS may answer text/plain; query_features decodes JSON regardless
+        data = query_features(url, params, ttl=CACHE_TTL['arcgis'])
 
         mines = []
         for feature in data.get('features', []):
@@ -174,18 +366,20 @@ def fetch_wa_dnr_mines():
 def fetch_wa_ecology_data(search_term, is_zip=True):
     """
     Fetches WA Ecology Cleanup Sites using the user-provided API.
-    Supports filtering by Zip or County.
+    Supports filtering by Zip or County; search_term=None fetches the whole state.
     """
     logging.info(f"Fetching WA Ecology Cleanup Sites for {'Zip' if is_zip else 'County'} {search_term}...")
     
     base_url = "https://apps.ecology.wa.gov/cleanupsearch/reports/cleanup/all/export?format=json"
-    if is_zip:
+    if search_term is None:
+        url = base_url
+    elif is_zip:
         url = f"{base_url}&Zip={search_term}"
     else:
         url = f"{base_url}&County={search_term}"
         
     try:
-        response = requests.get(url)
+        response = cached_get(url, ttl=CACHE_TTL['ecology'])
         response.raise_for_status()
         data = response.json()
         
@@ -195,7 +389,9 @@ def fetch_wa_ecology_data(search_term, is_zip=True):
             item_zip = str(item.get('ZipCode', ''))
             item_county = str(item.get('County', '')).upper()
             
-            if is_zip:
+            if search_term is None:
+                pass
+            elif is_zip:
                 # Strict Zip filtering
                 if search_term not in item_zip:
                      continue
@@ -246,60 +442,117 @@ def fetch_epa_superfund_data():
 def fetch_epa_rcra_data():
     return []
 
-def fetch_all_data(search_term, is_zip=True, state='WA', lat=None, lon=None):
+def fetch_all_data(search_term, is_zip=True, state='WA', lat=None, lon=None, max_workers=DEFAULT_MAX_WORKERS,
+                   radius_miles=DEFAULT_RADIUS_MILES, use_warehouse=True, as_table=False):
     """
     Orchestrates fetching data from all sources based on state.
+    radius_miles sizes the spatial queries pushed down to the servers.
+    search_term=None (with is_zip=False) fetches every source statewide.
+    Independent sources (and each hazardous mineral layer) are fetched concurrently
+    on a thread pool of at most max_workers threads, so the run takes roughly as
+    long as the slowest single source.
+    If the state has a fresh warehouse snapshot (see warehouse.is_synced), the
+    search is answered locally instead, unless use_warehouse is False.
+    Returns a 5-tuple of record lists, or with as_table=True one feature
+    table holding every layer (see features.to_table).
     """
-    sites = []
-    towers = []
-    mines = []
-    inactive_mines = []
-    hazardous_minerals = []
-    
+    if use_warehouse and warehouse.is_synced(state):
+        logging.info(f"Answering {search_term or state} from the local warehouse...")
+        with profiling.stage('warehouse', state=state, search=search_term) as record:
+            data = warehouse.load_search(search_term, is_zip, state, lat, lon, radius_miles)
+            record['out'] = dict(zip(warehouse.LAYERS, (len(layer) for layer in data)))
+        return features.to_table(data) if as_table else data
+
+    # Each task is (group, fetcher, args, kwargs). Groups map onto the returned
+    # tuple and keep the same ordering as the sequential version.
+    tasks = []
+
     # 1. Toxic Sites
     # WA Ecology (Only for WA)
     if state == 'WA':
-        sites.extend(fetch_wa_ecology_data(search_term, is_zip))
-    
+        tasks.append(('sites', fetch_wa_ecology_data, (search_term, is_zip), {}))
+
     # EPA TRI (All States)
-    sites.extend(fetch_epa_tri_data(state=state))
-    
-    # 2. Broadcast Towers (All States - HIFLD is national)
-    towers = fetch_broadcast_towers()
-    
+    tasks.append(('sites', fetch_epa_tri_data, (), {'state': state}))
+
+    # 2. Broadcast Towers (All States - HIFLD is national, queried by envelope)
+    tasks.append(('towers', fetch_broadcast_towers_for_search, (search_term, is_zip, state, lat, lon, radius_miles), {}))
+
     # 3. Mines & Minerals (State Specific)
     if state == 'WA':
-        mines = fetch_wa_dnr_mines()
-        inactive_mines = fetch_wa_dnr_inactive_mines()
-        hazardous_minerals = fetch_wa_dnr_hazardous_minerals()
+        # Push the county (or the zip's radius envelope) down into the DNR queries
+        search_filter = {
+            'county': None if is_zip else search_term,
+            'bbox': bbox_around(lat, lon, radius_miles) if is_zip and lat and lon else None
+        }
+        tasks.append(('mines', fetch_wa_dnr_mines, (), search_filter))
+        tasks.append(('inactive_mines', fetch_wa_dnr_inactive_mines, (), search_filter))
+        for layer_id, layer_name in HAZARDOUS_MINERAL_LAYERS.items():
+            tasks.append(('hazardous_minerals', fetch_wa_dnr_hazardous_mineral_layer, (layer_id, layer_name), search_filter))
     elif state == 'MT':
-        mines = fetch_mt_mines(lat=lat, lon=lon)
         # MT MBMG includes inactive/abandoned in the same layer, so we put them in 'mines'
+        tasks.append(('mines', fetch_mt_mines, (), {'lat': lat, 'lon': lon, 'radius_miles': radius_miles}))
     elif state == 'ID':
-        mines = fetch_id_mines(lat=lat, lon=lon)
-        sites.extend(fetch_id_deq_data(search_term, is_zip, lat, lon))
-    
-    return sites, towers, mines, inactive_mines, hazardous_minerals
+        tasks.append(('mines', fetch_id_mines, (), {'lat': lat, 'lon': lon, 'radius_miles': radius_miles}))
+        tasks.append(('sites', fetch_id_deq_data, (search_term, is_zip, lat, lon), {}))
+
+    results = {
+        'sites': [],
+        'towers': [],
+        'mines': [],
+        'inactive_mines': [],
+        'hazardous_minerals': []
+    }
+
+    logging.info(f"Fetching {len(tasks)} sources with up to {max_workers} workers...")
+    with profiling.stage('fetch_all_data', state=state, search=search_term) as record, \
+            ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='fetch') as executor:
+        futures = [(group, fetcher, executor.submit(profiling.propagate(_timed_fetch), fetcher, args, kwargs))
+                   for group, fetcher, args, kwargs in tasks]
+
+        # Collect in submission order so output ordering is deterministic
+        for group, fetcher, future in futures:
+            try:
+                results[group].extend(future.result())
+            except Exception as e:
+                logging.error(f"Error in {fetcher.__name__}: {e}")
+        record['out'] = {group: len(layer) for group, layer in results.items()}
+
+    if state == 'WA':
+        logging.info(f"Found {len(results['hazardous_minerals'])} Hazardous Mineral sites/areas.")
+
+    data = results['sites'], results['towers'], results['mines'], results['inactive_mines'], results['hazardous_minerals']
+    return features.to_table(data) if as_table else data
+
+def _timed_fetch(fetcher, args, kwargs):
+    """
+    Runs one fetch_all_data task as a profiling stage named after the
+    fetcher (and its layer, for per-layer fetchers), counting records out.
+    """
+    name = fetcher.__name__ + (f"[{args[0]}]" if fetcher is fetch_wa_dnr_hazardous_mineral_layer else '')
+    with profiling.stage(name) as record:
+        result = fetcher(*args, **kwargs)
+        record['out'] = len(result)
+    return result
 
-def fetch_wa_dnr_inactive_mines():
+def fetch_wa_dnr_inactive_mines(county=None, bbox=None):
     """
     Fetches Inactive and Abandoned Mine Lands (IAML) from WA DNR.
     Layer 8: IAML Sites (Points)
+    county / bbox restrict the query on the server (see _apply_search_filter).
     """
     logging.info("Fetching WA DNR Inactive Mines (IAML)...")
     mines = []
     url = "https://gis.dnr.wa.gov/site1/rest/services/Public_Geology/Mines_and_Minerals/MapServer/8/query"
-    params = {
+    params = _apply_search_filter({
         'where': "1=1",
-        'outFields': '*',
+        'outFields': ','.join(WA_DNR_IAML_FIELDS),
         'f': 'json',
         'outSR': '4326'
-    }
+    }, 'COUNTY', county, bbox)
     
     try:
-        response = requests.get(url, params=params)
-        response.raise_for_status()
-        data = response.json()
+        data = query_features(url, params, ttl=CACHE_TTL['arcgis'])
         
         for feature in data.get('features', []):
             attrs = feature.get('attributes', {})
@@ -337,97 +590,120 @@ def fetch_wa_dnr_inactive_mines():
         
     return mines
 
-def fetch_wa_dnr_hazardous_minerals():
+# WA DNR Hazardous Minerals layer IDs and Names
+HAZARDOUS_MINERAL_LAYERS = {
+    14: "Hazardous Minerals", # Likely Group, but we check
+    15: "Mercury Locations",
+    16: "Asbestos Locations",
+    17: "Arsenic Locations",
+    18: "Asbestos Bearing Rocks", # Polygon
+    20: "Radon Hazard--Radon Locations",
+    21: "Radon Hazard--Uranium Bearing Rocks" # Polygon
+}
+
+def fetch_wa_dnr_hazardous_minerals(county=None, bbox=None):
     """
     Fetches Hazardous Minerals from WA DNR.
     Layers: 14-18, 20-21.
     """
     logging.info("Fetching WA DNR Hazardous Minerals...")
     haz_sites = []
-    
-    # Layer IDs and Names
-    layers = {
-        14: "Hazardous Minerals", # Likely Group, but we check
-        15: "Mercury Locations",
-        16: "Asbestos Locations",
-        17: "Arsenic Locations",
-        18: "Asbestos Bearing Rocks", # Polygon
-        20: "Radon Hazard--Radon Locations",
-        21: "Radon Hazard--Uranium Bearing Rocks" # Polygon
-    }
-    
+
+    for layer_id, layer_name in HAZARDOUS_MINERAL_LAYERS.items():
+        haz_sites.extend(fetch_wa_dnr_hazardous_mineral_layer(layer_id, layer_name, county, bbox))
+
+    logging.info(f"Found {len(haz_sites)} Hazardous Mineral sites/areas.")
+    return haz_sites
+
+def fetch_wa_dnr_hazardous_mineral_layer(layer_id, layer_name, county=None, bbox=None, tolerance_deg=None):
+    """
+    Fetches a single WA DNR Hazardous Minerals layer.
+    County searches use a COUNTY where-clause on layers that have the field and
+    the county's extent on layers that don't (e.g. the rock polygons).
+    Polygons are generalized to tolerance_deg (default: one output pixel of the
+    search extent, or COUNTY_TOLERANCE_DEG statewide), on the server via
+    maxAllowableOffset and again on the client for servers that ignore it.
+    Returns a list of point/polygon site dictionaries.
+    """
+    logging.info(f"Fetching Layer {layer_id}: {layer_name}...")
+    haz_sites = []
     base_url = "https://gis.dnr.wa.gov/site1/rest/services/Public_Geology/Mines_and_Minerals/MapServer"
-    
-    for layer_id, layer_name in layers.items():
-        logging.info(f"Fetching Layer {layer_id}: {layer_name}...")
-        url = f"{base_url}/{layer_id}/query"
-        params = {
-            'where': "1=1",
-            'outFields': '*',
-            'f': 'json',
-            'outSR': '4326' # Request Lat/Lon for all
-        }
-        
-        try:
-            response = requests.get(url, params=params)
-            if response.status_code != 200:
+    url = f"{base_url}/{layer_id}/query"
+    params = {
+        'where': "1=1",
+        'outFields': ','.join(WA_DNR_HAZARDOUS_MINERAL_FIELDS),
+        'f': 'json',
+        'outSR': '4326' # Request Lat/Lon for all
+    }
+
+    try:
+        if county and not _layer_has_field(f"{base_url}/{layer_id}", 'COUNTY'):
+            county, bbox = None, bbox or get_county_bbox(county, 'WA')
+        if tolerance_deg is None:
+            extent = bbox or (get_county_bbox(county, 'WA') if county else None)
+            tolerance_deg = generalization_tolerance(extent) if extent else COUNTY_TOLERANCE_DEG
+        params = _apply_search_filter(params, 'COUNTY', county, bbox)
+        params['maxAllowableOffset'] = tolerance_deg
+
+        data = query_features(url, params, ttl=CACHE_TTL['arcgis'])
+        features = data.get('features', [])
+
+        for feature in features:
+            attrs = feature.get('attributes', {})
+            geom = feature.get('geometry', {})
+
+            site = {
+                'name': attrs.get('SITE_NAME', attrs.get('NAMED_UNITS', layer_name)),
+                'source': f"WA DNR {layer_name}",
+                'url': f"{base_url}/{layer_id}",
+                'details': f"Layer: {layer_name}; Lithology: {attrs.get('LITHOLOGY', 'N/A')}; Commodity: {attrs.get('COMMODITY', 'N/A')}",
+                'type': 'Hazardous Mineral',
+                'layer_id': layer_id,
+                'county': str(attrs.get('COUNTY', '')).upper()
+            }
+
+            # Handle Geometry
+            if 'x' in geom and 'y' in geom:
+                # Point
+                site['lat'] = geom['y']
+                site['lon'] = geom['x']
+                site['geom_type'] = 'Point'
+            elif 'rings' in geom:
+                # Polygon
+                site['rings'] = [simplify_ring(r, tolerance_deg) for r in geom['rings']]
+                site['geom_type'] = 'Polygon'
+                # Calculate centroid for filtering
+                # Simple average of first ring (as received)
+                ring = geom['rings'][0]
+                avg_lon = sum(p[0] for p in ring) / len(ring)
+                avg_lat = sum(p[1] for p in ring) / len(ring)
+                site['lat'] = avg_lat
+                site['lon'] = avg_lon
+            else:
                 continue
-                
-            data = response.json()
-            features = data.get('features', [])
-            
-            for feature in features:
-                attrs = feature.get('attributes', {})
-                geom = feature.get('geometry', {})
-                
-                site = {
-                    'name': attrs.get('SITE_NAME', attrs.get('NAMED_UNITS', layer_name)),
-                    'source': f"WA DNR {layer_name}",
-                    'url': f"{base_url}/{layer_id}",
-                    'details': f"Layer: {layer_name}; Lithology: {attrs.get('LITHOLOGY', 'N/A')}; Commodity: {attrs.get('COMMODITY', 'N/A')}",
-                    'type': 'Hazardous Mineral',
-                    'layer_id': layer_id,
-                    'county': str(attrs.get('COUNTY', '')).upper()
-                }
-                
-                # Handle Geometry
-                if 'x' in geom and 'y' in geom:
-                    # Point
-                    site['lat'] = geom['y']
-                    site['lon'] = geom['x']
-                    site['geom_type'] = 'Point'
-                elif 'rings' in geom:
-                    # Polygon
-                    site['rings'] = geom['rings']
-                    site['geom_type'] = 'Polygon'
-                    # Calculate centroid for filtering
-                    # Simple average of first ring
-                    ring = geom['rings'][0]
-                    avg_lon = sum(p[0] for p in ring) / len(ring)
-                    avg_lat = sum(p[1] for p in ring) / len(ring)
-                    site['lat'] = avg_lat
-                    site['lon'] = avg_lon
-                else:
-                    continue
-                
-                haz_sites.append(site)
-                
-        except Exception as e:
-            logging.error(f"Error fetching layer {layer_id}: {e}")
-            
-    logging.info(f"Found {len(haz_sites)} Hazardous Mineral sites/areas.")
+
+            haz_sites.append(site)
+
+    except Exception as e:
+        logging.error(f"Error fetching layer {layer_id}: {e}")
+
     return haz_sites
 
 def get_county_for_zip(zipcode):
     """
-    Determines the county for a given zip code using the WA Ecology API.
+    Determines the county for a given zip code from the offline zip table,
+    falling back to the WA Ecology API (and remembering the answer).
     Returns the county name (string) or None if not found.
     """
+    entry = zip_table.lookup(zipcode)
+    if entry and entry.get('county'):
+        return entry['county']
+
     logging.info(f"Looking up County for Zip {zipcode}...")
     url = f"https://apps.ecology.wa.gov/cleanupsearch/reports/cleanup/all/export?format=json&Zip={zipcode}"
     
     try:
-        response = requests.get(url)
+        response = cached_get(url, ttl=CACHE_TTL['ecology'])
         response.raise_for_status()
         data = response.json()
         
@@ -440,6 +716,7 @@ def get_county_for_zip(zipcode):
                     county = item.get('County')
                     if county:
                         logging.info(f"Found County: {county}")
+                        zip_table.remember(zipcode, county=county)
                         return county
     except Exception as e:
         logging.error(f"Error looking up county: {e}")
@@ -448,15 +725,29 @@ def get_county_for_zip(zipcode):
 
 def get_location_details(zipcode):
     """
-    Determines State, County, and City from Zip Code using Zippopotam.us.
+    Determines State, County, and City from Zip Code using the offline zip
+    table, falling back to Zippopotam.us (and remembering the answer).
     Returns a dict with details or None.
     """
+    entry = zip_table.lookup(zipcode)
+    if entry and entry.get('state') and entry.get('lat') is not None:
+        return {
+            'zip': zipcode,
+            'state': entry['state'],
+            'county': entry.get('county') or entry.get('city'),
+            'city': entry.get('city') or entry.get('county'),
+            'lat': entry['lat'],
+            'lon': entry['lon']
+        }
+
     url = f"http://api.zippopotam.us/us/{zipcode}"
     try:
-        response = requests.get(url, timeout=10)
+        response = cached_get(url, timeout=10, ttl=CACHE_TTL['location'])
         if response.status_code == 200:
             data = response.json()
             place = data['places'][0]
+            zip_table.remember(zipcode, state=place['state abbreviation'], city=place['place name'],
+                               lat=float(place['latitude']), lon=float(place['longitude']))
             return {
                 'zip': zipcode,
                 'state': place['state abbreviation'],
@@ -469,7 +760,63 @@ def get_location_details(zipcode):
         logging.error(f"Error looking up zip {zipcode}: {e}")
     return None
 
-def fetch_mt_mines(lat=None, lon=None, radius_miles=10):
+# Approximate state extents (xmin, ymin, xmax, ymax in lon/lat)
+STATE_BBOXES = {
+    'WA': (-124.85, 45.54, -116.91, 49.00),
+    'MT': (-116.05, 44.36, -104.04, 49.00),
+    'ID': (-117.24, 41.99, -111.04, 49.00)
+}
+
+STATE_FIPS = {'WA': '53', 'MT': '30', 'ID': '16'}
+
+def get_county_bbox(county, state):
+    """
+    Looks up a county's extent from the Census TIGERweb service.
+    Returns (xmin, ymin, xmax, ymax) in lon/lat or None.
+    """
+    fips = STATE_FIPS.get(state)
+    if not fips or not county:
+        return None
+
+    url = "https://tigerweb.geo.census.gov/arcgis/rest/services/TIGERweb/State_County/MapServer/1/query"
+    county_name = county.upper().replace(' COUNTY', '').replace("'", "''")
+    params = {
+        'where': f"STATE = '{fips}' AND UPPER(BASENAME) = '{county_name}'",
+        'returnExtentOnly': 'true',
+        'outSR': '4326',
+        'f': 'json'
+    }
+
+    try:
+        response = cached_get(url, params=params, timeout=30, ttl=CACHE_TTL['location'])
+        response.raise_for_status()
+        extent = response.json().get('extent') or {}
+        if extent.get('xmin') is None or extent.get('xmin') == 'NaN':
+            return None
+        return (extent['xmin'], extent['ymin'], extent['xmax'], extent['ymax'])
+    except Exception as e:
+        logging.error(f"Error looking up extent for {county} County: {e}")
+        return None
+
+def get_search_bbox(search_term, is_zip, state, lat=None, lon=None, radius_miles=DEFAULT_RADIUS_MILES):
+    """
+    Returns the envelope to push down to spatial queries for a search:
+    the county extent for county searches, a box around lat/lon for zip searches,
+    and the state extent otherwise. Boxes are padded by radius_miles so that
+    proximity filtering around sites near the edge still sees everything.
+    """
+    if not is_zip:
+        bbox = get_county_bbox(search_term, state)
+        if bbox:
+            lower = bbox_around(bbox[1], bbox[0], radius_miles)
+            upper = bbox_around(bbox[3], bbox[2], radius_miles)
+            return (lower[0], lower[1], upper[2], upper[3])
+    elif lat and lon:
+        return bbox_around(lat, lon, radius_miles)
+
+    return STATE_BBOXES.get(state)
+
+def fetch_mt_mines(lat=None, lon=None, radius_miles=DEFAULT_RADIUS_MILES):
     """
     Fetches mines from Montana Bureau of Mines and Geology (MBMG).
     Service: Mine_MBMG2006_shp
@@ -481,16 +828,14 @@ def fetch_mt_mines(lat=None, lon=None, radius_miles=10):
     
     params = {
         'where': "1=1",
-        'outFields': '*',
+        'outFields': ','.join(MT_MINE_FIELDS),
         'f': 'json',
         'outSR': '4326'
     }
     
     if lat and lon:
         # Create bounding box
-        offset = radius_miles * 0.02 # Approx conversion
-        xmin, ymin = lon - offset, lat - offset
-        xmax, ymax = lon + offset, lat + offset
+        xmin, ymin, xmax, ymax = bbox_around(lat, lon, radius_miles)
         params['geometry'] = f"{xmin},{ymin},{xmax},{ymax}"
         params['geometryType'] = 'esriGeometryEnvelope'
         params['spatialRel'] = 'esriSpatialRelIntersects'
@@ -498,9 +843,7 @@ def fetch_mt_mines(lat=None, lon=None, radius_miles=10):
         logging.info(f"Querying MT Mines in bbox: {params['geometry']}")
     
     try:
-        response = requests.get(url, params=params, timeout=30)
-        response.raise_for_status()
-        data = response.json()
+        data = query_features(url, params, ttl=CACHE_TTL['arcgis'], timeout=30)
         
         for feature in data.get('features', []):
             attrs = feature.get('attributes', {})
@@ -530,7 +873,7 @@ def fetch_mt_mines(lat=None, lon=None, radius_miles=10):
         logging.error(f"Error fetching MT Mines: {e}")
         return []
 
-def fetch_id_mines(lat=None, lon=None, radius_miles=10):
+def fetch_id_mines(lat=None, lon=None, radius_miles=DEFAULT_RADIUS_MILES):
     """
     Fetches mines from Idaho Geological Survey (IGS).
     Service: Mines and Prospects
@@ -542,16 +885,14 @@ def fetch_id_mines(lat=None, lon=None, radius_miles=10):
     
     params = {
         'where': "1=1",
-        'outFields': '*',
+        'outFields': ','.join(ID_MINE_FIELDS),
         'f': 'json',
         'outSR': '4326'
     }
     
     if lat and lon:
         # Create bounding box
-        offset = radius_miles * 0.02
-        xmin, ymin = lon - offset, lat - offset
-        xmax, ymax = lon + offset, lat + offset
+        xmin, ymin, xmax, ymax = bbox_around(lat, lon, radius_miles)
         params['geometry'] = f"{xmin},{ymin},{xmax},{ymax}"
         params['geometryType'] = 'esriGeometryEnvelope'
         params['spatialRel'] = 'esriSpatialRelIntersects'
@@ -559,9 +900,7 @@ def fetch_id_mines(lat=None, lon=None, radius_miles=10):
         logging.info(f"Querying ID Mines in bbox: {params['geometry']}")
     
     try:
-        response = requests.get(url, params=params, timeout=30)
-        response.raise_for_status()
-        data = response.json()
+        data = query_features(url, params, ttl=CACHE_TTL['arcgis'], timeout=30)
         
         for feature in data.get('features', []):
             attrs = feature.get('attributes', {})
@@ -597,6 +936,7 @@ def fetch_id_deq_data(search_term, is_zip=True, lat=None, lon=None):
     Fetches Idaho DEQ data from SWA_PCI_WMS MapServer.
     Layer 12: Potential Contaminants Inventory (PCI)
     Layer 28: Landfills
+    search_term=None (and no lat/lon) fetches the whole state.
     """
     logging.info(f"Fetching Idaho DEQ Data for {search_term}...")
     sites = []
@@ -606,46 +946,46 @@ def fetch_id_deq_data(search_term, is_zip=True, lat=None, lon=None):
     # Has ZIPCODE and COUNTY fields
     url_pci = f"{base_url}/12/query"
     where_clause = "1=1"
-    if is_zip:
+    if search_term is None:
+        pass
+    elif is_zip:
         where_clause = f"ZIPCODE = {search_term}"
     else:
         where_clause = f"UPPER(COUNTY) LIKE '%{search_term.upper()}%'"
         
     params_pci = {
         'where': where_clause,
-        'outFields': '*',
+        'outFields': ','.join(ID_DEQ_PCI_FIELDS),
         'f': 'json',
         'outSR': '4326'
     }
     
     try:
-        response = requests.get(url_pci, params=params_pci, timeout=30)
-        if response.status_code == 200:
-            data = response.json()
-            for feature in data.get('features', []):
-                attrs = feature.get('attributes', {})
-                geom = feature.get('geometry', {})
-                
-                lat_val = attrs.get('LATITUDE') or geom.get('y')
-                lon_val = attrs.get('LONGITUDE') or geom.get('x')
+        data = query_features(url_pci, params_pci, ttl=CACHE_TTL['arcgis'], timeout=30)
+        for feature in data.get('features', []):
+            attrs = feature.get('attributes', {})
+            geom = feature.get('geometry', {})
+            
+            lat_val = attrs.get('LATITUDE') or geom.get('y')
+            lon_val = attrs.get('LONGITUDE') or geom.get('x')
+            
+            if not lat_val or not lon_val:
+                continue
                 
-                if not lat_val or not lon_val:
-                    continue
-                    
-                site = {
-                    'name': attrs.get('FACILITY', 'Unknown Facility'),
-                    'address': attrs.get('ADDRESS', ''),
-                    'city': attrs.get('CITY', ''),
-                    'county': str(attrs.get('COUNTY', '')).upper(),
-                    'zip': str(attrs.get('ZIPCODE', '')),
-                    'lat': lat_val,
-                    'lon': lon_val,
-                    'source': 'ID DEQ PCI',
-                    'url': attrs.get('HOTLINK') or f"{base_url}/12",
-                    'details': f"Type: {attrs.get('FAC_TYPE', 'Unknown')}; Contaminant: {attrs.get('CONTAMINAN', 'None')}; Desc: {attrs.get('DESCRIPTION', '')}",
-                    'type': 'Toxic Site'
-                }
-                sites.append(site)
+            site = {
+                'name': attrs.get('FACILITY', 'Unknown Facility'),
+                'address': attrs.get('ADDRESS', ''),
+                'city': attrs.get('CITY', ''),
+                'county': str(attrs.get('COUNTY', '')).upper(),
+                'zip': str(attrs.get('ZIPCODE', '')),
+                'lat': lat_val,
+                'lon': lon_val,
+                'source': 'ID DEQ PCI',
+                'url': attrs.get('HOTLINK') or f"{base_url}/12",
+                'details': f"Type: {attrs.get('FAC_TYPE', 'Unknown')}; Contaminant: {attrs.get('CONTAMINAN', 'None')}; Desc: {attrs.get('DESCRIPTION', '')}",
+                'type': 'Toxic Site'
+            }
+            sites.append(site)
     except Exception as e:
         logging.error(f"Error fetching ID DEQ PCI: {e}")
 
@@ -654,20 +994,20 @@ def fetch_id_deq_data(search_term, is_zip=True, lat=None, lon=None):
     url_lf = f"{base_url}/28/query"
     params_lf = {
         'where': "1=1",
-        'outFields': '*',
+        'outFields': ','.join(ID_DEQ_LANDFILL_FIELDS),
         'f': 'json',
         'outSR': '4326'
     }
     
     # If we have lat/lon, use bounding box for landfills (approx 15 miles)
     if lat and lon:
-        offset = 0.25 
+        offset = ID_DEQ_LANDFILL_OFFSET_DEG
         xmin, ymin = lon - offset, lat - offset
         xmax, ymax = lon + offset, lat + offset
         params_lf['geometry'] = f"{xmin},{ymin},{xmax},{ymax}"
         params_lf['geometryType'] = 'esriGeometryEnvelope'
         params_lf['spatialRel'] = 'esriSpatialRelIntersects'
-    elif not is_zip:
+    elif not is_zip and search_term is not None:
         # Filter by County if provided
         params_lf['where'] = f"UPPER(COUNTY) LIKE '%{search_term.upper()}%'"
     else:
@@ -676,30 +1016,28 @@ def fetch_id_deq_data(search_term, is_zip=True, lat=None, lon=None):
         pass
 
     try:
-        response = requests.get(url_lf, params=params_lf, timeout=30)
-        if response.status_code == 200:
-            data = response.json()
-            for feature in data.get('features', []):
-                attrs = feature.get('attributes', {})
-                geom = feature.get('geometry', {})
-                
-                lat_val = geom.get('y')
-                lon_val = geom.get('x')
+        data = query_features(url_lf, params_lf, ttl=CACHE_TTL['arcgis'], timeout=30)
+        for feature in data.get('features', []):
+            attrs = feature.get('attributes', {})
+            geom = feature.get('geometry', {})
+            
+            lat_val = geom.get('y')
+            lon_val = geom.get('x')
+            
+            if not lat_val or not lon_val:
+                continue
                 
-                if not lat_val or not lon_val:
-                    continue
-                    
-                site = {
-                    'name': attrs.get('SITENAME', 'Unknown Landfill'),
-                    'county': str(attrs.get('COUNTY', '')).upper(),
-                    'lat': lat_val,
-                    'lon': lon_val,
-                    'source': 'ID DEQ Landfill',
-                    'url': f"{base_url}/28",
-                    'details': f"Status: {attrs.get('STATUS', 'Unknown')}; Type: {attrs.get('TYPE', 'Unknown')}; Contaminant: {attrs.get('CONTAMINANT', 'None')}",
-                    'type': 'Toxic Site' # Group with toxic sites
-                }
-                sites.append(site)
+            site = {
+                'name': attrs.get('SITENAME', 'Unknown Landfill'),
+                'county': str(attrs.get('COUNTY', '')).upper(),
+                'lat': lat_val,
+                'lon': lon_val,
+                'source': 'ID DEQ Landfill',
+                'url': f"{base_url}/28",
+                'details': f"Status: {attrs.get('STATUS', 'Unknown')}; Type: {attrs.get('TYPE', 'Unknown')}; Contaminant: {attrs.get('CONTAMINANT', 'None')}",
+                'type': 'Toxic Site' # Group with toxic sites
+            }
+            sites.append(site)
     except Exception as e:
         logging.error(f"Error fetching ID DEQ Landfills: {e}")
 
@@ -0,0 +1,222 @@
+import io
+import csv
+import json
+import math
+import struct
+import logging
+import numpy as np
+from src.kml_generator import DEFAULT_PRECISION
+from src.warehouse import LAYERS
+
+# Attribute columns written by every export format, in order
+FIELDS = ['layer', 'name', 'source', 'type', 'county', 'zip', 'city', 'address', 'rank', 'details', 'url']
+
+# Feature type for records that do not carry one
+LAYER_TYPES = {
+    'sites': 'Toxic Site',
+    'towers': 'Tower',
+    'mines': 'Mine',
+    'inactive_mines': 'Inactive Mine',
+    'hazardous_minerals': 'Hazardous Mineral'
+}
+
+# WKB geometry type codes
+WKB_POINT = 1
+WKB_POLYGON = 3
+
+def iter_features(sites, broadcast_towers, mines, inactive_mines, hazardous_minerals, precision=DEFAULT_PRECISION):
+    """
+    Yields (properties, geometry, point) for every record, layer by layer.
+    properties has one value per FIELDS entry; geometry is a GeoJSON Point or
+    Polygon dict with coordinates rounded to precision decimals, or None for
+    records without coordinates; point is the record's [lon, lat] (the
+    centroid pin for polygons) or None. Buffer rings are map decorations and
+    are not exported.
+    """
+    for layer, records in zip(LAYERS, (sites, broadcast_towers, mines, inactive_mines, hazardous_minerals)):
+        for record in records:
+            properties = {field: _text(record.get(field)) for field in FIELDS}
+            properties['layer'] = layer
+            properties['type'] = record.get('type') or LAYER_TYPES[layer]
+            point = _coords(record, precision)
+            yield properties, _geometry(record, point, precision), point
+
+class GeoJSONSink:
+    """
+    Streams a GeoJSON FeatureCollection, one feature per line, to a path or
+    binary file object.
+    """
+
+    extension = 'geojson'
+
+    def __init__(self, output):
+        self.file, self.owned = _open_text(output)
+        self.count = 0
+        self.file.write('{"type":"FeatureCollection","features":[\n')
+
+    def write(self, properties, geometry, point):
+        feature = {'type': 'Feature', 'properties': properties, 'geometry': geometry}
+        self.file.write((',\n' if self.count else '') + json.dumps(feature, separators=(',', ':'), ensure_ascii=False))
+        self.count += 1
+
+    def close(self):
+        self.file.write('\n]}\n')
+        _close_text(self.file, self.owned)
+
+class CSVSink:
+    """
+    Streams one row per feature with FIELDS plus geom_type and lat/lon (the
+    centroid pin for polygons) to a path or binary file object.
+    """
+
+    extension = 'csv'
+
+    def __init__(self, output):
+        self.file, self.owned = _open_text(output)
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(FIELDS + ['geom_type', 'lat', 'lon'])
+
+    def write(self, properties, geometry, point):
+        self.writer.writerow([properties[field] for field in FIELDS] +
+                             [geometry['type'] if geometry else ''] + ([point[1], point[0]] if point else ['', '']))
+
+    def close(self):
+        _close_text(self.file, self.owned)
+
+class FlatGeobufSink:
+    """
+    Collects features and writes them as FlatGeobuf (through GDAL, with the
+    packed Hilbert R-tree spatial index) on close, so readers can fetch a
+    bbox without scanning the file. The index is built over every feature,
+    so rows are held in memory until then. Needs pyogrio.
+    """
+
+    extension = 'fgb'
+
+    def __init__(self, path):
+        try:
+            from pyogrio.raw import write
+        except ImportError:
+            raise ImportError("FlatGeobuf output needs pyogrio (pip install pyogrio)")
+        self.write_arrays = write
+        self.path = path
+        self.columns = {field: [] for field in FIELDS}
+        self.geometries = []
+
+    def write(self, properties, geometry, point):
+        if geometry is None:
+            return
+        for field in FIELDS:
+            self.columns[field].append(properties[field])
+        self.geometries.append(to_wkb(geometry))
+
+    def close(self):
+        self.write_arrays(self.path, np.array(self.geometries, dtype=object),
+                          [np.array(self.columns[field], dtype=object) for field in FIELDS], FIELDS,
+                          driver='FlatGeobuf', geometry_type='Unknown', crs='EPSG:4326',
+                          layer_options={'SPATIAL_INDEX': 'YES'})
+
+# Export format name -> sink class
+SINKS = {
+    'geojson': GeoJSONSink,
+    'csv': CSVSink,
+    'fgb': FlatGeobufSink
+}
+
+def export(sites, broadcast_towers, mines, inactive_mines, hazardous_minerals, outputs, precision=DEFAULT_PRECISION):
+    """
+    Writes the layers to several formats in one pass over the records.
+    outputs is {format: path or binary file object} with formats from SINKS.
+    Returns True.
+    """
+    sinks = {}
+    try:
+        for fmt, output in outputs.items():
+            sinks[fmt] = SINKS[fmt](output)
+        count = 0
+        for feature in iter_features(sites, broadcast_towers, mines, inactive_mines, hazardous_minerals, precision):
+            for sink in sinks.values():
+                sink.write(*feature)
+            count += 1
+    finally:
+        for sink in sinks.values():
+            sink.close()
+    logging.info(f"Exported {count} features as {', '.join(outputs)}.")
+    return True
+
+def write_geojson(sites, broadcast_towers, mines, inactive_mines, hazardous_minerals, search_term, output_file,
+                  precision=DEFAULT_PRECISION, **kwargs):
+    """
+    Writer-style wrapper (same signature as generate_kml) around export.
+    """
+    return export(sites, broadcast_towers, mines, inactive_mines, hazardous_minerals, {'geojson': output_file}, precision)
+
+def write_csv(sites, broadcast_towers, mines, inactive_mines, hazardous_minerals, search_term, output_file,
+              precision=DEFAULT_PRECISION, **kwargs):
+    """
+    Writer-style wrapper (same signature as generate_kml) around export.
+    """
+    return export(sites, broadcast_towers, mines, inactive_mines, hazardous_minerals, {'csv': output_file}, precision)
+
+def write_flatgeobuf(sites, broadcast_towers, mines, inactive_mines, hazardous_minerals, search_term, output_file,
+                     precision=DEFAULT_PRECISION, **kwargs):
+    """
+    Writer-style wrapper (same signature as generate_kml) around export.
+    """
+    return export(sites, broadcast_towers, mines, inactive_mines, hazardous_minerals, {'fgb': output_file}, precision)
+
+def to_wkb(geometry):
+    """
+    Little-endian WKB for a GeoJSON-style Point or Polygon dict.
+    """
+    if geometry['type'] == 'Point':
+        return struct.pack('<BIdd', 1, WKB_POINT, *geometry['coordinates'])
+    rings = geometry['coordinates']
+    parts = [struct.pack('<BII', 1, WKB_POLYGON, len(rings))]
+    for ring in rings:
+        parts.append(struct.pack('<I', len(ring)))
+        parts.append(struct.pack(f"<{2 * len(ring)}d", *(v for point in ring for v in point)))
+    return b''.join(parts)
+
+def _geometry(record, point, precision):
+    if record.get('geom_type') == 'Polygon' and record.get('rings'):
+        rings = []
+        for ring in record['rings']:
+            ring = [[round(p[0], precision), round(p[1], precision)] for p in ring]
+            if ring and ring[0] != ring[-1]:
+                ring.append(list(ring[0]))
+            rings.append(ring)
+        return {'type': 'Polygon', 'coordinates': rings}
+    if point is None:
+        return None
+    return {'type': 'Point', 'coordinates': point}
+
+def _coords(record, precision):
+    try:
+        lon, lat = float(record['lon']), float(record['lat'])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if math.isnan(lon) or math.isnan(lat):
+        return None
+    return [round(lon, precision), round(lat, precision)]
+
+def _text(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return ''
+    return str(value)
+
+def _open_text(output):
+    """
+    A text file over a path or binary file object, and whether we own it.
+    """
+    if isinstance(output, str):
+        return open(output, 'w', encoding='utf-8', newline=''), True
+    return io.TextIOWrapper(output, encoding='utf-8', newline=''), False
+
+def _close_text(file, owned):
+    if owned:
+        file.close()
+    else:
+        # Hand the caller's binary file back open
+        file.flush()
+        file.detach()
@@ -0,0 +1,201 @@
+import numpy as np
+import pandas as pd
+from src import profiling
+from src.warehouse import LAYERS
+from src.geometry import COUNTY_TOLERANCE_DEG, generalization_tolerance, simplify_ring
+from src.spatial import DEFAULT_RADIUS_MILES, ID_DEQ_LANDFILL_OFFSET_DEG, SpatialIndex
+
+# Columns of the feature table and their dtypes. Strings repeated across
+# records (sources, counties, URLs...) are categorical, so each distinct value
+# is stored once; 'layer' is one of LAYERS.
+COLUMNS = {
+    'layer': 'category',
+    'name': 'object',
+    'lat': 'float64',
+    'lon': 'float64',
+    'source': 'category',
+    'county': 'category',
+    'zip': 'category',
+    'city': 'category',
+    'address': 'object',
+    'type': 'category',
+    'url': 'category',
+    'details': 'object',
+    'rank': 'category',
+    'facility_id': 'object',
+    'layer_id': 'Int64',
+    'geom_type': 'category',
+    'rings': 'object'
+}
+
+# Record keys kept even when empty: every source sets them, and the writers
+# read coordinates directly
+REQUIRED_KEYS = ('name', 'lat', 'lon')
+
+def to_table(data):
+    """
+    Builds the feature table from fetch_all_data's 5-tuple of record lists:
+    one row per record, in layer order and then record order. Keys a source
+    does not have (landfills have no zip, towers no county...) are null.
+    """
+    records = [record for layer in data for record in layer]
+    table = pd.DataFrame.from_records(records, columns=[c for c in COLUMNS if c != 'layer'])
+    table.insert(0, 'layer', np.repeat(np.array(LAYERS, dtype=object), [len(layer) for layer in data]))
+    table['lat'] = pd.to_numeric(table['lat'], errors='coerce')
+    table['lon'] = pd.to_numeric(table['lon'], errors='coerce')
+    table['layer'] = pd.Categorical(table['layer'], categories=LAYERS)
+    return table.astype({c: dtype for c, dtype in COLUMNS.items() if c not in ('layer', 'lat', 'lon')})
+
+def to_layers(table):
+    """
+    The inverse of to_table: a 5-tuple of record lists for the writers and
+    the warehouse. Null columns are left out of each record, except
+    REQUIRED_KEYS, which are kept as None.
+    """
+    layers = tuple([] for _ in LAYERS)
+    if not len(table):
+        return layers
+    columns = [c for c in COLUMNS if c != 'layer']
+    positions = {layer: i for i, layer in enumerate(LAYERS)}
+    values = table[columns].astype(object)
+    for layer, row in zip(table['layer'], values.itertuples(index=False, name=None)):
+        record = {key: value for key, value in zip(columns, row) if not _missing(value)}
+        for key in REQUIRED_KEYS:
+            record.setdefault(key, None)
+        layers[positions[layer]].append(record)
+    return layers
+
+def layer_counts(table):
+    """
+    {layer: row count} in LAYERS order.
+    """
+    counts = table['layer'].value_counts()
+    return {layer: int(counts.get(layer, 0)) for layer in LAYERS}
+
+def spatial_index(table):
+    """
+    SpatialIndex over every row of table with coordinates. Build it once per
+    table and pass it to each filter_table call on that table.
+    """
+    return SpatialIndex.from_points(table['lat'].to_numpy(dtype=np.float64), table['lon'].to_numpy(dtype=np.float64))
+
+def filter_table(table, query, radius_miles=DEFAULT_RADIUS_MILES, statewide=False, index=None):
+    """
+    Returns the rows of table a resolved query (see pipeline.resolve_query)
+    keeps. County searches match on county name; towers, and everything else
+    for zips, are kept within radius_miles of the zip centroid (or of the
+    centre of the county's sites). With statewide, the sources that are
+    otherwise filtered on the server (WA Ecology, ID DEQ) are narrowed to
+    what fetch_all_data returns for this search. County and zip matches run
+    once per distinct category value. Radius searches measure only the rows
+    in the grid cells of index (spatial_index(table), built here when not
+    given) around the centre.
+    """
+    search_term, is_zip = query['search_term'], query['is_zip']
+    lat, lon = query['lat'], query['lon']
+    term = search_term.upper()
+    zip_center = (lat, lon) if is_zip and lat and lon else None
+
+    with profiling.stage('filter', search=search_term, statewide=statewide, columnar=True) as record:
+        record['in'] = layer_counts(table)
+        if index is None:
+            index = spatial_index(table)
+        layer = table['layer']
+        source = table['source']
+        county_match = _matches(table['county'], lambda values: values.str.upper().str.contains(term, regex=False))
+
+        sites = layer == 'sites'
+        if statewide:
+            if is_zip:
+                ecology = _matches(table['zip'], lambda values: values.str.contains(search_term, regex=False))
+                pci = _matches(table['zip'], lambda values: values.str.startswith(search_term))
+            else:
+                ecology = pci = county_match
+            if lat and lon:
+                landfill = (((table['lat'] - lat).abs() <= ID_DEQ_LANDFILL_OFFSET_DEG) &
+                            ((table['lon'] - lon).abs() <= ID_DEQ_LANDFILL_OFFSET_DEG))
+            else:
+                landfill = county_match | is_zip
+            sites &= ~(((source == 'WA Ecology') & ~ecology) | ((source == 'ID DEQ PCI') & ~pci) |
+                       ((source == 'ID DEQ Landfill') & ~landfill))
+
+        # EPA TRI: zip prefix or within the radius for zips; the (upper-case) county otherwise
+        tri = sites & (source == 'EPA TRI')
+        if is_zip:
+            tri_keep = _matches(table['zip'], lambda values: values.str.startswith(search_term))
+            if zip_center:
+                tri_keep |= _within(table, tri, zip_center, radius_miles, index)
+        else:
+            tri_keep = _matches(table['county'], lambda values: values.str.contains(term, regex=False))
+        sites &= ~tri | tri_keep
+
+        if is_zip:
+            center = zip_center
+        else:
+            located = table.loc[sites, ['lat', 'lon']].dropna()
+            center = (located['lat'].mean(), located['lon'].mean()) if len(located) else None
+
+        mines = layer == 'mines'
+        inactive_mines = layer == 'inactive_mines'
+        hazardous = layer == 'hazardous_minerals'
+        towers = _within(table, layer == 'towers', center, radius_miles, index)
+        if is_zip:
+            mines = _within(table, mines, center, radius_miles, index)
+            inactive_mines = _within(table, inactive_mines, center, radius_miles, index)
+            hazardous = _within(table, hazardous, center, radius_miles, index)
+        else:
+            mines &= county_match
+            inactive_mines &= county_match
+            no_county = table['county'].isna() | (table['county'] == '')
+            hazardous &= ((~no_county & county_match) |
+                          _within(table, hazardous & no_county, center, radius_miles, index))
+
+        filtered = table[sites | towers | mines | inactive_mines | hazardous]
+        record['out'] = layer_counts(filtered)
+    return filtered
+
+def generalize(table):
+    """
+    Simplifies polygon rings to one output pixel of the table's extent (see
+    generalization_tolerance). Statewide layers are fetched at county-scale
+    detail (COUNTY_TOLERANCE_DEG), so outputs cut from them that cover more
+    than a county are coarsened to match a direct fetch of that extent.
+    Returns a new table when anything changes; the input is left as is.
+    """
+    polygons = np.flatnonzero(((table['geom_type'] == 'Polygon') & table['rings'].notna()).to_numpy())
+    located = table[['lat', 'lon']].dropna()
+    if not len(polygons) or not len(located):
+        return table
+    tolerance = generalization_tolerance((located['lon'].min(), located['lat'].min(),
+                                          located['lon'].max(), located['lat'].max()))
+    if tolerance <= COUNTY_TOLERANCE_DEG:
+        return table
+
+    rings = table['rings'].to_numpy(dtype=object).copy()
+    for i in polygons:
+        rings[i] = [simplify_ring(ring, tolerance) for ring in rings[i]]
+    return table.assign(rings=rings)
+
+def _within(table, mask, center, radius_miles, index):
+    """
+    mask narrowed to rows within radius_miles of center (none without a
+    center), measuring only the candidates index finds around it.
+    """
+    within = np.zeros(len(table), dtype=bool)
+    if center:
+        within[index.positions_within(center[0], center[1], radius_miles)] = True
+    return pd.Series(within, index=table.index) & mask
+
+def _matches(column, predicate):
+    """
+    Rows of a categorical string column whose value satisfies predicate
+    (a vectorized test over a string Series), evaluated once per category.
+    Null rows never match.
+    """
+    categories = pd.Series(column.cat.categories.astype(str))
+    return column.isin(categories[predicate(categories).to_numpy(dtype=bool)])
+
+def _missing(value):
+    if value is None or value is pd.NA:
+        return True
+    return isinstance(value, float) and value != value
@@ -0,0 +1,125 @@
+import math
+import numpy as np
+
+# Ellipsoid equatorial radius, as used by the original create_circle
+EARTH_RADIUS_METERS = 6378137
+METERS_PER_MILE = 1609.34
+
+# Buffer rings drawn around sites and mines
+DEFAULT_RING_RADII_MILES = (1,)
+
+# Vertex count is picked so the ring strays at most this far from the true
+# circle between vertices; 36 vertices for the 1 mile ring
+RING_MAX_ERROR_METERS = 6.2
+MIN_RING_VERTICES = 12
+MAX_RING_VERTICES = 90
+
+# Approximate on-screen size (pixels) of the output extent, used to pick a
+# generalization tolerance that is invisible at the scale the map is viewed at
+OUTPUT_PIXELS = 2048
+
+# Tolerance for polygons fetched statewide (batch runs, the map service, the
+# warehouse): about one output pixel of a county-sized extent, so shared
+# statewide layers are as detailed as a single-county fetch. Each output is
+# generalized to its own extent when rendered (see features.generalize).
+COUNTY_TOLERANCE_DEG = 0.0005
+
+def generalization_tolerance(bbox, pixels=OUTPUT_PIXELS):
+    """
+    Returns a simplification tolerance in degrees: one pixel of the extent
+    (xmin, ymin, xmax, ymax) rendered at the given width.
+    """
+    xmin, ymin, xmax, ymax = bbox
+    return max(xmax - xmin, ymax - ymin) / pixels
+
+def simplify_ring(ring, tolerance):
+    """
+    Douglas-Peucker simplification of a ring (list of [x, y]).
+    A closed ring stays closed and keeps at least three distinct vertices.
+    """
+    points = np.asarray(ring, dtype=np.float64)
+    if tolerance <= 0 or len(points) <= 4:
+        return ring
+
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+
+    # Iterative so large rings cannot hit the recursion limit. For a closed
+    # ring the first "segment" has zero length, so the farthest vertex from
+    # the start is split on first.
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        distances = _segment_distances(points[first], points[last], points[first + 1:last])
+        offset = int(np.argmax(distances))
+        if distances[offset] > tolerance:
+            index = first + 1 + offset
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+
+    if keep.sum() < 4:
+        # Collapsed below a triangle: keep the vertices farthest from the start
+        order = np.argsort(-np.hypot(*(points - points[0]).T), kind='stable')
+        keep[order[:2]] = True
+
+    return points[keep].tolist()
+
+def _segment_distances(start, end, inner):
+    """
+    Distances of inner points from the segment start-end.
+    """
+    segment = end - start
+    length_sq = float(segment @ segment)
+    if length_sq == 0:
+        return np.hypot(*(inner - start).T)
+    t = np.clip(((inner - start) @ segment) / length_sq, 0, 1)
+    projection = start + np.outer(t, segment)
+    return np.hypot(*(inner - projection).T)
+
+def ring_vertex_count(radius_meters, max_error_meters=RING_MAX_ERROR_METERS):
+    """
+    Number of vertices needed so a ring of the given radius is within
+    max_error_meters of a true circle, clamped to MIN/MAX_RING_VERTICES.
+    """
+    if radius_meters <= max_error_meters:
+        return MIN_RING_VERTICES
+    vertices = math.ceil(math.pi / math.acos(1 - max_error_meters / radius_meters))
+    return int(min(max(vertices, MIN_RING_VERTICES), MAX_RING_VERTICES))
+
+def buffer_rings(lats, lons, radius_meters, vertices=None):
+    """
+    Builds a closed ring of radius_meters around every point at once.
+    Returns an array of shape (points, vertices + 1, 2) holding (lon, lat)
+    in degrees. vertices defaults to ring_vertex_count(radius_meters).
+    """
+    if vertices is None:
+        vertices = ring_vertex_count(radius_meters)
+    lat1 = np.radians(np.asarray(lats, dtype=np.float64))[:, None]
+    lon1 = np.radians(np.asarray(lons, dtype=np.float64))[:, None]
+    bearings = np.linspace(0, 2 * np.pi, vertices + 1)
+    distance = radius_meters / EARTH_RADIUS_METERS
+
+    sin_lat1, cos_lat1 = np.sin(lat1), np.cos(lat1)
+    lat2 = np.arcsin(sin_lat1 * math.cos(distance) + cos_lat1 * math.sin(distance) * np.cos(bearings))
+    lon2 = lon1 + np.arctan2(np.sin(bearings) * math.sin(distance) * cos_lat1,
+                             math.cos(distance) - sin_lat1 * np.sin(lat2))
+
+    rings = np.degrees(np.stack([lon2, lat2], axis=-1))
+    # Close exactly on the first vertex
+    rings[:, -1] = rings[:, 0]
+    return rings
+
+def record_rings(records, radii_miles=DEFAULT_RING_RADII_MILES, vertices=None):
+    """
+    Buffer rings for records with 'lat'/'lon' keys, one batch per radius.
+    Returns, per record, a list of (radius_miles, ring array) in radii order.
+    """
+    if not records:
+        return []
+    lats = [r['lat'] for r in records]
+    lons = [r['lon'] for r in records]
+    batches = [(radius, buffer_rings(lats, lons, radius * METERS_PER_MILE, vertices)) for radius in radii_miles]
+    return [[(radius, rings[i]) for radius, rings in batches] for i in range(len(records))]
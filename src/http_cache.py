@@ -0,0 +1,322 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+import logging
+import requests
+from collections import OrderedDict
+from contextlib import contextmanager
+from requests.structures import CaseInsensitiveDict
+from src import http_session, profiling
+
+# TTLs (seconds) used by the fetchers
+HOUR = 60 * 60
+DAY = 24 * HOUR
+
+# Cache location can be overridden with the TOXMAP_CACHE_DIR environment variable
+DEFAULT_CACHE_DIR = os.environ.get('TOXMAP_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'toxmap', 'http'))
+
+# Upper bound on response bodies kept in memory for the rest of the run
+DEFAULT_MEMO_BYTES = 256 * 1024 * 1024
+
+_settings = {
+    'enabled': True,
+    'cache_dir': DEFAULT_CACHE_DIR,
+    'memo_bytes': DEFAULT_MEMO_BYTES
+}
+
+# Requests currently being fetched, by key: later identical requests wait for
+# the first one instead of downloading again
+_flights = {}
+_flights_lock = threading.Lock()
+
+# key -> (expires_at, response), oldest first
+_memo = OrderedDict()
+_memo_state = {'bytes': 0}
+_memo_lock = threading.Lock()
+
+def configure(enabled=None, cache_dir=None, memo_bytes=None):
+    """
+    Enables/disables the cache, moves it to another directory or resizes the
+    in-memory memo.
+    """
+    if enabled is not None:
+        _settings['enabled'] = enabled
+    if cache_dir is not None:
+        _settings['cache_dir'] = cache_dir
+    if memo_bytes is not None:
+        _settings['memo_bytes'] = memo_bytes
+        clear_memo()
+
+def clear_memo():
+    """
+    Forgets the responses kept in memory for this run.
+    """
+    with _memo_lock:
+        _memo.clear()
+        _memo_state['bytes'] = 0
+
+def clear_cache():
+    """
+    Deletes every cached response (on disk and in memory).
+    """
+    clear_memo()
+    cache_dir = _settings['cache_dir']
+    if os.path.isdir(cache_dir):
+        shutil.rmtree(cache_dir)
+        logging.info(f"Cleared HTTP cache at {cache_dir}")
+
+def cache_key(url, params=None):
+    """
+    Returns the cache key for a URL and its query parameters.
+    """
+    items = sorted((str(k), str(v)) for k, v in (params or {}).items())
+    return hashlib.sha256(json.dumps([url, items]).encode('utf-8')).hexdigest()
+
+def cached_get(url, params=None, headers=None, ttl=DAY, timeout=None):
+    """
+    GETs a URL through the on-disk cache and returns a requests.Response.
+
+    Entries younger than ttl are served without touching the network. Older
+    entries are revalidated with If-None-Match / If-Modified-Since when the
+    server sent an ETag / Last-Modified; otherwise they are downloaded again.
+    Only 200 responses are stored. A stale entry is served if the server
+    cannot be reached. Requests go through the pooled, retrying session in
+    http_session.
+
+    Identical requests made while one is in flight share its result, and 200
+    responses are memoized in memory (for up to ttl) for the rest of the run.
+    """
+    key = cache_key(url, params)
+    response = _memo_get(key)
+    if response is not None:
+        profiling.record_request(response.url, response.status_code, 0, 0, from_cache=True)
+    else:
+        response = _single_flight(key, lambda: _cached_get(url, params, headers, ttl, timeout))
+        if ttl and response.status_code == 200:
+            _memo_put(key, response, ttl)
+    return _copy_response(response)
+
+def _cached_get(url, params, headers, ttl, timeout):
+    if not _settings['enabled'] or not ttl:
+        return http_session.get(url, params=params, headers=headers, timeout=timeout)
+
+    meta, meta_path, body_path, response = _fetch(url, params, headers, ttl, timeout, stream=False)
+    if response is None:
+        return _build_response(meta, body_path)
+
+    if response.status_code == 200:
+        _store(meta_path, body_path, response, [response.content])
+    response.from_cache = False
+    return response
+
+@contextmanager
+def cached_stream(url, params=None, headers=None, ttl=DAY, timeout=None):
+    """
+    Like cached_get, but yields a binary file object over the response body
+    instead of loading it into memory. Downloads are streamed straight into
+    the cache, and the parser then reads from disk. Raises for non-200 responses.
+    Concurrent streams of the same URL share one download (when the cache is enabled).
+    """
+    if not _settings['enabled'] or not ttl:
+        response = http_session.get(url, params=params, headers=headers, timeout=timeout, stream=True)
+        try:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            yield response.raw
+        finally:
+            response.close()
+        return
+
+    body_path = _single_flight(f"stream:{cache_key(url, params)}",
+                               lambda: _download(url, params, headers, ttl, timeout))
+    with open(body_path, 'rb') as f:
+        yield f
+
+def _download(url, params, headers, ttl, timeout):
+    """
+    Brings the cache entry for url up to date, streaming any new body to disk.
+    Returns the body path.
+    """
+    meta, meta_path, body_path, response = _fetch(url, params, headers, ttl, timeout, stream=True)
+    if response is not None:
+        try:
+            response.raise_for_status()
+            _store(meta_path, body_path, response, response.iter_content(chunk_size=1024 * 1024))
+        finally:
+            response.close()
+    return body_path
+
+def _single_flight(key, fn):
+    """
+    Runs fn once per key at a time: callers arriving while it runs wait and
+    get the same result (or exception).
+    """
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = {'done': threading.Event()}
+
+    if not leader:
+        logging.info(f"Waiting for in-flight request {key[:16]}...")
+        flight['done'].wait()
+        if 'error' in flight:
+            raise flight['error']
+        return flight['result']
+
+    try:
+        flight['result'] = fn()
+        return flight['result']
+    except Exception as e:
+        flight['error'] = e
+        raise
+    finally:
+        with _flights_lock:
+            del _flights[key]
+        flight['done'].set()
+
+def _memo_get(key):
+    with _memo_lock:
+        entry = _memo.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.time():
+            del _memo[key]
+            _memo_state['bytes'] -= len(entry[1].content)
+            return None
+        _memo.move_to_end(key)
+        return entry[1]
+
+def _memo_put(key, response, ttl):
+    size = len(response.content)
+    if size > _settings['memo_bytes']:
+        return
+    with _memo_lock:
+        if key in _memo:
+            _memo_state['bytes'] -= len(_memo.pop(key)[1].content)
+        _memo[key] = (time.time() + ttl, response)
+        _memo_state['bytes'] += size
+        while _memo_state['bytes'] > _settings['memo_bytes']:
+            _, (_, evicted) = _memo.popitem(last=False)
+            _memo_state['bytes'] -= len(evicted.content)
+
+def _copy_response(response):
+    """
+    A separate Response over the same body, so callers sharing a result
+    cannot affect each other.
+    """
+    copy = requests.Response()
+    copy._content = response.content
+    copy.status_code = response.status_code
+    copy.headers = CaseInsensitiveDict(response.headers)
+    copy.encoding = response.encoding
+    copy.url = response.url
+    copy.reason = response.reason
+    copy.from_cache = getattr(response, 'from_cache', False)
+    return copy
+
+def _fetch(url, params, headers, ttl, timeout, stream):
+    """
+    Returns (meta, meta_path, body_path, response). response is None when the
+    cached body at body_path should be used (fresh, revalidated, or stale fallback).
+    """
+    key = cache_key(url, params)
+    meta_path, body_path = _entry_paths(key)
+    meta = _read_meta(meta_path, body_path)
+
+    if meta and time.time() - meta['fetched_at'] < ttl:
+        logging.info(f"Cache hit: {url}")
+        profiling.record_request(meta['url'], meta['status_code'], 0, 0, from_cache=True)
+        return meta, meta_path, body_path, None
+
+    request_headers = dict(headers or {})
+    if meta:
+        # Conditional revalidation
+        if meta.get('etag'):
+            request_headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            request_headers['If-Modified-Since'] = meta['last_modified']
+
+    try:
+        response = http_session.get(url, params=params, headers=request_headers, timeout=timeout, stream=stream)
+    except requests.RequestException as e:
+        if meta:
+            logging.warning(f"Serving stale cache for {url} ({e})")
+            return meta, meta_path, body_path, None
+        raise
+
+    if response.status_code == 304 and meta:
+        logging.info(f"Cache revalidated: {url}")
+        response.close()
+        meta['fetched_at'] = time.time()
+        _write_meta(meta_path, meta)
+        return meta, meta_path, body_path, None
+
+    if response.status_code >= 500 and meta:
+        # The session's retries are used up; an old body beats an error page
+        logging.warning(f"Serving stale cache for {url} (HTTP {response.status_code})")
+        response.close()
+        return meta, meta_path, body_path, None
+
+    return meta, meta_path, body_path, response
+
+def _entry_paths(key):
+    entry_dir = os.path.join(_settings['cache_dir'], key[:2])
+    return os.path.join(entry_dir, f"{key}.json"), os.path.join(entry_dir, f"{key}.body")
+
+def _read_meta(meta_path, body_path):
+    if not (os.path.exists(meta_path) and os.path.exists(body_path)):
+        return None
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _write_meta(meta_path, meta):
+    tmp_path = f"{meta_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, meta_path)
+
+def _store(meta_path, body_path, response, chunks):
+    """
+    Writes body chunks then metadata, each atomically, so readers never see a partial entry.
+    """
+    try:
+        os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+        tmp_path = f"{body_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            os.replace(tmp_path, body_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        _write_meta(meta_path, {
+            'url': response.url,
+            'status_code': response.status_code,
+            'headers': dict(response.headers),
+            'encoding': response.encoding,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'fetched_at': time.time()
+        })
+    except OSError as e:
+        logging.warning(f"Could not write HTTP cache entry: {e}")
+
+def _build_response(meta, body_path):
+    response = requests.Response()
+    with open(body_path, 'rb') as f:
+        response._content = f.read()
+    response.status_code = meta['status_code']
+    response.headers = CaseInsensitiveDict(meta['headers'])
+    response.encoding = meta.get('encoding')
+    response.url = meta['url']
+    response.from_cache = True
+    return response
@@ -0,0 +1,135 @@
+import os
+import time
+import random
+import threading
+import requests
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from src import profiling
+
+# (connect, read) timeout in seconds for requests that do not set one
+DEFAULT_TIMEOUT = (10, 60)
+
+# Retries for transient failures: connection errors, 429 and 5xx. Waits grow
+# as BACKOFF_FACTOR * 2^n (capped at MAX_BACKOFF) plus up to BACKOFF_JITTER
+# seconds of random jitter; a Retry-After header takes precedence.
+MAX_RETRIES = 4
+BACKOFF_FACTOR = 0.5
+BACKOFF_JITTER = 0.5
+MAX_BACKOFF = 30
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Host pools kept, and connections kept alive per host. Sized for the fetch
+# and page thread pools hitting the same server at once.
+POOL_CONNECTIONS = 16
+POOL_MAXSIZE = 32
+
+# Base URL that every request is redirected to, with the original host as the
+# first path segment (e.g. a local stand-in server for offline benchmarks)
+_settings = {
+    'upstream': os.environ.get('TOXMAP_UPSTREAM') or None
+}
+
+_session = None
+_lock = threading.Lock()
+
+class JitteredRetry(Retry):
+    """
+    Retry with random jitter added to the exponential backoff, so parallel
+    requests that failed together do not retry together.
+    """
+
+    def get_backoff_time(self):
+        backoff = super().get_backoff_time()
+        if backoff <= 0:
+            return backoff
+        return min(MAX_BACKOFF, backoff + random.uniform(0, BACKOFF_JITTER))
+
+def build_session():
+    """
+    Creates a requests.Session with pooled keep-alive connections, retries
+    with backoff on 429/5xx and gzip/deflate negotiation.
+    """
+    retry = JitteredRetry(
+        total=MAX_RETRIES,
+        connect=MAX_RETRIES,
+        read=MAX_RETRIES,
+        status=MAX_RETRIES,
+        backoff_factor=BACKOFF_FACTOR,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        # Hand the last response back instead of raising, so callers see the
+        # real status via raise_for_status()
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, max_retries=retry)
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers['Accept-Encoding'] = 'gzip, deflate'
+    return session
+
+def configure(upstream=None):
+    """
+    Redirects all requests to upstream (e.g. 'http://127.0.0.1:8000'):
+    https://host/path?query becomes upstream/host/path?query. Pass '' to
+    send requests to the real hosts again.
+    """
+    if upstream is not None:
+        _settings['upstream'] = upstream.rstrip('/') or None
+
+def rewrite_url(url):
+    """
+    Applies the upstream redirect (if any) to url.
+    """
+    upstream = _settings['upstream']
+    if not upstream:
+        return url
+    parts = urlsplit(url)
+    return f"{upstream}/{parts.netloc}{parts.path}" + (f"?{parts.query}" if parts.query else '')
+
+def get_session():
+    """
+    Returns the process-wide session, creating it on first use.
+    """
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _session = build_session()
+    return _session
+
+def get(url, params=None, headers=None, timeout=None, stream=False):
+    """
+    GETs a URL through the shared session, applying DEFAULT_TIMEOUT when no
+    timeout is given. Each request is recorded for profiling with its
+    status, wall time and bytes on the wire (Content-Length, or the body
+    size when the server did not send one and the body was read).
+    """
+    start = time.perf_counter()
+    try:
+        response = get_session().get(rewrite_url(url), params=params, headers=headers,
+                                     timeout=timeout or DEFAULT_TIMEOUT, stream=stream)
+    except requests.RequestException:
+        profiling.record_request(url, None, None, time.perf_counter() - start)
+        raise
+    if profiling.enabled():
+        size = response.headers.get('Content-Length')
+        if size is not None:
+            size = int(size)
+        elif not stream:
+            size = len(response.content)
+        profiling.record_request(response.url, response.status_code, size, time.perf_counter() - start)
+    return response
+
+def close():
+    """
+    Closes pooled connections; the next request opens a fresh session.
+    """
+    global _session
+    with _lock:
+        if _session is not None:
+            _session.close()
+            _session = None
@@ -1,12 +1,130 @@
 import simplekml
 import logging
-import math
+from src import profiling
+from src.geometry import DEFAULT_RING_RADII_MILES, buffer_rings, record_rings
 
-def generate_kml(sites, broadcast_towers, mines, inactive_mines, hazardous_minerals, search_term, output_file):
+# Decimal places written for coordinates (6 is ~0.1 m)
+DEFAULT_PRECISION = 6
+
+# Ecology site rank -> icon/ring color
+RANK_COLORS = {
+    '6': simplekml.Color.pink,
+    '4': simplekml.Color.green,
+    '5': simplekml.Color.green,
+    '3': simplekml.Color.yellow,
+    '0': simplekml.Color.red,
+    '1': simplekml.Color.red,
+    '2': simplekml.Color.red
+}
+
+# Subfolders of "Toxic Sites" that always exist; others are added per source
+FIXED_TOXIC_FOLDERS = ["EPA TRI Facilities", "Other Toxic Sites"]
+
+ICON_FLAG = 'http://maps.google.com/mapfiles/kml/shapes/flag.png'
+ICON_DIAMOND = 'http://maps.google.com/mapfiles/kml/shapes/open-diamond.png'
+ICON_DOT = 'http://maps.google.com/mapfiles/kml/shapes/shaded_dot.png'
+ICON_CAUTION = 'http://maps.google.com/mapfiles/kml/shapes/caution.png'
+
+def style_specs():
+    """
+    Returns the fixed set of shared styles, keyed by (category, kind) where kind
+    is 'point' or 'ring'. Each spec holds the icon href/color/scale for points
+    or the poly/line colors and width for rings. Used by every KML backend.
+    """
+    specs = {}
+    ring_colors = {f'rank{rank}': color for rank, color in RANK_COLORS.items()}
+    ring_colors.update({
+        'rank_unknown': simplekml.Color.blue,
+        'tri': simplekml.Color.purple,
+        'other': simplekml.Color.brown,
+        'mine': simplekml.Color.orange,
+        'hazardous': simplekml.Color.brown
+    })
+
+    for category, color in ring_colors.items():
+        specs[(category, 'point')] = {'color': color}
+        specs[(category, 'ring')] = {
+            'poly_color': simplekml.Color.changealphaint(100, color),
+            'line_color': color,
+            'width': 2
+        }
+
+    # Use a Flag icon for towers
+    specs[('tower', 'point')] = {'icon': ICON_FLAG, 'color': simplekml.Color.cyan} # Tinted Cyan
+    specs[('mine', 'point')] = {'icon': ICON_DIAMOND, 'color': simplekml.Color.orange, 'scale': 0.8}
+    # Use a shaded dot or similar for inactive
+    specs[('inactive_mine', 'point')] = {'icon': ICON_DOT, 'color': simplekml.Color.grey, 'scale': 0.8}
+    specs[('hazardous', 'point')] = {'icon': ICON_CAUTION, 'color': simplekml.Color.brown}
+    return specs
+
+def style_id(key):
+    """
+    The id shared styles are written under, e.g. 'tri_point'.
+    """
+    return f"{key[0]}_{key[1]}"
+
+def build_styles():
+    """
+    Returns the shared simplekml styles used by generate_kml, keyed by (category, kind).
+    Each style is written once and referenced from placemarks by styleUrl.
+    """
+    styles = {}
+    for key, spec in style_specs().items():
+        style = simplekml.Style()
+        if key[1] == 'point':
+            if spec.get('icon'):
+                style.iconstyle.icon.href = spec['icon']
+            if spec.get('scale') is not None:
+                style.iconstyle.scale = spec['scale']
+            style.iconstyle.color = spec['color']
+        else:
+            style.polystyle.color = spec['poly_color']
+            style.linestyle.color = spec['line_color']
+            style.linestyle.width = spec['width']
+        styles[key] = style
+    return styles
+
+def site_folder(site):
+    """
+    Returns (folder name, style category) for a toxic site under "Toxic Sites".
+    """
+    source = site.get('source', 'Unknown')
+    if 'Ecology' in source:
+        # Rank coloring for Ecology
+        return "WA Ecology Cleanup Sites", _rank_category(str(site.get('rank', '')))
+    elif 'TRI' in source:
+        return "EPA TRI Facilities", 'tri'
+    # Generic State Cleanup or Other
+    return f"{source} Sites", 'other'
+
+def describe(record):
+    """
+    Placemark description: source, details and a link to the source data.
+    """
+    desc = f"Source: {record.get('source', 'Unknown')}<br/>Details: {record.get('details', '')}"
+    if record.get('url'):
+        desc += f"<br/><a href='{record['url']}'>Source Data</a>"
+    return desc
+
+def _rank_category(rank):
+    return f'rank{rank}' if rank in RANK_COLORS else 'rank_unknown'
+
+def round_coords(coords, precision=DEFAULT_PRECISION):
+    """
+    Rounds (lon, lat) pairs so coordinates are written with at most precision decimals.
+    """
+    return [(round(c[0], precision), round(c[1], precision)) for c in coords]
+
+def generate_kml(sites, broadcast_towers, mines, inactive_mines, hazardous_minerals, search_term, output_file,
+                 precision=DEFAULT_PRECISION, ring_radii=DEFAULT_RING_RADII_MILES, ring_vertices=None):
     """
     Generates a KML file with folders for Toxic Sites, Towers, Active Mines, Inactive Mines, and Hazardous Minerals.
+    Placemarks reference a fixed set of shared styles and coordinates are
+    rounded to precision decimals. Sites and active mines get one buffer ring
+    per radius in ring_radii (miles), built in a single batch per radius.
     """
     kml = simplekml.Kml()
+    styles = build_styles()
     
     logging.info(f"Generating KML for {len(sites)} sites, {len(broadcast_towers)} towers, {len(mines)} active mines, {len(inactive_mines)} inactive mines, {len(hazardous_minerals)} hazardous sites...")
 
@@ -16,168 +134,117 @@ def generate_kml(sites, broadcast_towers, mines, inactive_mines, hazardous_miner
     # We'll create a dictionary to hold folder references
     folders = {}
     
-    tri_folder = toxic_folder.newfolder(name="EPA TRI Facilities")
-    folders['EPA TRI'] = tri_folder
-    
-    other_folder = toxic_folder.newfolder(name="Other Toxic Sites")
-    folders['Other'] = other_folder
+    for folder_name in FIXED_TOXIC_FOLDERS:
+        folders[folder_name] = toxic_folder.newfolder(name=folder_name)
     
     towers_folder = kml.newfolder(name="Broadcast Towers")
     mines_folder = kml.newfolder(name="Mines") # Combined for simplicity, or split if needed
     haz_folder = kml.newfolder(name="Hazardous Minerals")
 
+    with profiling.stage('rings', sites=len(sites), mines=len(mines)):
+        site_rings = record_rings(sites, ring_radii, ring_vertices)
+        mine_rings = record_rings(mines, ring_radii, ring_vertices)
+
     # Add Toxic Sites
-    for site in sites:
-        # Determine folder and style based on source
-        source = site.get('source', 'Unknown')
-        
-        if 'Ecology' in source:
-            if 'WA Ecology' not in folders:
-                folders['WA Ecology'] = toxic_folder.newfolder(name="WA Ecology Cleanup Sites")
-            target_folder = folders['WA Ecology']
-            
-            # Rank coloring for Ecology
-            rank = str(site.get('rank', ''))
-            if rank == '6': color = simplekml.Color.pink
-            elif rank in ['4', '5']: color = simplekml.Color.green
-            elif rank == '3': color = simplekml.Color.yellow
-            elif rank in ['0', '1', '2']: color = simplekml.Color.red
-            else: color = simplekml.Color.blue
-            
-        elif 'TRI' in source:
-            target_folder = tri_folder
-            color = simplekml.Color.purple
-            
-        else:
-            # Generic State Cleanup or Other
-            if source not in folders:
-                folders[source] = toxic_folder.newfolder(name=f"{source} Sites")
-            target_folder = folders[source]
-            color = simplekml.Color.brown
-
-        # Ensure Name exists
-        name = site.get('name') or "Unknown Site"
+    with profiling.stage('Toxic Sites', items=len(sites)):
+        for site, rings in zip(sites, site_rings):
+            # Determine folder and style based on source
+            folder_name, category = site_folder(site)
+            if folder_name not in folders:
+                folders[folder_name] = toxic_folder.newfolder(name=folder_name)
+            target_folder = folders[folder_name]
+
+            # Ensure Name exists
+            name = site.get('name') or "Unknown Site"
         
-        pnt = target_folder.newpoint(name=name)
-        pnt.coords = [(site['lon'], site['lat'])]
+            pnt = target_folder.newpoint(name=name)
+            pnt.coords = round_coords([(site['lon'], site['lat'])], precision)
         
-        # Add URL to description
-        desc = f"Source: {source}<br/>Details: {site.get('details', '')}"
-        if site.get('url'):
-            desc += f"<br/><a href='{site['url']}'>Source Data</a>"
-        pnt.description = desc
+            # Add URL to description
+            pnt.description = describe(site)
         
-        pnt.style.iconstyle.color = color
+            pnt.style = styles[(category, 'point')]
         
-        # Add Ring for Toxic Sites
-        circle = target_folder.newpolygon(name=f"1 Mile Radius - {name}")
-        circle.outerboundaryis = create_circle(site['lat'], site['lon'], 1609.34) # 1 mile in meters
-        circle.style.polystyle.color = simplekml.Color.changealphaint(100, color)
-        circle.style.linestyle.color = color
-        circle.style.linestyle.width = 2
+            # Add Rings for Toxic Sites
+            for radius, ring in rings:
+                circle = target_folder.newpolygon(name=ring_name(radius, name))
+                circle.outerboundaryis = round_coords(ring.tolist(), precision)
+                circle.style = styles[(category, 'ring')]
 
     # Add Broadcast Towers
-    for tower in broadcast_towers:
-        pnt = towers_folder.newpoint(name=tower['name'])
-        pnt.coords = [(tower['lon'], tower['lat'])]
+    with profiling.stage('Broadcast Towers', items=len(broadcast_towers)):
+        for tower in broadcast_towers:
+            pnt = towers_folder.newpoint(name=tower.get('name') or "Unknown Tower")
+            pnt.coords = round_coords([(tower['lon'], tower['lat'])], precision)
         
-        desc = f"Source: {tower['source']}<br/>Details: {tower['details']}"
-        if tower.get('url'):
-            desc += f"<br/><a href='{tower['url']}'>Source Data</a>"
-        pnt.description = desc
+            pnt.description = describe(tower)
         
-        # Use a Flag icon for towers
-        pnt.style.iconstyle.icon.href = 'http://maps.google.com/mapfiles/kml/shapes/flag.png'
-        pnt.style.iconstyle.color = simplekml.Color.cyan # Tinted Cyan
+            pnt.style = styles[('tower', 'point')]
 
     # Add Active Mines
-    for mine in mines:
-        name = mine.get('name') or "Unknown Mine"
-        pnt = mines_folder.newpoint(name=name)
-        pnt.coords = [(mine['lon'], mine['lat'])]
+    with profiling.stage('Mines', items=len(mines)):
+        for mine, rings in zip(mines, mine_rings):
+            name = mine.get('name') or "Unknown Mine"
+            pnt = mines_folder.newpoint(name=name)
+            pnt.coords = round_coords([(mine['lon'], mine['lat'])], precision)
         
-        desc = f"Source: {mine.get('source', 'Unknown')}<br/>Details: {mine.get('details', '')}"
-        if mine.get('url'):
-            desc += f"<br/><a href='{mine['url']}'>Source Data</a>"
-        pnt.description = desc
+            pnt.description = describe(mine)
         
-        pnt.style.iconstyle.icon.href = 'http://maps.google.com/mapfiles/kml/shapes/open-diamond.png'
-        pnt.style.iconstyle.scale = 0.8
-        pnt.style.iconstyle.color = simplekml.Color.orange
+            pnt.style = styles[('mine', 'point')]
         
-        # Add Ring for Mines (Orange)
-        circle = mines_folder.newpolygon(name=f"1 Mile Radius - {name}")
-        circle.outerboundaryis = create_circle(mine['lat'], mine['lon'], 1609.34)
-        circle.style.polystyle.color = simplekml.Color.changealphaint(100, simplekml.Color.orange)
-        circle.style.linestyle.color = simplekml.Color.orange
-        circle.style.linestyle.width = 2
+            # Add Rings for Mines (Orange)
+            for radius, ring in rings:
+                circle = mines_folder.newpolygon(name=ring_name(radius, name))
+                circle.outerboundaryis = round_coords(ring.tolist(), precision)
+                circle.style = styles[('mine', 'ring')]
 
     # Add Inactive Mines
-    for mine in inactive_mines:
-        name = mine.get('name') or "Unknown Inactive Mine"
-        # If we want to separate them in the KML structure, we can create a subfolder or just add to mines_folder
-        # Let's add to mines_folder but with different icon/color
-        pnt = mines_folder.newpoint(name=name)
-        pnt.coords = [(mine['lon'], mine['lat'])]
+    with profiling.stage('Inactive Mines', items=len(inactive_mines)):
+        for mine in inactive_mines:
+            name = mine.get('name') or "Unknown Inactive Mine"
+            # If we want to separate them in the KML structure, we can create a subfolder or just add to mines_folder
+            # Let's add to mines_folder but with different icon/color
+            pnt = mines_folder.newpoint(name=name)
+            pnt.coords = round_coords([(mine['lon'], mine['lat'])], precision)
         
-        desc = f"Source: {mine.get('source', 'Unknown')}<br/>Details: {mine.get('details', '')}"
-        if mine.get('url'):
-            desc += f"<br/><a href='{mine['url']}'>Source Data</a>"
-        pnt.description = desc
+            pnt.description = describe(mine)
         
-        # Use a shaded dot or similar for inactive
-        pnt.style.iconstyle.icon.href = 'http://maps.google.com/mapfiles/kml/shapes/shaded_dot.png'
-        pnt.style.iconstyle.scale = 0.8
-        pnt.style.iconstyle.color = simplekml.Color.grey
+            pnt.style = styles[('inactive_mine', 'point')]
 
     # Add Hazardous Minerals
-    for site in hazardous_minerals:
-        desc = f"Source: {site['source']}<br/>Details: {site['details']}"
-        if site.get('url'):
-            desc += f"<br/><a href='{site['url']}'>Source Data</a>"
-            
-        if site.get('geom_type') == 'Point':
-            pnt = haz_folder.newpoint(name=site['name'])
-            pnt.coords = [(site['lon'], site['lat'])]
-            pnt.description = desc
-            pnt.style.iconstyle.icon.href = 'http://maps.google.com/mapfiles/kml/shapes/caution.png'
-            pnt.style.iconstyle.color = simplekml.Color.brown
-        elif site.get('geom_type') == 'Polygon':
-            poly = haz_folder.newpolygon(name=site['name'])
-            poly.outerboundaryis = site['rings'][0] # Use first ring
-            poly.description = desc
-            poly.style.polystyle.color = simplekml.Color.changealphaint(100, simplekml.Color.brown)
-            poly.style.linestyle.color = simplekml.Color.brown
-            poly.style.linestyle.width = 2
+    with profiling.stage('Hazardous Minerals', items=len(hazardous_minerals)):
+        for site in hazardous_minerals:
+            desc = describe(site)
+            name = site.get('name') or "Unknown Hazardous Mineral"
+
+            if site.get('geom_type') == 'Point':
+                pnt = haz_folder.newpoint(name=name)
+                pnt.coords = round_coords([(site['lon'], site['lat'])], precision)
+                pnt.description = desc
+                pnt.style = styles[('hazardous', 'point')]
+            elif site.get('geom_type') == 'Polygon':
+                poly = haz_folder.newpolygon(name=name)
+                poly.outerboundaryis = round_coords(site['rings'][0], precision) # Use first ring
+                poly.description = desc
+                poly.style = styles[('hazardous', 'ring')]
             
-            # Add a pin for the polygon too (centroid)
-            pnt = haz_folder.newpoint(name=site['name'])
-            pnt.coords = [(site['lon'], site['lat'])]
-            pnt.description = desc
-            pnt.style.iconstyle.icon.href = 'http://maps.google.com/mapfiles/kml/shapes/caution.png'
-            pnt.style.iconstyle.color = simplekml.Color.brown
-
-    kml.save(output_file)
+                # Add a pin for the polygon too (centroid)
+                pnt = haz_folder.newpoint(name=name)
+                pnt.coords = round_coords([(site['lon'], site['lat'])], precision)
+                pnt.description = desc
+                pnt.style = styles[('hazardous', 'point')]
+
+    # Unformatted output: no pretty-print whitespace
+    with profiling.stage('save'):
+        kml.save(output_file, format=False)
     return True
 
-def create_circle(lat, lon, radius_meters):
+def ring_name(radius_miles, name):
+    return f"{radius_miles:g} Mile Radius - {name}"
+
+def create_circle(lat, lon, radius_meters, vertices=36):
     """
     Returns a list of coordinates forming a circle around the point.
+    Single-point wrapper around geometry.buffer_rings.
     """
-    coords = []
-    R = 6378137 # Earth's radius in meters
-    
-    for i in range(0, 361, 10): # 36 steps
-        angle = math.radians(i)
-        
-        lat1 = math.radians(lat)
-        lon1 = math.radians(lon)
-        
-        lat2 = math.asin(math.sin(lat1)*math.cos(radius_meters/R) + 
-                         math.cos(lat1)*math.sin(radius_meters/R)*math.cos(angle))
-        lon2 = lon1 + math.atan2(math.sin(angle)*math.sin(radius_meters/R)*math.cos(lat1), 
-                                 math.cos(radius_meters/R)-math.sin(lat1)*math.sin(lat2))
-        
-        coords.append((math.degrees(lon2), math.degrees(lat2)))
-        
-    return coords
+    return [tuple(c) for c in buffer_rings([lat], [lon], radius_meters, vertices)[0].tolist()]
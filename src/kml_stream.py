@@ -0,0 +1,313 @@
+import math
+import logging
+import zipfile
+from contextlib import contextmanager
+from lxml import etree
+from src import profiling
+from src.geometry import DEFAULT_RING_RADII_MILES, record_rings
+from src.kml_generator import (DEFAULT_PRECISION, FIXED_TOXIC_FOLDERS, describe, ring_name,
+                               site_folder, style_id, style_specs)
+
+KML_NS = 'http://www.opengis.net/kml/2.2'
+
+# KMZ level of detail: grid cell size for chunks, and how many screen pixels a
+# chunk's Region must cover before its contents load
+CHUNK_DEGREES = 0.25
+POINT_MIN_LOD_PIXELS = 16
+POLYGON_MIN_LOD_PIXELS = 128
+RING_MIN_LOD_PIXELS = 256
+REGION_PAD_DEGREES = 0.005
+
+# Records whose buffer rings are computed together; only one batch of rings
+# is held in memory while placemarks are written
+RING_BATCH_SIZE = 1000
+
+def stream_kml(sites, broadcast_towers, mines, inactive_mines, hazardous_minerals, search_term, output_file,
+               precision=DEFAULT_PRECISION, ring_radii=DEFAULT_RING_RADII_MILES, ring_vertices=None):
+    """
+    Writes the same document as generate_kml, but incrementally with lxml's
+    xmlfile: each placemark is built, written and dropped, so memory stays flat
+    however many features there are. Folder layout and shared styles match
+    generate_kml.
+    """
+    logging.info(f"Streaming KML for {len(sites)} sites, {len(broadcast_towers)} towers, {len(mines)} active mines, {len(inactive_mines)} inactive mines, {len(hazardous_minerals)} hazardous sites...")
+    write_document(output_file, sites, broadcast_towers, mines, inactive_mines, hazardous_minerals, precision,
+                   ring_radii=ring_radii, ring_vertices=ring_vertices)
+    return True
+
+def stream_kmz(sites, broadcast_towers, mines, inactive_mines, hazardous_minerals, search_term, output_file,
+               precision=DEFAULT_PRECISION, ring_radii=DEFAULT_RING_RADII_MILES, ring_vertices=None):
+    """
+    Writes a compressed KMZ whose features sit in spatial chunks behind
+    <Region>/<Lod>, so Google Earth only draws a chunk once it covers enough
+    of the screen. Points show up early; 1-mile rings and mineral polygons
+    only when zoomed in.
+    """
+    logging.info(f"Streaming KMZ for {len(sites)} sites, {len(broadcast_towers)} towers, {len(mines)} active mines, {len(inactive_mines)} inactive mines, {len(hazardous_minerals)} hazardous sites...")
+    with zipfile.ZipFile(output_file, 'w', compression=zipfile.ZIP_DEFLATED) as kmz:
+        with kmz.open('doc.kml', 'w') as doc:
+            write_document(doc, sites, broadcast_towers, mines, inactive_mines, hazardous_minerals, precision,
+                           lod=True, ring_radii=ring_radii, ring_vertices=ring_vertices)
+    return True
+
+def write_document(output, sites, broadcast_towers, mines, inactive_mines, hazardous_minerals, precision=DEFAULT_PRECISION,
+                   lod=False, ring_radii=DEFAULT_RING_RADII_MILES, ring_vertices=None):
+    """
+    Streams a complete KML document (styles + folders) to a path or binary file object.
+    """
+    with etree.xmlfile(output, encoding='utf-8') as xf:
+        xf.write_declaration()
+        # Children are written unqualified under the default namespace declared
+        # here, which keeps lxml from repeating xmlns on every placemark
+        with xf.element('kml', xmlns=KML_NS):
+            with xf.element('Document'):
+                for key, spec in style_specs().items():
+                    xf.write(style_element(key, spec))
+                write_folders(xf, sites, broadcast_towers, mines, inactive_mines, hazardous_minerals, precision, lod,
+                              ring_radii, ring_vertices)
+
+def write_folders(xf, sites, broadcast_towers, mines, inactive_mines, hazardous_minerals, precision=DEFAULT_PRECISION,
+                  lod=False, ring_radii=DEFAULT_RING_RADII_MILES, ring_vertices=None):
+    """
+    Streams the standard folders into an open xmlfile.
+    With lod=True, points and rings/polygons of each folder are written as
+    separate sets of spatial chunks, each behind its own Region.
+    Buffer rings for sites and mines are computed RING_BATCH_SIZE records at
+    a time (per chunk with lod=True) as their placemarks are written.
+    """
+    # Toxic Sites: fixed subfolders first, then one per source in first-seen order
+    folder_names = list(FIXED_TOXIC_FOLDERS)
+    for site in sites:
+        name, _ = site_folder(site)
+        if name not in folder_names:
+            folder_names.append(name)
+
+    def site_point(site):
+        category = site_folder(site)[1]
+        return point_placemark(site.get('name') or "Unknown Site", site, (category, 'point'), precision)
+
+    def site_ring(entry):
+        site = entry['record']
+        category = site_folder(site)[1]
+        name = ring_name(entry['radius'], site.get('name') or 'Unknown Site')
+        return polygon_placemark(name, entry['ring'].tolist(), (category, 'ring'), precision)
+
+    def mine_point(mine):
+        return point_placemark(mine.get('name') or "Unknown Mine", mine, ('mine', 'point'), precision)
+
+    def mine_ring(entry):
+        name = ring_name(entry['radius'], entry['record'].get('name') or 'Unknown Mine')
+        return polygon_placemark(name, entry['ring'].tolist(), ('mine', 'ring'), precision)
+
+    def inactive_point(mine):
+        return point_placemark(mine.get('name') or "Unknown Inactive Mine", mine, ('inactive_mine', 'point'), precision)
+
+    def tower_point(tower):
+        return point_placemark(tower.get('name') or "Unknown Tower", tower, ('tower', 'point'), precision)
+
+    def mineral_polygon(site):
+        # Use first ring
+        return polygon_placemark(site.get('name') or "Unknown Hazardous Mineral", site['rings'][0], ('hazardous', 'ring'),
+                                 precision, describe(site))
+
+    def mineral_point(site):
+        # Points, and a pin at the centroid of each polygon
+        return point_placemark(site.get('name') or "Unknown Hazardous Mineral", site, ('hazardous', 'point'), precision)
+
+    minerals = [s for s in hazardous_minerals if s.get('geom_type') in ('Point', 'Polygon')]
+    polygons = [s for s in minerals if s.get('geom_type') == 'Polygon']
+
+    with profiling.stage('Toxic Sites', items=len(sites)), _folder(xf, "Toxic Sites"):
+        for folder_name in folder_names:
+            folder_sites = [s for s in sites if site_folder(s)[0] == folder_name]
+            with _folder(xf, folder_name):
+                if lod:
+                    _write_chunks(xf, folder_sites, site_point, _point_extent, POINT_MIN_LOD_PIXELS, "Sites")
+                    _write_ring_chunks(xf, folder_sites, site_ring, ring_radii, ring_vertices, "Buffer Rings")
+                else:
+                    for site, site_entries in _iter_ring_entries(folder_sites, ring_radii, ring_vertices):
+                        xf.write(site_point(site))
+                        for entry in site_entries:
+                            xf.write(site_ring(entry))
+
+    with profiling.stage('Broadcast Towers', items=len(broadcast_towers)), _folder(xf, "Broadcast Towers"):
+        if lod:
+            _write_chunks(xf, broadcast_towers, tower_point, _point_extent, POINT_MIN_LOD_PIXELS, "Towers")
+        else:
+            for tower in broadcast_towers:
+                xf.write(tower_point(tower))
+
+    with profiling.stage('Mines', items=len(mines) + len(inactive_mines)), _folder(xf, "Mines"):
+        if lod:
+            _write_chunks(xf, mines, mine_point, _point_extent, POINT_MIN_LOD_PIXELS, "Mines")
+            _write_ring_chunks(xf, mines, mine_ring, ring_radii, ring_vertices, "Buffer Rings")
+            _write_chunks(xf, inactive_mines, inactive_point, _point_extent, POINT_MIN_LOD_PIXELS, "Inactive Mines")
+        else:
+            for mine, mine_entries in _iter_ring_entries(mines, ring_radii, ring_vertices):
+                xf.write(mine_point(mine))
+                for entry in mine_entries:
+                    xf.write(mine_ring(entry))
+            for mine in inactive_mines:
+                xf.write(inactive_point(mine))
+
+    with profiling.stage('Hazardous Minerals', items=len(hazardous_minerals)), _folder(xf, "Hazardous Minerals"):
+        if lod:
+            _write_chunks(xf, polygons, mineral_polygon, _polygon_extent, POLYGON_MIN_LOD_PIXELS, "Areas")
+            _write_chunks(xf, minerals, mineral_point, _point_extent, POINT_MIN_LOD_PIXELS, "Locations")
+        else:
+            for site in minerals:
+                if site.get('geom_type') == 'Polygon':
+                    xf.write(mineral_polygon(site))
+                xf.write(mineral_point(site))
+
+def region_element(extent, min_lod_pixels, max_lod_pixels=-1):
+    """
+    Builds a <Region> for a (west, south, east, north) extent.
+    """
+    west, south, east, north = extent
+    region = etree.Element('Region')
+    box = etree.SubElement(region, 'LatLonAltBox')
+    _text(box, 'north', round(north, 6))
+    _text(box, 'south', round(south, 6))
+    _text(box, 'east', round(east, 6))
+    _text(box, 'west', round(west, 6))
+    lod = etree.SubElement(region, 'Lod')
+    _text(lod, 'minLodPixels', min_lod_pixels)
+    _text(lod, 'maxLodPixels', max_lod_pixels)
+    return region
+
+def _write_chunks(xf, records, make_placemark, extent_of, min_lod_pixels, label):
+    """
+    Groups records into CHUNK_DEGREES grid cells and writes each cell as a
+    subfolder with a Region covering its features.
+    """
+    for (row, col), chunk in _chunks(records):
+        _write_chunk(xf, chunk, make_placemark, extent_of, min_lod_pixels, label, row, col)
+
+def _write_ring_chunks(xf, records, make_placemark, radii_miles, vertices, label):
+    """
+    _write_chunks for the buffer rings of records, chunked by record position.
+    Rings are computed one chunk at a time.
+    """
+    for (row, col), chunk in _chunks(records):
+        entries = [entry for _, record_entries in _iter_ring_entries(chunk, radii_miles, vertices)
+                   for entry in record_entries]
+        _write_chunk(xf, entries, make_placemark, _ring_extent, RING_MIN_LOD_PIXELS, label, row, col)
+
+def _chunks(records):
+    """
+    Records grouped by CHUNK_DEGREES grid cell: sorted [((row, col), records)].
+    """
+    chunks = {}
+    for record in records:
+        key = (math.floor(record['lat'] / CHUNK_DEGREES), math.floor(record['lon'] / CHUNK_DEGREES))
+        chunks.setdefault(key, []).append(record)
+    return sorted(chunks.items(), key=lambda item: item[0])
+
+def _write_chunk(xf, items, make_placemark, extent_of, min_lod_pixels, label, row, col):
+    if not items:
+        return
+    extents = [extent_of(item) for item in items]
+    extent = (min(e[0] for e in extents), min(e[1] for e in extents),
+              max(e[2] for e in extents), max(e[3] for e in extents))
+    with _folder(xf, f"{label} ({row * CHUNK_DEGREES:.2f}, {col * CHUNK_DEGREES:.2f})",
+                 region_element(_pad_extent(extent), min_lod_pixels)):
+        for item in items:
+            xf.write(make_placemark(item))
+
+def _pad_extent(extent):
+    # Regions need some area even for a single point
+    west, south, east, north = extent
+    return (west - REGION_PAD_DEGREES, south - REGION_PAD_DEGREES, east + REGION_PAD_DEGREES, north + REGION_PAD_DEGREES)
+
+def _point_extent(record):
+    return (record['lon'], record['lat'], record['lon'], record['lat'])
+
+def _ring_extent(entry):
+    lon_min, lat_min = entry['ring'].min(axis=0)
+    lon_max, lat_max = entry['ring'].max(axis=0)
+    return (float(lon_min), float(lat_min), float(lon_max), float(lat_max))
+
+def _iter_ring_entries(records, radii_miles, vertices):
+    """
+    Yields (record, [{'lat', 'lon', 'radius', 'ring', 'record'} per buffer ring]),
+    computing the rings RING_BATCH_SIZE records at a time.
+    """
+    for start in range(0, len(records), RING_BATCH_SIZE):
+        batch = records[start:start + RING_BATCH_SIZE]
+        for record, rings in zip(batch, record_rings(batch, radii_miles, vertices)):
+            yield record, [{'lat': record['lat'], 'lon': record['lon'], 'radius': radius, 'ring': ring,
+                            'record': record} for radius, ring in rings]
+
+def _polygon_extent(record):
+    ring = record['rings'][0]
+    lons = [p[0] for p in ring]
+    lats = [p[1] for p in ring]
+    return (min(lons), min(lats), max(lons), max(lats))
+
+def style_element(key, spec):
+    """
+    Builds a shared <Style> element from a style_specs() entry.
+    """
+    style = etree.Element('Style', id=style_id(key))
+    if key[1] == 'point':
+        icon_style = etree.SubElement(style, 'IconStyle')
+        _text(icon_style, 'color', spec['color'])
+        if spec.get('scale') is not None:
+            _text(icon_style, 'scale', spec['scale'])
+        if spec.get('icon'):
+            icon = etree.SubElement(icon_style, 'Icon')
+            _text(icon, 'href', spec['icon'])
+    else:
+        line_style = etree.SubElement(style, 'LineStyle')
+        _text(line_style, 'color', spec['line_color'])
+        _text(line_style, 'width', spec['width'])
+        poly_style = etree.SubElement(style, 'PolyStyle')
+        _text(poly_style, 'color', spec['poly_color'])
+    return style
+
+def point_placemark(name, record, style_key, precision=DEFAULT_PRECISION):
+    placemark = _placemark(name, describe(record), style_key)
+    point = etree.SubElement(placemark, 'Point')
+    _text(point, 'coordinates', format_coords([(record['lon'], record['lat'])], precision))
+    return placemark
+
+def polygon_placemark(name, ring, style_key, precision=DEFAULT_PRECISION, description=None):
+    placemark = _placemark(name, description, style_key)
+    polygon = etree.SubElement(placemark, 'Polygon')
+    boundary = etree.SubElement(polygon, 'outerBoundaryIs')
+    linear_ring = etree.SubElement(boundary, 'LinearRing')
+    _text(linear_ring, 'coordinates', format_coords(ring, precision))
+    return placemark
+
+def format_coords(coords, precision=DEFAULT_PRECISION):
+    """
+    KML coordinate string for (lon, lat) pairs, rounded to precision decimals.
+    """
+    return " ".join(f"{round(c[0], precision)},{round(c[1], precision)}" for c in coords)
+
+def _placemark(name, description, style_key):
+    placemark = etree.Element('Placemark')
+    _text(placemark, 'name', name)
+    if description:
+        _text(placemark, 'description', description)
+    _text(placemark, 'styleUrl', f"#{style_id(style_key)}")
+    return placemark
+
+@contextmanager
+def _folder(xf, name, region=None):
+    """
+    Writes <Folder><name/>[<Region/>]...</Folder> around streamed content.
+    """
+    with xf.element('Folder'):
+        element = etree.Element('name')
+        element.text = name
+        xf.write(element)
+        if region is not None:
+            xf.write(region)
+        yield
+
+def _text(parent, tag, value):
+    element = etree.SubElement(parent, tag)
+    element.text = str(value)
+    return element
@@ -0,0 +1,211 @@
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from src import exporters, features, profiling, warehouse
+from src.data_fetchers import (fetch_all_data, get_county_for_zip, get_location_details, DEFAULT_MAX_WORKERS,
+                               STATE_BBOXES)
+from src.geometry import DEFAULT_RING_RADII_MILES
+from src.kml_generator import generate_kml, DEFAULT_PRECISION
+from src.kml_stream import stream_kml, stream_kmz
+from src.spatial import DEFAULT_RADIUS_MILES
+
+# Output writers selectable by name: (function, file extension)
+WRITERS = {
+    'kml': (generate_kml, 'kml'),
+    'stream': (stream_kml, 'kml'),
+    'kmz': (stream_kmz, 'kmz')
+}
+
+# Export formats written alongside (or instead of) the KML, in one pass: see exporters.SINKS
+EXPORTS = tuple(exporters.SINKS)
+
+# Zip lookups run at the same time when resolving a batch
+DEFAULT_RESOLVE_WORKERS = 8
+
+def run_query(queries, output_dir='output', radius_miles=DEFAULT_RADIUS_MILES, writer='kml',
+              precision=DEFAULT_PRECISION, ring_radii=DEFAULT_RING_RADII_MILES, ring_vertices=None,
+              max_workers=DEFAULT_MAX_WORKERS, render_workers=None, exports=()):
+    """
+    Resolves, fetches, filters and renders one or many zips/counties.
+    queries is a zip/county string or a list of them.
+
+    A single query pushes its county/zip filters down to the servers, as the
+    interactive CLI does. A batch fetches each state's sources once and
+    answers every query in that state from the shared data. Fetched data is
+    held and filtered as a columnar feature table (see features.filter_table). Outputs are
+    rendered in parallel on up to render_workers processes (default: all cores).
+
+    exports lists extra formats from EXPORTS (geojson, csv, fgb) written from
+    the same filtered layers as the KML, in one pass over the records. Set
+    writer=None to write only the exports.
+
+    Returns one dict per distinct search:
+    {'query', 'search_term', 'is_zip', 'state', 'output_file', 'output_files', 'counts', 'success'}.
+    output_file is the KML (or the first export); output_files lists every file written.
+    """
+    if isinstance(queries, str):
+        queries = [queries]
+    resolved = resolve_queries(queries)
+    if not resolved:
+        return []
+
+    os.makedirs(output_dir, exist_ok=True)
+    write, extension = WRITERS[writer] if writer else (None, None)
+    extensions = ([extension] if extension else []) + [exporters.SINKS[fmt].extension for fmt in exports]
+    if not extensions:
+        raise ValueError("Nothing to write: pass a writer and/or exports")
+    render_kwargs = {'precision': precision, 'ring_radii': ring_radii, 'ring_vertices': ring_vertices}
+
+    if len(resolved) == 1:
+        query = resolved[0]
+        data = fetch_all_data(query['search_term'], query['is_zip'], query['state'], query['lat'], query['lon'],
+                              max_workers=max_workers, radius_miles=radius_miles, as_table=True)
+        jobs = [_prepare(query, data, radius_miles, output_dir, extensions, statewide=False)]
+    else:
+        states = sorted({q['state'] for q in resolved})
+        logging.info(f"Fetching statewide data once for {', '.join(states)} ({len(resolved)} searches)...")
+        statewide = {state: fetch_all_data(None, False, state, max_workers=max_workers, radius_miles=radius_miles,
+                                           as_table=True)
+                     for state in states}
+        # One spatial index per state, shared by every search in it
+        indexes = {state: features.spatial_index(table) for state, table in statewide.items()}
+        jobs = [_prepare(q, statewide[q['state']], radius_miles, output_dir, extensions, statewide=True,
+                         index=indexes[q['state']])
+                for q in resolved]
+
+    if len(jobs) == 1:
+        job = jobs[0]
+        job['result']['success'] = _render(write, exports, job, render_kwargs)
+        return [job['result']]
+
+    logging.info(f"Rendering {len(jobs)} outputs...")
+    with ProcessPoolExecutor(max_workers=render_workers) as executor:
+        futures = [executor.submit(_render_in_worker, write, exports, job, render_kwargs, profiling.enabled())
+                   for job in jobs]
+        for job, future in zip(jobs, futures):
+            try:
+                job['result']['success'], records = future.result()
+                profiling.merge(records)
+            except Exception as e:
+                logging.error(f"Error rendering {job['result']['output_file']}: {e}")
+                job['result']['success'] = False
+    return [job['result'] for job in jobs]
+
+def sync_warehouse(states=None, max_workers=DEFAULT_MAX_WORKERS, path=None):
+    """
+    Downloads every source statewide (bypassing any existing snapshot) and
+    stores it in the warehouse. states defaults to all supported states.
+    Returns {state: {layer: count}}.
+    """
+    counts = {}
+    for state in states or list(STATE_BBOXES):
+        state = state.upper()
+        logging.info(f"Syncing {state} into the warehouse...")
+        data = fetch_all_data(None, False, state, max_workers=max_workers, use_warehouse=False)
+        counts[state] = warehouse.store_state(state, data, path)
+    return counts
+
+def resolve_query(user_input, state=None):
+    """
+    Turns a zip or county name into a search:
+    {'query', 'search_term', 'is_zip', 'state', 'lat', 'lon', 'city'}.
+    Counties are in state (default WA); a zip's state comes from the lookup.
+    WA zips are widened to their county so the search includes all of its data.
+    """
+    user_input = str(user_input).strip()
+    query = {
+        'query': user_input,
+        'search_term': user_input,
+        'is_zip': user_input.isdigit(),
+        'state': (state or 'WA').upper(), # Default
+        'lat': None,
+        'lon': None,
+        'city': None
+    }
+    if not query['is_zip']:
+        return query
+
+    details = get_location_details(user_input)
+    if not details:
+        logging.warning(f"Could not determine location for {user_input}. Defaulting to WA.")
+        return query
+
+    query.update(state=details['state'], lat=details.get('lat'), lon=details.get('lon'), city=details.get('city'))
+    if query['state'] == 'WA':
+        # For WA, we still want the County expansion behavior
+        wa_county = get_county_for_zip(user_input)
+        if wa_county:
+            logging.info(f"Zip {user_input} is in {wa_county} County; searching the whole county.")
+            query.update(search_term=wa_county, is_zip=False)
+    return query
+
+def resolve_queries(queries, max_workers=DEFAULT_RESOLVE_WORKERS):
+    """
+    Resolves queries concurrently, dropping blanks and searches that resolve
+    to the same county/zip (they would write the same output).
+    """
+    queries = [q for q in (str(q).strip() for q in queries) if q]
+    with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='resolve') as executor:
+        resolved = list(executor.map(resolve_query, queries))
+
+    unique = {}
+    for query in resolved:
+        key = (query['search_term'].upper(), query['is_zip'], query['state'])
+        unique.setdefault(key, query)
+    return list(unique.values())
+
+def output_path(output_dir, search_term, extension='kml'):
+    safe_term = "".join([c for c in search_term if c.isalnum() or c in (' ', '_')]).strip()
+    return os.path.join(output_dir, f"toxMap[{safe_term}].{extension}")
+
+def filter_query(query, data, radius_miles=DEFAULT_RADIUS_MILES, statewide=False):
+    """
+    Filters fetched record lists (fetch_all_data's 5-tuple) for a resolved
+    query (see resolve_query), through features.filter_table. Set statewide
+    when data is a whole state rather than fetch_all_data's answer for this
+    query.
+    """
+    return features.to_layers(features.filter_table(features.to_table(data), query, radius_miles, statewide))
+
+def _render(write, exports, job, render_kwargs):
+    """
+    Writes one job's outputs as a profiling stage: the KML with write (if
+    any), then every export in a single exporters.export pass.
+    """
+    result = job['result']
+    paths = list(result['output_files'])
+    with profiling.stage('render', output=result['output_file'], writer=write.__name__ if write else None,
+                         exports=list(exports), **result['counts']):
+        success = True
+        if write:
+            success = write(*job['layers'], result['search_term'], paths.pop(0), **render_kwargs)
+        if exports:
+            success = exporters.export(*job['layers'], dict(zip(exports, paths)),
+                                       precision=render_kwargs['precision']) and success
+        return success
+
+def _render_in_worker(write, exports, job, render_kwargs, profile):
+    """
+    _render in a worker process. Returns (success, profiling records made
+    in the worker), for the parent to merge into its report.
+    """
+    profiling.configure(enabled=profile)
+    profiling.reset()
+    success = _render(write, exports, job, render_kwargs)
+    return success, profiling.snapshot() if profile else None
+
+def _prepare(query, table, radius_miles, output_dir, extensions, statewide, index=None):
+    """
+    Filters a fetched (or shared statewide) feature table for one search and
+    describes its output. Polygons cut from statewide layers are generalized
+    to the output's extent. index is the table's spatial index, if built.
+    """
+    filtered = features.filter_table(table, query, radius_miles, statewide, index)
+    layers = features.to_layers(features.generalize(filtered) if statewide else filtered)
+
+    result = {key: query[key] for key in ('query', 'search_term', 'is_zip', 'state')}
+    result['output_files'] = [output_path(output_dir, query['search_term'], extension) for extension in extensions]
+    result['output_file'] = result['output_files'][0]
+    result['counts'] = dict(zip(('sites', 'towers', 'mines', 'inactive_mines', 'hazardous_minerals'),
+                                (len(layer) for layer in layers)))
+    return {'result': result, 'layers': layers}
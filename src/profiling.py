@@ -0,0 +1,184 @@
+import time
+import json
+import pstats
+import cProfile
+import threading
+import contextvars
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+# Functions listed in the report when the run is wrapped in cProfile
+CPROFILE_TOP_FUNCTIONS = 40
+
+_settings = {
+    'enabled': False
+}
+
+# Completed stages and HTTP requests, in completion order
+_stages = []
+_requests = []
+_lock = threading.Lock()
+
+# Name of the innermost stage running in this thread/task (see propagate)
+_current = contextvars.ContextVar('profiling_stage', default=None)
+
+def configure(enabled=None):
+    """
+    Turns recording on or off. Recording is off by default, and then every
+    hook below is a no-op.
+    """
+    if enabled is not None:
+        _settings['enabled'] = enabled
+
+def enabled():
+    return _settings['enabled']
+
+def reset():
+    """
+    Forgets everything recorded so far.
+    """
+    with _lock:
+        _stages.clear()
+        _requests.clear()
+
+@contextmanager
+def stage(name, **fields):
+    """
+    Times the enclosed block as a stage and yields its record (a dict), so the
+    block can add counters to it (e.g. record['out'] = len(result)).
+    Nested stages are named 'outer/inner'. HTTP requests made inside the
+    block (on this thread, or on threads started through propagate) are
+    attributed to it.
+    """
+    if not _settings['enabled']:
+        yield {}
+        return
+
+    parent = _current.get()
+    full_name = f"{parent}/{name}" if parent else name
+    record = {'stage': full_name, **fields}
+    token = _current.set(full_name)
+    start = time.perf_counter()
+    try:
+        yield record
+    except Exception as e:
+        record['error'] = str(e)
+        raise
+    finally:
+        record['seconds'] = round(time.perf_counter() - start, 6)
+        _current.reset(token)
+        with _lock:
+            _stages.append(record)
+
+def propagate(fn):
+    """
+    Wraps fn so that it runs inside the caller's current stage when handed to
+    a thread pool (contextvars are not inherited by pool threads).
+    """
+    if not _settings['enabled']:
+        return fn
+    name = _current.get()
+
+    def run(*args, **kwargs):
+        token = _current.set(name)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current.reset(token)
+    return run
+
+def record_request(url, status, size, seconds, from_cache=False):
+    """
+    Records one HTTP request: status code (None when it failed), body bytes
+    received (None when unknown) and wall time.
+    """
+    if not _settings['enabled']:
+        return
+    parts = urlsplit(url)
+    entry = {'url': url, 'host': parts.netloc, 'path': parts.path, 'status': status, 'bytes': size,
+             'seconds': round(seconds, 6), 'cached': from_cache, 'stage': _current.get()}
+    with _lock:
+        _requests.append(entry)
+
+def merge(records):
+    """
+    Adds stages and requests recorded elsewhere (see snapshot), e.g. by a
+    render worker process.
+    """
+    if not _settings['enabled'] or not records:
+        return
+    with _lock:
+        _stages.extend(records.get('stages', []))
+        _requests.extend(records.get('requests', []))
+
+def snapshot():
+    """
+    Copies of the recorded stages and requests: {'stages': [...], 'requests': [...]}.
+    """
+    with _lock:
+        return {'stages': [dict(s) for s in _stages], 'requests': [dict(r) for r in _requests]}
+
+def report(**extra):
+    """
+    Builds the JSON-ready report: every stage and request, plus totals per
+    stage name and per host.
+    """
+    records = snapshot()
+
+    by_stage = {}
+    for record in records['stages']:
+        totals = by_stage.setdefault(record['stage'], {'count': 0, 'seconds': 0.0})
+        totals['count'] += 1
+        totals['seconds'] = round(totals['seconds'] + record['seconds'], 6)
+
+    by_host = {}
+    for request in records['requests']:
+        totals = by_host.setdefault(request['host'], {'requests': 0, 'cached': 0, 'bytes': 0, 'seconds': 0.0,
+                                                     'statuses': {}})
+        totals['requests'] += 1
+        totals['cached'] += 1 if request['cached'] else 0
+        totals['bytes'] += request['bytes'] or 0
+        totals['seconds'] = round(totals['seconds'] + request['seconds'], 6)
+        status = str(request['status'])
+        totals['statuses'][status] = totals['statuses'].get(status, 0) + 1
+
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        **extra,
+        'stage_totals': by_stage,
+        'hosts': by_host,
+        'stages': records['stages'],
+        'requests': records['requests']
+    }
+
+def write_report(path, **extra):
+    """
+    Writes report(**extra) to path as JSON.
+    """
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report(**extra), f, indent=2, default=str)
+
+@contextmanager
+def cprofile(path=None):
+    """
+    Runs the enclosed block under cProfile (main thread only) and yields a
+    dict that receives 'top': the CPROFILE_TOP_FUNCTIONS slowest functions
+    by cumulative time. Raw stats are dumped to path (for snakeviz/pstats)
+    when given.
+    """
+    result = {}
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield result
+    finally:
+        profiler.disable()
+        if path:
+            profiler.dump_stats(path)
+        stats = pstats.Stats(profiler)
+        top = []
+        for (filename, line, function), (_, calls, own, cumulative, _) in stats.stats.items():
+            top.append({'function': f"{filename}:{line}({function})", 'calls': calls,
+                        'own_seconds': round(own, 6), 'cumulative_seconds': round(cumulative, 6)})
+        top.sort(key=lambda f: f['cumulative_seconds'], reverse=True)
+        result['top'] = top[:CPROFILE_TOP_FUNCTIONS]
@@ -0,0 +1,298 @@
+import io
+import json
+import math
+import time
+import logging
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from src import exporters, features
+from src.data_fetchers import fetch_all_data, DEFAULT_MAX_WORKERS, STATE_BBOXES
+from src.kml_stream import stream_kml, stream_kmz
+from src.pipeline import resolve_query
+from src.spatial import DEFAULT_RADIUS_MILES
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8080
+
+# Statewide layers are reloaded after this long (seconds)
+DEFAULT_DATA_MAX_AGE = 12 * 60 * 60
+
+# Rendered results kept in memory, bounded by count and total size
+DEFAULT_CACHE_ITEMS = 256
+DEFAULT_CACHE_BYTES = 512 * 1024 * 1024
+
+# Largest radius= accepted, in miles
+MAX_RADIUS_MILES = 100
+
+# Resolved searches (zip/county -> state, centroid...) remembered
+DEFAULT_QUERY_CACHE_ITEMS = 4096
+
+# format parameter -> (writer, content type, file extension)
+FORMATS = {
+    'kml': (stream_kml, 'application/vnd.google-earth.kml+xml', 'kml'),
+    'kmz': (stream_kmz, 'application/vnd.google-earth.kmz', 'kmz'),
+    'geojson': (exporters.write_geojson, 'application/geo+json', 'geojson'),
+    'csv': (exporters.write_csv, 'text/csv', 'csv')
+}
+
+class LRUCache:
+    """
+    Thread-safe LRU of rendered bytes, bounded by item count and total size.
+    """
+
+    def __init__(self, max_items=DEFAULT_CACHE_ITEMS, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.items = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.items.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.items:
+                self.size -= len(self.items.pop(key))
+            self.items[key] = value
+            self.size += len(value)
+            while len(self.items) > self.max_items or self.size > self.max_bytes:
+                _, evicted = self.items.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.size = 0
+
+    def discard_if(self, predicate):
+        """
+        Drops the entries whose key satisfies predicate.
+        """
+        with self.lock:
+            for key in [key for key in self.items if predicate(key)]:
+                self.size -= len(self.items.pop(key))
+
+    def stats(self):
+        with self.lock:
+            return {'items': len(self.items), 'bytes': self.size, 'hits': self.hits, 'misses': self.misses}
+
+class MapService:
+    """
+    Answers map requests from statewide layers kept in memory.
+
+    Each state is fetched once (from the warehouse when synced, otherwise
+    live) into a columnar feature table, with its spatial index built once
+    alongside; searches filter both with features.filter_table. Each state is
+    reloaded after data_max_age. Rendered maps are kept in
+    an LRUCache keyed by search, radius, format and the load time of the
+    state's layers; a reload drops that state's entries. Only states in
+    STATE_BBOXES are served.
+    """
+
+    def __init__(self, radius_miles=DEFAULT_RADIUS_MILES, data_max_age=DEFAULT_DATA_MAX_AGE,
+                 cache=None, max_workers=DEFAULT_MAX_WORKERS, max_queries=DEFAULT_QUERY_CACHE_ITEMS):
+        self.radius_miles = radius_miles
+        self.data_max_age = data_max_age
+        self.cache = cache or LRUCache()
+        self.max_workers = max_workers
+        self.max_queries = max_queries
+        self.states = {}
+        self.queries = OrderedDict()
+        self.lock = threading.Lock()
+        self.state_locks = {}
+
+    def state_data(self, state):
+        """
+        Returns {'table', 'index', 'loaded_at'} for a state, loading it if missing or stale.
+        Raises ValueError for states outside STATE_BBOXES.
+        """
+        if state not in STATE_BBOXES:
+            raise ValueError(f"Unsupported state: {state}")
+        entry = self.states.get(state)
+        if entry and time.time() - entry['loaded_at'] < self.data_max_age:
+            return entry
+
+        with self.lock:
+            state_lock = self.state_locks.setdefault(state, threading.Lock())
+        # One load per state at a time; other requests for it wait and reuse it
+        with state_lock:
+            entry = self.states.get(state)
+            if entry and time.time() - entry['loaded_at'] < self.data_max_age:
+                return entry
+            logging.info(f"Loading statewide layers for {state}...")
+            table = fetch_all_data(None, False, state, max_workers=self.max_workers, radius_miles=self.radius_miles,
+                                   as_table=True)
+            entry = {'table': table, 'index': features.spatial_index(table), 'loaded_at': time.time()}
+            self.states[state] = entry
+            # Maps of the old layers can no longer be hit (the key holds loaded_at)
+            self.cache.discard_if(lambda key: key[2] == state)
+        return entry
+
+    def resolve(self, term, state=None):
+        """
+        resolve_query, memoized for the max_queries most recent searches.
+        Zips that could not be located are not memoized, so a failed lookup
+        is retried on the next request.
+        """
+        key = (term.upper(), (state or '').upper())
+        with self.lock:
+            query = self.queries.get(key)
+            if query is not None:
+                self.queries.move_to_end(key)
+                return query
+        query = resolve_query(term, state)
+        if not located(query):
+            return query
+        with self.lock:
+            self.queries[key] = query
+            while len(self.queries) > self.max_queries:
+                self.queries.popitem(last=False)
+        return query
+
+    def render(self, term, state=None, radius_miles=None, fmt='kml'):
+        """
+        Returns (body, query, cache_hit) for a zip or county search.
+        """
+        radius_miles = radius_miles or self.radius_miles
+        query = self.resolve(term, state)
+        # Checked first so that stale layers are reloaded even for cached maps
+        entry = self.state_data(query['state'])
+        key = (query['search_term'].upper(), query['is_zip'], query['state'], radius_miles, fmt, entry['loaded_at'])
+
+        body = self.cache.get(key)
+        if body is not None:
+            return body, query, True
+
+        filtered = features.filter_table(entry['table'], query, radius_miles, statewide=True, index=entry['index'])
+        layers = features.to_layers(features.generalize(filtered))
+
+        write = FORMATS[fmt][0]
+        buffer = io.BytesIO()
+        write(*layers, query['search_term'], buffer)
+        body = buffer.getvalue()
+        self.cache.put(key, body)
+        return body, query, False
+
+    def stats(self):
+        return {
+            'states': {state: {'loaded_at': entry['loaded_at'], 'features': features.layer_counts(entry['table'])}
+                       for state, entry in self.states.items()},
+            'cache': self.cache.stats()
+        }
+
+class MapRequestHandler(BaseHTTPRequestHandler):
+    """
+    GET /kml?zip=99021
+    GET /kml?county=Spokane&state=WA
+    Optional: format=kml|kmz|geojson|csv, radius=<miles>.
+    GET /health returns loaded states and cache statistics as JSON.
+    """
+    service = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+
+        if url.path == '/health':
+            self._send(200, json.dumps(self.service.stats()).encode('utf-8'), 'application/json')
+            return
+        if url.path != '/kml':
+            self._send_error(404, "Not found")
+            return
+
+        term = params.get('zip') or params.get('county')
+        fmt = params.get('format', 'kml').lower()
+        if not term or (params.get('zip') and not params['zip'].isdigit()):
+            self._send_error(400, "Pass zip=<zip code> or county=<name>&state=<WA|MT|ID>")
+            return
+        if fmt not in FORMATS:
+            self._send_error(400, f"Unknown format: {fmt}")
+            return
+        if params.get('state') and params['state'].upper() not in STATE_BBOXES:
+            self._send_error(400, f"Unsupported state: {params['state']} (use {'|'.join(STATE_BBOXES)})")
+            return
+        try:
+            radius_miles = float(params['radius']) if params.get('radius') else None
+        except ValueError:
+            radius_miles = math.nan
+        if radius_miles is not None and not (math.isfinite(radius_miles) and 0 < radius_miles <= MAX_RADIUS_MILES):
+            self._send_error(400, f"Invalid radius: {params['radius']} (use 0 < radius <= {MAX_RADIUS_MILES} miles)")
+            return
+
+        start = time.time()
+        try:
+            query = self.service.resolve(term, params.get('state'))
+            if not located(query):
+                self._send_error(404, f"Could not locate zip code {term}")
+                return
+            if query['state'] not in STATE_BBOXES:
+                self._send_error(400, f"{term} is not in a supported state ({'|'.join(STATE_BBOXES)})")
+                return
+            body, query, hit = self.service.render(term, params.get('state'), radius_miles, fmt)
+        except Exception as e:
+            logging.exception(f"Error rendering {term}: {e}")
+            self._send_error(500, "Could not build the map")
+            return
+
+        _, content_type, extension = FORMATS[fmt]
+        safe_term = "".join([c for c in query['search_term'] if c.isalnum() or c in (' ', '_')]).strip()
+        self._send(200, body, content_type, {
+            'Content-Disposition': f'attachment; filename="toxMap[{safe_term}].{extension}"',
+            'X-Cache': 'HIT' if hit else 'MISS',
+            'X-Render-Time': f"{time.time() - start:.3f}"
+        })
+
+    def _send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status, message):
+        self._send(status, json.dumps({'error': message}).encode('utf-8'), 'application/json')
+
+    def log_message(self, format, *args):
+        logging.info(f"{self.address_string()} - {format % args}")
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, preload=(), service=None):
+    """
+    Runs the map service until interrupted, loading the states in preload first.
+    """
+    service = service or MapService()
+    for state in preload:
+        service.state_data(state.upper())
+
+    handler = type('BoundMapRequestHandler', (MapRequestHandler,), {'service': service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    logging.info(f"Serving maps on http://{host}:{server.server_address[1]}/kml")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def located(query):
+    """
+    False for a zip search that resolve_query could not place (no centroid;
+    its state is then only the WA default).
+    """
+    return not query['is_zip'] or (query['lat'] is not None and query['lon'] is not None)
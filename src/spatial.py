@@ -0,0 +1,166 @@
+import math
+import numpy as np
+
+EARTH_RADIUS_MILES = 3958.8
+KM_PER_MILE = 1.609344
+MILES_PER_DEG_LAT = 69.0
+
+# Default proximity radius for towers, mines and minerals
+DEFAULT_RADIUS_MILES = 10
+
+# Half-width of the box searched for ID DEQ landfills around a zip
+ID_DEQ_LANDFILL_OFFSET_DEG = 0.25
+
+def to_miles(radius, units='mi'):
+    """
+    Converts a radius given in 'mi' or 'km' to miles.
+    """
+    if units == 'km':
+        return radius / KM_PER_MILE
+    if units == 'mi':
+        return radius
+    raise ValueError(f"Unknown distance units: {units}")
+
+def haversine_miles(lat, lon, lats, lons):
+    """
+    Great-circle distance in miles from one point to arrays of points.
+    """
+    lat1 = math.radians(lat)
+    lat2 = np.radians(lats)
+    dlat = lat2 - lat1
+    dlon = np.radians(lons) - math.radians(lon)
+    a = np.sin(dlat / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+def bbox_around(lat, lon, radius_miles):
+    """
+    Returns the (xmin, ymin, xmax, ymax) lon/lat box enclosing a circle of radius_miles.
+    The longitude span widens with latitude.
+    """
+    dlat = radius_miles / MILES_PER_DEG_LAT
+    cos_lat = max(math.cos(math.radians(min(abs(lat) + dlat, 89.9))), 1e-6)
+    dlon = min(radius_miles / (MILES_PER_DEG_LAT * cos_lat), 180.0)
+    return (lon - dlon, lat - dlat, lon + dlon, lat + dlat)
+
+def centroid(records):
+    """
+    Mean lat/lon of records with coordinates, or None.
+    """
+    points = [(r['lat'], r['lon']) for r in records if _has_coords(r)]
+    if not points:
+        return None
+    lats, lons = zip(*points)
+    return sum(lats) / len(lats), sum(lons) / len(lons)
+
+class SpatialIndex:
+    """
+    Grid index over a list of records with 'lat'/'lon' keys.
+
+    Built once per layer (or once per feature table, see from_points); each
+    radius query only measures the records in grid cells overlapping the
+    query's bounding box, using a vectorized haversine.
+    Records without coordinates are never returned.
+    """
+
+    def __init__(self, records, cell_deg=0.1):
+        self.records = records
+        self.cell_deg = cell_deg
+
+        positions = [i for i, r in enumerate(records) if _has_coords(r)]
+        self.positions = np.array(positions, dtype=np.int64)
+        self.lats = np.array([float(records[i]['lat']) for i in positions], dtype=np.float64)
+        self.lons = np.array([float(records[i]['lon']) for i in positions], dtype=np.float64)
+        self._bucket()
+
+    @classmethod
+    def from_points(cls, lats, lons, cell_deg=0.1):
+        """
+        Index over coordinate arrays, such as a feature table's lat/lon
+        columns. Query it with positions_within; NaN coordinates are skipped.
+        """
+        index = cls.__new__(cls)
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        index.records = None
+        index.cell_deg = cell_deg
+        index.positions = np.flatnonzero(~(np.isnan(lats) | np.isnan(lons)))
+        index.lats = lats[index.positions]
+        index.lons = lons[index.positions]
+        index._bucket()
+        return index
+
+    def _bucket(self):
+        # Bucket point offsets by grid cell
+        cell_deg = self.cell_deg
+        self.cells = {}
+        if len(self.positions):
+            rows = np.floor(self.lats / cell_deg).astype(np.int64)
+            cols = np.floor(self.lons / cell_deg).astype(np.int64)
+            order = np.lexsort((cols, rows))
+            keys = np.stack([rows[order], cols[order]], axis=1)
+            breaks = np.flatnonzero(np.any(keys[1:] != keys[:-1], axis=1)) + 1
+            for group in np.split(order, breaks):
+                self.cells[(int(rows[group[0]]), int(cols[group[0]]))] = group
+
+    def __len__(self):
+        return len(self.positions)
+
+    def _candidates(self, bbox):
+        xmin, ymin, xmax, ymax = bbox
+        row_range = range(math.floor(ymin / self.cell_deg), math.floor(ymax / self.cell_deg) + 1)
+        col_range = range(math.floor(xmin / self.cell_deg), math.floor(xmax / self.cell_deg) + 1)
+
+        # Scan whichever is smaller: the overlapping cells or the occupied cells
+        if len(row_range) * len(col_range) > len(self.cells):
+            groups = [g for (r, c), g in self.cells.items() if r in row_range and c in col_range]
+        else:
+            groups = [self.cells[(r, c)] for r in row_range for c in col_range if (r, c) in self.cells]
+
+        if not groups:
+            return np.empty(0, dtype=np.int64)
+        return np.sort(np.concatenate(groups))
+
+    def positions_within(self, lat, lon, radius_miles):
+        """
+        Positions (in the indexed records or arrays) of the points within
+        radius_miles of (lat, lon), in ascending order.
+        """
+        offsets = self._candidates(bbox_around(lat, lon, radius_miles))
+        if len(offsets):
+            distances = haversine_miles(lat, lon, self.lats[offsets], self.lons[offsets])
+            offsets = offsets[distances <= radius_miles]
+        return self.positions[offsets]
+
+    def query_radius(self, lat, lon, radius_miles):
+        """
+        Returns records within radius_miles of (lat, lon), in their original order.
+        """
+        return [self.records[i] for i in self.positions_within(lat, lon, radius_miles)]
+
+    def query_bbox(self, bbox):
+        """
+        Returns records inside a (xmin, ymin, xmax, ymax) box, in their original order.
+        """
+        offsets = self._candidates(bbox)
+        if len(offsets):
+            xmin, ymin, xmax, ymax = bbox
+            lats = self.lats[offsets]
+            lons = self.lons[offsets]
+            offsets = offsets[(lons >= xmin) & (lons <= xmax) & (lats >= ymin) & (lats <= ymax)]
+        return [self.records[i] for i in self.positions[offsets]]
+
+def filter_by_radius(records, lat, lon, radius_miles):
+    """
+    One-off radius filter; build a SpatialIndex directly to reuse it across queries.
+    """
+    return SpatialIndex(records).query_radius(lat, lon, radius_miles)
+
+def _has_coords(record):
+    lat = record.get('lat')
+    lon = record.get('lon')
+    if lat is None or lon is None:
+        return False
+    try:
+        return not (math.isnan(float(lat)) or math.isnan(float(lon)))
+    except (TypeError, ValueError):
+        return False
@@ -0,0 +1,221 @@
+import os
+import math
+import shutil
+import logging
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from lxml import etree
+from src import features, profiling
+from src.data_fetchers import fetch_all_data, DEFAULT_MAX_WORKERS, STATE_BBOXES
+from src.geometry import DEFAULT_RING_RADII_MILES
+from src.kml_generator import DEFAULT_PRECISION, style_specs
+from src.kml_stream import KML_NS, region_element, style_element, write_folders
+
+# Most features drawn by one tile; the rest move down to its four children
+DEFAULT_TILE_FEATURES = 1000
+
+# Deepest quadtree level; tiles there keep everything left in their cell
+MAX_LEVEL = 12
+
+# Layers picked first when a tile cannot hold everything in its cell
+LAYER_PRIORITY = ('sites', 'mines', 'hazardous_minerals', 'inactive_mines', 'towers')
+
+# Screen pixels a tile's Region must cover before Google Earth loads it.
+# Tiles stay loaded when zoomed further in (maxLodPixels -1), so the view
+# shows every level down to the deepest one in range.
+TILE_MIN_LOD_PIXELS = 256
+
+ROOT_FILE = 'doc.kml'
+TILES_DIR = 'tiles'
+
+def build_superoverlay(states=None, output_dir='output', tile_features=DEFAULT_TILE_FEATURES,
+                       precision=DEFAULT_PRECISION, ring_radii=DEFAULT_RING_RADII_MILES, ring_vertices=None,
+                       max_workers=DEFAULT_MAX_WORKERS, render_workers=None):
+    """
+    Writes a KML super-overlay of the statewide layers of states (default:
+    all supported states) under output_dir/superoverlay: a root doc.kml with
+    one NetworkLink per state, and per state a quadtree of tile files
+    (see plan_tiles), each linking to its children behind Regions so that
+    Google Earth only loads the tiles in view at the current zoom. Tiles are
+    rendered in parallel on up to render_workers processes.
+    Returns (root file path, whether every tile was written).
+    """
+    root_dir = os.path.join(output_dir, 'superoverlay')
+    render_kwargs = {'precision': precision, 'ring_radii': ring_radii, 'ring_vertices': ring_vertices}
+    states = [state.upper() for state in states or list(STATE_BBOXES)]
+
+    roots = []
+    success = True
+    with ProcessPoolExecutor(max_workers=render_workers) as executor:
+        futures = []
+        for state in states:
+            logging.info(f"Fetching statewide layers for the {state} super-overlay...")
+            table = fetch_all_data(None, False, state, max_workers=max_workers, as_table=True)
+            with profiling.stage('plan_tiles', state=state, features=len(table)) as record:
+                tiles = plan_tiles(table, STATE_BBOXES[state], tile_features)
+                record['tiles'] = len(tiles)
+            logging.info(f"Rendering {len(tiles)} {state} tiles...")
+
+            # Tiles of an earlier run with a different layout would linger otherwise
+            tile_dir = os.path.join(root_dir, TILES_DIR, state)
+            shutil.rmtree(tile_dir, ignore_errors=True)
+            os.makedirs(tile_dir)
+            for tile in tiles:
+                path = os.path.join(tile_dir, tile_name(tile['key']))
+                futures.append((path, executor.submit(_write_tile_in_worker, path, tile, table.iloc[tile['rows']],
+                                                      state, render_kwargs, profiling.enabled())))
+            roots.append((state, tiles[0]))
+
+        for path, future in futures:
+            try:
+                profiling.merge(future.result())
+            except Exception as e:
+                logging.error(f"Error rendering {path}: {e}")
+                success = False
+
+    root_path = os.path.join(root_dir, ROOT_FILE)
+    write_root(root_path, roots)
+    logging.info(f"Wrote the super-overlay for {', '.join(states)} to {root_path}")
+    return root_path, success
+
+def plan_tiles(table, bbox, tile_features=DEFAULT_TILE_FEATURES, max_level=MAX_LEVEL):
+    """
+    Partitions the rows of a feature table with coordinates into a quadtree
+    over bbox (xmin, ymin, xmax, ymax), grown to cover every feature.
+
+    Each tile keeps at most tile_features rows of its cell, spread over the
+    cell and in LAYER_PRIORITY order (see _sample); the remaining rows move down to the
+    child quadrant holding them. Every row ends up in exactly one tile.
+    Returns tiles in breadth-first order (the level-0 tile first), each
+    {'key': (level, x, y), 'bbox', 'rows': table positions, 'children': [child tiles' key and bbox]}.
+    """
+    lats = table['lat'].to_numpy(dtype=np.float64)
+    lons = table['lon'].to_numpy(dtype=np.float64)
+    located = np.flatnonzero(~(np.isnan(lats) | np.isnan(lons)))
+    if len(located):
+        bbox = (min(bbox[0], lons[located].min()), min(bbox[1], lats[located].min()),
+                max(bbox[2], lons[located].max()), max(bbox[3], lats[located].max()))
+
+    # Rows in priority order; sampling keeps the first row per grid cell
+    priority = {layer: i for i, layer in enumerate(LAYER_PRIORITY)}
+    ranks = table['layer'].map(priority).to_numpy(dtype=np.int64)
+    located = located[np.argsort(ranks[located], kind='stable')]
+
+    tiles = []
+    pending = [((0, 0, 0), bbox, located)]
+    while pending:
+        key, cell, rows = pending.pop(0)
+        level, x, y = key
+        tile = {'key': key, 'bbox': cell, 'children': []}
+        tiles.append(tile)
+
+        if len(rows) <= tile_features or level >= max_level:
+            tile['rows'] = np.sort(rows)
+            continue
+
+        sampled = _sample(lons[rows], lats[rows], cell, tile_features)
+        tile['rows'] = np.sort(rows[sampled])
+        moved = np.ones(len(rows), dtype=bool)
+        moved[sampled] = False
+        rest = rows[moved]
+
+        xmin, ymin, xmax, ymax = cell
+        xmid, ymid = (xmin + xmax) / 2, (ymin + ymax) / 2
+        east = lons[rest] >= xmid
+        north = lats[rest] >= ymid
+        for dx, dy, mask in ((0, 1, ~east & north), (1, 1, east & north), (0, 0, ~east & ~north), (1, 0, east & ~north)):
+            if not mask.any():
+                continue
+            child_key = (level + 1, 2 * x + dx, 2 * y + dy)
+            child_cell = (xmid if dx else xmin, ymid if dy else ymin, xmax if dx else xmid, ymax if dy else ymid)
+            tile['children'].append({'key': child_key, 'bbox': child_cell})
+            pending.append((child_key, child_cell, rest[mask]))
+    return tiles
+
+def tile_name(key):
+    """
+    File name of the tile at key (level, x, y).
+    """
+    return f"{key[0]}_{key[1]}_{key[2]}.kml"
+
+def write_tile(path, tile, table, state, render_kwargs):
+    """
+    Writes one tile: its features (shared styles and the standard folders)
+    behind a Region of its cell, then a NetworkLink per child tile.
+    """
+    with profiling.stage('tile', state=state, key=tile['key'], features=len(table)):
+        layers = features.to_layers(table)
+        with etree.xmlfile(path, encoding='utf-8') as xf:
+            xf.write_declaration()
+            with xf.element('kml', xmlns=KML_NS):
+                with xf.element('Document'):
+                    _text_element(xf, 'name', f"{state} tile {tile_name(tile['key'])[:-4]}")
+                    xf.write(region_element(tile['bbox'], 0 if tile['key'][0] == 0 else TILE_MIN_LOD_PIXELS))
+                    for key, spec in style_specs().items():
+                        xf.write(style_element(key, spec))
+                    write_folders(xf, *layers, render_kwargs['precision'], ring_radii=render_kwargs['ring_radii'],
+                                  ring_vertices=render_kwargs['ring_vertices'])
+                    for child in tile['children']:
+                        xf.write(network_link(tile_name(child['key']), child['bbox'], TILE_MIN_LOD_PIXELS))
+    return path
+
+def _write_tile_in_worker(path, tile, table, state, render_kwargs, profile):
+    """
+    write_tile in a worker process. Returns the profiling records made in
+    the worker, for the parent to merge into its report.
+    """
+    profiling.configure(enabled=profile)
+    profiling.reset()
+    write_tile(path, tile, table, state, render_kwargs)
+    return profiling.snapshot() if profile else None
+
+def write_root(path, roots):
+    """
+    Writes the root document: a NetworkLink to each state's level-0 tile.
+    roots is [(state, level-0 tile)].
+    """
+    with etree.xmlfile(path, encoding='utf-8') as xf:
+        xf.write_declaration()
+        with xf.element('kml', xmlns=KML_NS):
+            with xf.element('Document'):
+                _text_element(xf, 'name', "ToxMap super-overlay")
+                for state, tile in roots:
+                    href = f"{TILES_DIR}/{state}/{tile_name(tile['key'])}"
+                    xf.write(network_link(href, tile['bbox'], 0, name=state))
+
+def network_link(href, bbox, min_lod_pixels, name=None):
+    """
+    A <NetworkLink> that loads href once the Region of bbox covers
+    min_lod_pixels on screen.
+    """
+    link = etree.Element('NetworkLink')
+    if name:
+        etree.SubElement(link, 'name').text = name
+    link.append(region_element(bbox, min_lod_pixels))
+    target = etree.SubElement(link, 'Link')
+    etree.SubElement(target, 'href').text = href
+    etree.SubElement(target, 'viewRefreshMode').text = 'onRegion'
+    return link
+
+def _sample(lons, lats, cell, count):
+    """
+    Offsets of count points spread over cell: the first point (in input
+    order) in each cell of a ceil(sqrt(count)) square grid over it, topped
+    up with the next points in input order when fewer cells are occupied.
+    """
+    grid = math.ceil(math.sqrt(count))
+    xmin, ymin, xmax, ymax = cell
+    cols = np.clip(((lons - xmin) / max(xmax - xmin, 1e-12) * grid).astype(np.int64), 0, grid - 1)
+    rows = np.clip(((lats - ymin) / max(ymax - ymin, 1e-12) * grid).astype(np.int64), 0, grid - 1)
+    _, first = np.unique(rows * grid + cols, return_index=True)
+    first = np.sort(first)[:count]
+    if len(first) < count:
+        rest = np.ones(len(lons), dtype=bool)
+        rest[first] = False
+        first = np.concatenate([first, np.flatnonzero(rest)[:count - len(first)]])
+    return first
+
+def _text_element(xf, tag, text):
+    element = etree.Element(tag)
+    element.text = text
+    xf.write(element)
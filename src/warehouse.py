@@ -0,0 +1,218 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from src.spatial import DEFAULT_RADIUS_MILES, ID_DEQ_LANDFILL_OFFSET_DEG, bbox_around
+
+# Warehouse location can be overridden with the TOXMAP_WAREHOUSE environment variable
+DEFAULT_WAREHOUSE_PATH = os.environ.get('TOXMAP_WAREHOUSE', os.path.join(os.path.expanduser('~'), '.cache', 'toxmap', 'warehouse.sqlite'))
+
+# A synced state is used by fetch_all_data for this long (seconds)
+DEFAULT_MAX_AGE = 7 * 24 * 60 * 60
+
+# Layers in the order fetch_all_data returns them
+LAYERS = ('sites', 'towers', 'mines', 'inactive_mines', 'hazardous_minerals')
+
+_settings = {
+    'enabled': True,
+    'path': DEFAULT_WAREHOUSE_PATH,
+    'max_age': DEFAULT_MAX_AGE
+}
+
+# Database files whose schema was created by this process
+_schema_ready = set()
+_schema_lock = threading.Lock()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS features (
+    id INTEGER PRIMARY KEY,
+    state TEXT NOT NULL,
+    layer TEXT NOT NULL,
+    source TEXT,
+    county TEXT,
+    zip TEXT,
+    record TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS features_county ON features (state, layer, county);
+CREATE INDEX IF NOT EXISTS features_zip ON features (state, layer, zip);
+CREATE INDEX IF NOT EXISTS features_source ON features (state, layer, source);
+CREATE VIRTUAL TABLE IF NOT EXISTS features_rtree USING rtree (id, min_x, max_x, min_y, max_y);
+CREATE TABLE IF NOT EXISTS synced_states (
+    state TEXT PRIMARY KEY,
+    synced_at REAL NOT NULL,
+    counts TEXT
+);
+"""
+
+def configure(enabled=None, path=None, max_age=None):
+    """
+    Enables/disables warehouse lookups, moves the database or changes how
+    long a sync stays fresh.
+    """
+    if enabled is not None:
+        _settings['enabled'] = enabled
+    if path is not None:
+        _settings['path'] = path
+    if max_age is not None:
+        _settings['max_age'] = max_age
+
+def connect(path=None):
+    """
+    Opens the warehouse, creating the schema the first time this process
+    opens path (or again if the file has since been removed).
+    """
+    path = os.path.abspath(path or _settings['path'])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with _schema_lock:
+        exists = os.path.exists(path)
+        conn = sqlite3.connect(path)
+        if path not in _schema_ready or not exists:
+            conn.executescript(SCHEMA)
+            _schema_ready.add(path)
+    return conn
+
+def store_state(state, data, path=None):
+    """
+    Replaces everything stored for a state with data, the statewide 5-tuple
+    returned by fetch_all_data(None, False, state). Done in one transaction,
+    so readers see either the old or the new snapshot.
+    """
+    conn = connect(path)
+    try:
+        with conn:
+            conn.execute("DELETE FROM features_rtree WHERE id IN (SELECT id FROM features WHERE state = ?)", (state,))
+            conn.execute("DELETE FROM features WHERE state = ?", (state,))
+            for layer, records in zip(LAYERS, data):
+                for record in records:
+                    cursor = conn.execute(
+                        "INSERT INTO features (state, layer, source, county, zip, record) VALUES (?, ?, ?, ?, ?, ?)",
+                        (state, layer, record.get('source'), str(record.get('county') or '').upper(),
+                         str(record.get('zip') or ''), json.dumps(record)))
+                    extent = _record_extent(record)
+                    if extent:
+                        conn.execute("INSERT INTO features_rtree VALUES (?, ?, ?, ?, ?)",
+                                     (cursor.lastrowid, extent[0], extent[2], extent[1], extent[3]))
+            counts = {layer: len(records) for layer, records in zip(LAYERS, data)}
+            conn.execute("INSERT OR REPLACE INTO synced_states VALUES (?, ?, ?)", (state, time.time(), json.dumps(counts)))
+    finally:
+        conn.close()
+    logging.info(f"Stored {sum(counts.values())} {state} features in the warehouse.")
+    return counts
+
+def is_synced(state, path=None):
+    """
+    True if warehouse lookups are enabled and state was synced within max_age.
+    """
+    path = path or _settings['path']
+    if not _settings['enabled'] or not os.path.exists(path):
+        return False
+    conn = connect(path)
+    try:
+        row = conn.execute("SELECT synced_at FROM synced_states WHERE state = ?", (state,)).fetchone()
+    finally:
+        conn.close()
+    return bool(row) and time.time() - row[0] < _settings['max_age']
+
+def load_search(search_term, is_zip=True, state='WA', lat=None, lon=None, radius_miles=DEFAULT_RADIUS_MILES,
+                path=None):
+    """
+    Answers a search from the warehouse in fetch_all_data's 5-tuple form:
+    county/zip predicates run on the attribute indexes and envelopes on the
+    R*Tree. filter_query gives the same result as for the live sources.
+    search_term=None returns the whole state.
+    """
+    conn = connect(path)
+    try:
+        if search_term is None:
+            return tuple(_select(conn, state, layer) for layer in LAYERS)
+
+        term = search_term.upper()
+        county_like = f"%{term}%"
+        if is_zip:
+            bbox = bbox_around(lat, lon, radius_miles) if lat and lon else None
+        else:
+            bbox = _county_extent(conn, state, county_like, radius_miles)
+
+        # Toxic sites mirror the server-side filters of their fetchers. TRI is
+        # fetched statewide, so only the facilities filter_query can keep (zip
+        # prefix, within the radius, or in the county) are loaded.
+        if is_zip:
+            tri = _in_bbox(bbox) if bbox else ("0 = 1", ())
+            landfills = ("1 = 1", ())
+            if lat and lon:
+                landfills = _in_bbox((lon - ID_DEQ_LANDFILL_OFFSET_DEG, lat - ID_DEQ_LANDFILL_OFFSET_DEG,
+                                      lon + ID_DEQ_LANDFILL_OFFSET_DEG, lat + ID_DEQ_LANDFILL_OFFSET_DEG))
+            site_filter = (f"((source = 'EPA TRI' AND (zip LIKE ? OR {tri[0]})) OR (source = 'WA Ecology' AND zip LIKE ?) OR "
+                           f"(source = 'ID DEQ PCI' AND zip LIKE ?) OR (source = 'ID DEQ Landfill' AND {landfills[0]}))",
+                           (f"{search_term}%", *tri[1], f"%{search_term}%", f"{search_term}%", *landfills[1]))
+        else:
+            site_filter = ("county LIKE ?", (county_like,))
+        sites = _select(conn, state, 'sites', *site_filter)
+
+        towers = _select(conn, state, 'towers', *(_in_bbox(bbox) if bbox else ("1 = 1", ())))
+
+        if not is_zip and state == 'WA':
+            mines = _select(conn, state, 'mines', "county LIKE ?", (county_like,))
+            inactive_mines = _select(conn, state, 'inactive_mines', "county LIKE ?", (county_like,))
+            # Layers without a COUNTY field are matched on the county's extent
+            no_county = _in_bbox(bbox) if bbox else ("0 = 1", ())
+            hazardous_minerals = _select(conn, state, 'hazardous_minerals',
+                                         f"(county LIKE ? OR (county = '' AND {no_county[0]}))",
+                                         (county_like, *no_county[1]))
+        else:
+            spatial = _in_bbox(bbox) if bbox and (is_zip or state == 'WA') else ("1 = 1", ())
+            mines = _select(conn, state, 'mines', *spatial)
+            inactive_mines = _select(conn, state, 'inactive_mines', *spatial)
+            hazardous_minerals = _select(conn, state, 'hazardous_minerals', *spatial)
+    finally:
+        conn.close()
+
+    logging.info(f"Loaded {len(sites)} sites, {len(towers)} towers, {len(mines) + len(inactive_mines)} mines and "
+                 f"{len(hazardous_minerals)} hazardous minerals for {search_term} from the warehouse.")
+    return sites, towers, mines, inactive_mines, hazardous_minerals
+
+def _select(conn, state, layer, where="1 = 1", params=()):
+    rows = conn.execute(f"SELECT record FROM features WHERE state = ? AND layer = ? AND {where} ORDER BY id",
+                        (state, layer, *params))
+    return [json.loads(row[0]) for row in rows]
+
+def _in_bbox(bbox):
+    """
+    SQL predicate (and params) matching features whose extent intersects bbox.
+    """
+    xmin, ymin, xmax, ymax = bbox
+    return ("id IN (SELECT id FROM features_rtree WHERE min_x <= ? AND max_x >= ? AND min_y <= ? AND max_y >= ?)",
+            (xmax, xmin, ymax, ymin))
+
+def _county_extent(conn, state, county_like, radius_miles):
+    """
+    Extent of the county's stored features, padded by radius_miles, or None.
+    """
+    row = conn.execute(
+        "SELECT MIN(r.min_x), MIN(r.min_y), MAX(r.max_x), MAX(r.max_y) FROM features f "
+        "JOIN features_rtree r ON r.id = f.id WHERE f.state = ? AND f.county LIKE ?",
+        (state, county_like)).fetchone()
+    if not row or row[0] is None:
+        return None
+    lower = bbox_around(row[1], row[0], radius_miles)
+    upper = bbox_around(row[3], row[2], radius_miles)
+    return (lower[0], lower[1], upper[2], upper[3])
+
+def _record_extent(record):
+    """
+    (xmin, ymin, xmax, ymax) of a point or polygon record, or None without coordinates.
+    """
+    if record.get('rings'):
+        points = [p for ring in record['rings'] for p in ring]
+        return (min(p[0] for p in points), min(p[1] for p in points),
+                max(p[0] for p in points), max(p[1] for p in points))
+    try:
+        lat = float(record['lat'])
+        lon = float(record['lon'])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if lat != lat or lon != lon:
+        return None
+    return (lon, lat, lon, lat)
@@ -0,0 +1,216 @@
+import io
+import os
+import csv
+import zipfile
+import logging
+import threading
+import numpy as np
+from src.http_cache import cached_get, cached_stream, DAY
+from src.spatial import haversine_miles
+
+# Bundled table (written by build_zip_table, meant to ship with the package)
+BUNDLED_TABLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'zip_table.csv')
+
+# Zips resolved over the network are remembered here
+LEARNED_TABLE_PATH = os.environ.get('TOXMAP_ZIP_TABLE', os.path.join(os.path.expanduser('~'), '.cache', 'toxmap', 'zip_learned.csv'))
+
+COLUMNS = ['zip', 'state', 'county', 'city', 'lat', 'lon']
+
+# Census 2020 ZCTA centroids and ZCTA-to-county relationship file
+GAZETTEER_URL = "https://www2.census.gov/geo/docs/maps-data/data/gazetteer/2020_Gazetteer/2020_Gaz_zcta_national.zip"
+ZCTA_COUNTY_URL = "https://www2.census.gov/geo/docs/maps-data/data/rel2020/zcta520/tab20_zcta520_county20_natl.txt"
+
+# Census files change once a decade
+CENSUS_TTL = 365 * DAY
+
+# USPS city names, and the zips that have no ZCTA (PO boxes, single-building
+# zips), come from the dataset bundled with the zipcodes package
+USPS_PACKAGE = 'zipcodes'
+
+_table = None
+_lock = threading.Lock()
+
+def lookup(zipcode):
+    """
+    Returns {'zip', 'state', 'county', 'city', 'lat', 'lon'} for a zip, or None.
+    county/city are None when unknown. The table is loaded on first use.
+    """
+    entry = _load().get(str(zipcode).strip()[:5])
+    return dict(entry) if entry else None
+
+def remember(zipcode, **fields):
+    """
+    Merges fields learned from a network lookup into the table and appends
+    the entry to the learned table so later runs resolve it offline.
+    """
+    zipcode = str(zipcode).strip()[:5]
+    table = _load()
+    with _lock:
+        entry = dict(table.get(zipcode) or {'zip': zipcode})
+        updates = {k: v for k, v in fields.items() if k in COLUMNS and v not in (None, '')}
+        if all(entry.get(k) == v for k, v in updates.items()):
+            return
+        entry.update(updates)
+        table[zipcode] = entry
+        try:
+            _append(LEARNED_TABLE_PATH, entry)
+        except OSError as e:
+            logging.warning(f"Could not save zip {zipcode} to {LEARNED_TABLE_PATH}: {e}")
+
+def build_zip_table(states, output_path=BUNDLED_TABLE_PATH):
+    """
+    Builds the zip table for states, a dict of state abbreviation -> FIPS
+    code (e.g. STATE_FIPS). Zips with a Census ZCTA get its internal point
+    for lat/lon and the county holding most of its land area; every zip gets
+    its USPS city name, and zips without a ZCTA their USPS county and
+    centroid (see USPS_PACKAGE). If the Census files cannot be downloaded,
+    the table is built from the USPS data alone. Zips left without a county
+    take the county of the nearest zip in their state (see _fill_counties).
+    Returns the number of zips written.
+    """
+    table = _usps_zips(states)
+    try:
+        census = _census_zips(states)
+    except Exception as e:
+        logging.warning(f"Census files unavailable ({e}); using USPS centroids and counties only")
+        census = {}
+    for zipcode, entry in census.items():
+        entry['city'] = (table.get(zipcode) or {}).get('city', '')
+        table[zipcode] = entry
+    entries = list(table.values())
+    _fill_counties(entries)
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS)
+        writer.writeheader()
+        writer.writerows(sorted(entries, key=lambda e: e['zip']))
+    os.replace(tmp_path, output_path)
+
+    global _table
+    _table = None
+    logging.info(f"Wrote {len(entries)} zips ({len(census)} with Census centroids) to {output_path}")
+    return len(entries)
+
+def _census_zips(states):
+    """
+    {zip: entry} from the Census ZCTA files for states (abbreviation -> FIPS).
+    """
+    from_fips = {fips: state for state, fips in states.items()}
+
+    counties = {}
+    with cached_stream(ZCTA_COUNTY_URL, ttl=CENSUS_TTL, timeout=120) as f:
+        reader = csv.DictReader(io.TextIOWrapper(f, encoding='utf-8-sig'), delimiter='|')
+        for row in reader:
+            zcta = row.get('GEOID_ZCTA5_20')
+            county_geoid = row.get('GEOID_COUNTY_20') or ''
+            state = from_fips.get(county_geoid[:2])
+            if not zcta or not state:
+                continue
+            area = int(row.get('AREALAND_PART') or 0)
+            if zcta not in counties or area > counties[zcta][2]:
+                name = (row.get('NAMELSAD_COUNTY_20') or '').replace(' County', '')
+                counties[zcta] = (state, name, area)
+
+    response = cached_get(GAZETTEER_URL, ttl=CENSUS_TTL, timeout=120)
+    response.raise_for_status()
+    entries = {}
+    with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+        with archive.open(archive.namelist()[0]) as f:
+            reader = csv.reader(io.TextIOWrapper(f, encoding='utf-8'), delimiter='\t')
+            header = [h.strip() for h in next(reader)]
+            for values in reader:
+                row = dict(zip(header, (v.strip() for v in values)))
+                if row.get('GEOID') not in counties:
+                    continue
+                state, county, _ = counties[row['GEOID']]
+                entries[row['GEOID']] = {'zip': row['GEOID'], 'state': state, 'county': county, 'city': '',
+                                         'lat': row['INTPTLAT'], 'lon': row['INTPTLONG']}
+    return entries
+
+def _fill_counties(entries):
+    """
+    Gives entries without a county the county of the nearest entry (by
+    centroid) in the same state that has one, and reports which were filled.
+    Entries without a centroid are left as they are and reported too.
+    """
+    missing = [e for e in entries if not e['county']]
+    if not missing:
+        return
+    filled, unplaced = [], []
+    for entry in missing:
+        known = [e for e in entries if e['state'] == entry['state'] and e['county'] and e['lat'] != '' and e['lon'] != '']
+        if entry['lat'] == '' or entry['lon'] == '' or not known:
+            unplaced.append(entry['zip'])
+            continue
+        distances = haversine_miles(float(entry['lat']), float(entry['lon']),
+                                    np.array([float(e['lat']) for e in known]), np.array([float(e['lon']) for e in known]))
+        entry['county'] = known[int(np.argmin(distances))]['county']
+        filled.append(f"{entry['zip']} ({entry['county']})")
+    if filled:
+        logging.warning(f"No county for {len(filled)} zips; used the nearest zip's: {', '.join(filled)}")
+    if unplaced:
+        logging.warning(f"No county or centroid for zips {', '.join(unplaced)}")
+
+def _usps_zips(states):
+    """
+    {zip: entry} from the USPS_PACKAGE dataset for states.
+    """
+    try:
+        import zipcodes
+    except ImportError:
+        raise ImportError(f"build-zips needs the {USPS_PACKAGE} package (pip install {USPS_PACKAGE})")
+    entries = {}
+    for state in states:
+        for row in zipcodes.filter_by(state=state):
+            county = row.get('county') or ''
+            if county.endswith(' County'):
+                county = county[:-len(' County')]
+            entries[row['zip_code']] = {'zip': row['zip_code'], 'state': state, 'county': county,
+                                        'city': row.get('city') or '', 'lat': row.get('lat') or '',
+                                        'lon': row.get('long') or ''}
+    return entries
+
+def _load():
+    global _table
+    if _table is None:
+        with _lock:
+            if _table is None:
+                table = {}
+                # Learned entries refine the bundled ones
+                for path in (BUNDLED_TABLE_PATH, LEARNED_TABLE_PATH):
+                    for entry in _read(path):
+                        table.setdefault(entry['zip'], {}).update({k: v for k, v in entry.items() if v is not None})
+                _table = table
+    return _table
+
+def _read(path):
+    if not os.path.exists(path):
+        return []
+    entries = []
+    try:
+        with open(path, 'r', newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                if not row.get('zip'):
+                    continue
+                entries.append({
+                    'zip': row['zip'],
+                    'state': row.get('state') or None,
+                    'county': row.get('county') or None,
+                    'city': row.get('city') or None,
+                    'lat': float(row['lat']) if row.get('lat') else None,
+                    'lon': float(row['lon']) if row.get('lon') else None
+                })
+    except (OSError, ValueError) as e:
+        logging.warning(f"Could not read zip table {path}: {e}")
+    return entries
+
+def _append(path, entry):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    new_file = not os.path.exists(path)
+    with open(path, 'a', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS)
+        if new_file:
+            writer.writeheader()
+        writer.writerow({k: '' if entry.get(k) is None else entry[k] for k in COLUMNS})
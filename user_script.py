@@ -1,42 +1,15 @@
 import simplekml
 import json
-import math
 import urllib.request
 from urllib.parse import quote
 from math import sin, cos, sqrt, atan2
 from simplekml import Types
+from src.geometry import buffer_rings
 
 def generate_circle(kml, lat_deg, lon_deg, radius_km, siteRank):
-    scaled_radius_km = radius_km
-    # Mean Earth radius (needed for calculation).
-    earth_radius_km = 6371
-    earth_radius_m = earth_radius_km * 1000
-    # Distance is entered in km, convert to meters.
-    radius_m = scaled_radius_km * 1000
-    angular_distance = radius_m/earth_radius_m
-    # Convert coordinates from degrees to radians.
-    lat_rad = math.radians(lat_deg)
-    lon_rad = math.radians(lon_deg)
-    # Create a list of angles at which to create points (how many points will the circle consist of).
-    numPoints = range(0, 360, 10)
-    angles = []
-    for x in numPoints:
-        angles.append(float(x))
-    angles.append(float(0))
-    
-    tuppleLatLongsInner = []
-    # Calculate and file.write out the list of coordinates.
-    for angle in angles:
-        # Convert bearing to radians and calculates new lat/lon values
-        bearing = math.radians(angle)
-        new_lat = math.asin(math.sin(lat_rad) * math.cos(angular_distance) + math.cos(lat_rad) * math.sin(angular_distance) * math.cos(bearing))
-        new_lon = lon_rad + math.atan2(math.sin(bearing) * math.sin(angular_distance) * math.cos(lat_rad), math.cos(angular_distance) - math.sin(lat_rad) * math.sin(new_lat))
-        # Convert new lat and lon to degrees
-        new_lat_deg = math.degrees(new_lat)
-        new_lon_deg = math.degrees(new_lon)
-        # Print them out
-        tuppleLatLongsInner.append((new_lon_deg, new_lat_deg))
-        
+    # Ring of 36 segments, built by the shared geometry kernel
+    tuppleLatLongsInner = [tuple(c) for c in buffer_rings([lat_deg], [lon_deg], radius_km * 1000, vertices=36)[0].tolist()]
+
     pol = kml.newlinestring(name="Risk zone", coords=tuppleLatLongsInner)
     pol.extrude = 1
     pol.altitudemode = simplekml.AltitudeMode.relativetoground